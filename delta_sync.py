@@ -0,0 +1,86 @@
+"""Bring a local copy of a portal file up to date, fetching only changed blocks.
+
+Usage:
+    python delta_sync.py <server> <username> <remote path> <local file> [--block-size N]
+
+The password is read from the PORTAL_PASSWORD environment variable or
+prompted for. Only the standard library is needed on the vessel side.
+"""
+import os
+import sys
+import shutil
+import getpass
+import argparse
+
+from filemanager.client import PortalClient, PortalError, quote_path
+from filemanager.delta import match_blocks, reconstruct
+
+# Must not exceed DELTA_MAX_BLOCKS_PER_REQUEST on the server
+BLOCKS_PER_REQUEST = 1024
+
+def fetch_blocks(client, remote_path, signature, indices):
+    """Yield the bytes of the missing blocks in ascending order, a batch per request"""
+    for start in range(0, len(indices), BLOCKS_PER_REQUEST):
+        batch = indices[start:start + BLOCKS_PER_REQUEST]
+        payload = {
+            'block_size': signature['block_size'],
+            'indices': batch,
+            'etag': signature['etag'],
+        }
+        with client.post_json(f'delta/blocks/{quote_path(remote_path)}/', payload) as response:
+            while True:
+                data = response.read(64 * 1024)
+                if not data:
+                    break
+                yield data
+
+def full_download(client, remote_path, tmp_path):
+    with client.open(f'download/{quote_path(remote_path)}/') as response, open(tmp_path, 'wb') as out:
+        shutil.copyfileobj(response, out, 64 * 1024)
+    return os.path.getsize(tmp_path)
+
+def sync(client, remote_path, local_path, block_size=None):
+    params = {'block_size': block_size} if block_size else None
+    signature = client.get_json(f'delta/signature/{quote_path(remote_path)}/', params)
+    tmp_path = f'{local_path}.delta-tmp'
+
+    try:
+        if os.path.exists(local_path):
+            found = match_blocks(local_path, signature)
+            fetched = reconstruct(
+                local_path,
+                signature,
+                found,
+                lambda indices: fetch_blocks(client, remote_path, signature, indices),
+                tmp_path
+            )
+            print(f"Reused {len(found)} of {len(signature['blocks'])} blocks")
+        else:
+            fetched = full_download(client, remote_path, tmp_path)
+        os.replace(tmp_path, local_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    print(f"Fetched {fetched} of {signature['size']} bytes")
+    return fetched
+
+def main():
+    parser = argparse.ArgumentParser(description='Delta-sync a file from the portal')
+    parser.add_argument('server')
+    parser.add_argument('username')
+    parser.add_argument('remote_path')
+    parser.add_argument('local_path')
+    parser.add_argument('--block-size', type=int, default=None)
+    args = parser.parse_args()
+
+    password = os.environ.get('PORTAL_PASSWORD') or getpass.getpass()
+    try:
+        client = PortalClient(args.server, args.username, password)
+        sync(client, args.remote_path, args.local_path, args.block_size)
+    except (PortalError, IOError) as e:
+        print(f"Sync failed: {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
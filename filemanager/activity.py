@@ -0,0 +1,337 @@
+import os
+import glob
+import json
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+from .models import ActivityRollup, FileActivity
+
+RECORD_FIELDS = ['user_id', 'filename', 'filepath', 'activity_type', 'ip_address', 'file_size']
+
+def build_activity(record):
+    return FileActivity(
+        timestamp=datetime.fromisoformat(record['timestamp']),
+        **{field: record.get(field) for field in RECORD_FIELDS}
+    )
+
+def save_activities(records):
+    """Insert activity records in one transaction, skipping rows that can never be saved"""
+    try:
+        with transaction.atomic():
+            FileActivity.objects.bulk_create([build_activity(record) for record in records])
+    except IntegrityError:
+        # Typically a user deleted while the record was queued
+        for record in records:
+            try:
+                with transaction.atomic():
+                    build_activity(record).save()
+            except IntegrityError as e:
+                print(f"Dropping activity record {record}: {e}")
+
+def pid_is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class ActivitySpool:
+    """Append-only journal of queued records, so a crash does not lose them.
+
+    Every record gets a sequence number; after each flush the highest
+    written number is checkpointed, and replay skips everything up to it.
+    Numbers keep growing for the life of the process, and the journal is
+    only truncated once the last record appended has been written.
+    """
+
+    def __init__(self, spool_dir):
+        os.makedirs(spool_dir, exist_ok=True)
+        self.spool_dir = spool_dir
+        self.path = os.path.join(spool_dir, f'activity-{os.getpid()}.jsonl')
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.committed = 0
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def append(self, record):
+        with self.lock:
+            self.seq += 1
+            record['seq'] = self.seq
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+
+    def checkpoint(self, seq):
+        with self.lock:
+            self.committed = max(self.committed, seq)
+            if self.committed == self.seq:
+                # Everything appended is in the database, start a fresh journal
+                self.file.truncate(0)
+            write_checkpoint(self.path, self.committed)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def recover(self):
+        """Replay journals left behind by processes that are no longer running.
+
+        A dead process's journal is first renamed to a name carrying our
+        pid, so when several workers start together only one replays it.
+        """
+        recovered = 0
+        paths = glob.glob(os.path.join(self.spool_dir, 'activity-*.jsonl'))
+        paths += glob.glob(os.path.join(self.spool_dir, 'activity-*.jsonl.claimed-*[0-9]'))
+        for path in paths:
+            owner = journal_owner(path)
+            if owner is None or (owner != os.getpid() and pid_is_running(owner)):
+                continue
+
+            if path != self.path:
+                path = claim_journal(path)
+                if path is None:
+                    # Another process got there first
+                    continue
+
+            records = read_journal(path)
+            if records:
+                save_activities(records)
+                recovered += len(records)
+            if path == self.path:
+                self.file.truncate(0)
+                write_checkpoint(path, 0)
+            else:
+                os.remove(path)
+                remove_checkpoint(path)
+        return recovered
+
+def journal_owner(path):
+    """Pid of the process a journal belongs to, or None for a name we did not write"""
+    name = os.path.basename(path)
+    if '.claimed-' in name:
+        pid = name.rsplit('.claimed-', 1)[1]
+    else:
+        pid = name[len('activity-'):-len('.jsonl')]
+    try:
+        return int(pid)
+    except ValueError:
+        return None
+
+def claim_journal(path):
+    """Rename path (and its checkpoint) to a name owned by this process, or None if it is gone"""
+    claimed = f"{path.split('.claimed-')[0]}.claimed-{os.getpid()}"
+    try:
+        os.rename(path, claimed)
+    except FileNotFoundError:
+        return None
+    try:
+        os.rename(f'{path}.done', f'{claimed}.done')
+    except FileNotFoundError:
+        pass
+    return claimed
+
+def write_checkpoint(path, seq):
+    tmp_path = f'{path}.done.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(str(seq))
+    os.replace(tmp_path, f'{path}.done')
+
+def remove_checkpoint(path):
+    try:
+        os.remove(f'{path}.done')
+    except FileNotFoundError:
+        pass
+
+def read_journal(path):
+    try:
+        with open(f'{path}.done') as f:
+            done = int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        done = 0
+
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Partially written last line
+                continue
+            if record.get('seq', 0) > done:
+                records.append(record)
+    return records
+
+class ActivityWriter:
+    """Buffers activity records and writes them from a background thread.
+
+    Records are flushed with bulk_create once batch_size have queued up or
+    flush_interval seconds have passed, and once more at interpreter exit.
+    """
+
+    def __init__(self, batch_size=200, flush_interval=2.0, spool_dir=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.spool = ActivitySpool(spool_dir) if spool_dir else None
+        self.submit_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.spool:
+            try:
+                recovered = self.spool.recover()
+                if recovered:
+                    print(f"Recovered {recovered} spooled activity record(s)")
+            except DatabaseError as e:
+                print(f"Could not replay activity spool: {e}")
+            finally:
+                close_old_connections()
+
+        self.thread = threading.Thread(target=self.run, name='activity-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def submit(self, record):
+        if self.spool:
+            # Records must be queued in seq order, or a checkpoint could cover one still waiting
+            with self.submit_lock:
+                self.spool.append(record)
+                self.queue.put(record)
+        else:
+            self.queue.put(record)
+
+    def run(self):
+        batch = []
+        deadline = None
+        while not (self.stopping.is_set() and self.queue.empty() and not batch):
+            timeout = self.flush_interval if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            except queue.Empty:
+                pass
+
+            due = deadline is not None and time.monotonic() >= deadline
+            if batch and (len(batch) >= self.batch_size or due or self.stopping.is_set()):
+                if self.write(batch):
+                    batch = []
+                    deadline = None
+                elif self.stopping.is_set():
+                    # Leave the rest in the spool for the next start
+                    break
+                else:
+                    deadline = time.monotonic() + self.flush_interval
+
+    def write(self, batch):
+        try:
+            save_activities(batch)
+        except DatabaseError as e:
+            print(f"Activity log write failed, will retry: {e}")
+            return False
+        finally:
+            close_old_connections()
+
+        if self.spool:
+            self.spool.checkpoint(max(record.get('seq', 0) for record in batch))
+        return True
+
+    def stop(self, timeout=10):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        if self.spool:
+            self.spool.close()
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_activity_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                writer = ActivityWriter(
+                    batch_size=settings.ACTIVITY_LOG_BATCH_SIZE,
+                    flush_interval=settings.ACTIVITY_LOG_FLUSH_INTERVAL,
+                    spool_dir=settings.ACTIVITY_LOG_SPOOL_DIR,
+                )
+                writer.start()
+                _writer = writer
+    return _writer
+
+def record_activity(record):
+    if settings.ACTIVITY_LOG_ASYNC:
+        get_activity_writer().submit(record)
+    else:
+        save_activities([record])
+
+def record_activities(records):
+    """Record a batch at once; written in a single transaction when not queued"""
+    if settings.ACTIVITY_LOG_ASYNC:
+        writer = get_activity_writer()
+        for record in records:
+            writer.submit(record)
+    else:
+        save_activities(records)
+
+def retention_cutoff(days):
+    """Local midnight `days` days ago; activity before it is rolled up"""
+    today = timezone.localdate()
+    return day_start(today - timedelta(days=days))
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+def roll_up_day(day, cutoff):
+    """Add one day of activity to ActivityRollup and delete the rows. Returns the rows removed."""
+    start = day_start(day)
+    end = min(day_start(day + timedelta(days=1)), cutoff)
+    rows = FileActivity.objects.filter(timestamp__gte=start, timestamp__lt=end)
+
+    with transaction.atomic():
+        totals = rows.values('user_id', 'activity_type').annotate(count=Count('id'), total_bytes=Sum('file_size'))
+        existing = {
+            (rollup.user_id, rollup.activity_type): rollup
+            for rollup in ActivityRollup.objects.select_for_update().filter(day=day)
+        }
+        to_create = []
+        to_update = []
+        for total in totals:
+            rollup = existing.get((total['user_id'], total['activity_type']))
+            if rollup is None:
+                to_create.append(ActivityRollup(
+                    day=day, user_id=total['user_id'], activity_type=total['activity_type'],
+                    count=total['count'], total_bytes=total['total_bytes'] or 0
+                ))
+            else:
+                rollup.count += total['count']
+                rollup.total_bytes += total['total_bytes'] or 0
+                to_update.append(rollup)
+        ActivityRollup.objects.bulk_create(to_create)
+        ActivityRollup.objects.bulk_update(to_update, ['count', 'total_bytes'])
+        removed = rows.delete()[0]
+    return removed
+
+def roll_up_activity(cutoff):
+    """Fold activity older than cutoff into daily rollups, a day per transaction.
+
+    An interrupted run leaves whole days either rolled up or untouched, so
+    it can simply be started again. Returns (rows removed, days processed).
+    """
+    removed = days = 0
+    while True:
+        oldest = FileActivity.objects.filter(timestamp__lt=cutoff).order_by('timestamp').values_list('timestamp', flat=True).first()
+        if oldest is None:
+            break
+        removed += roll_up_day(timezone.localtime(oldest).date(), cutoff)
+        days += 1
+    return removed, days
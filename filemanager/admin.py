@@ -9,7 +9,9 @@ from django.http import JsonResponse
 import json
 import os
 from django.conf import settings
-from .models import FolderPermission, UserProfile, FileActivity
+from .models import FolderPermission, UserProfile, FileActivity, ActivityRollup
+from .listing import build_folder_tree
+from .pagination import KeysetChangeList
 
 class FolderPermissionForm(forms.ModelForm):
     class Meta:
@@ -57,31 +59,32 @@ class CustomUserAdmin(UserAdmin):
         return render(request, 'admin/folder_browser.html')
     
     def get_folders(self, request):
-        """API endpoint to get folders"""
-        base_path = settings.FILE_STORAGE_ROOT
-        folder_path = request.GET.get('path', '')
+        """Folder tree for the picker, a few levels at a time.
+
+        Every node reports has_children, so the picker asks again with a
+        node's path when it is expanded instead of loading the whole tree.
+        """
+        base_path = os.path.abspath(settings.FILE_STORAGE_ROOT)
+        folder_path = request.GET.get('path', '').strip('/')
         
-        full_path = os.path.join(base_path, folder_path)
+        try:
+            depth = int(request.GET.get('depth', settings.FOLDER_TREE_DEPTH))
+        except ValueError:
+            depth = settings.FOLDER_TREE_DEPTH
+        depth = max(1, min(depth, settings.FOLDER_TREE_MAX_DEPTH))
         
-        if not os.path.exists(full_path):
+        full_path = os.path.abspath(os.path.join(base_path, folder_path))
+        if full_path != base_path and not full_path.startswith(base_path + os.sep):
+            return JsonResponse({'error': 'Path does not exist'}, status=404)
+        if not os.path.isdir(full_path):
             return JsonResponse({'error': 'Path does not exist'}, status=404)
         
-        folders = []
         try:
-            for item in os.listdir(full_path):
-                item_path = os.path.join(full_path, item)
-                if os.path.isdir(item_path):
-                    rel_path = os.path.join(folder_path, item).replace('\\', '/')
-                    folders.append({
-                        'name': item,
-                        'path': rel_path,
-                        'has_children': any(os.path.isdir(os.path.join(item_path, subitem)) for subitem in os.listdir(item_path))
-                    })
-        except Exception as e:
+            folders = build_folder_tree(base_path, folder_path, depth)
+        except OSError as e:
             return JsonResponse({'error': str(e)}, status=500)
         
-        folders.sort(key=lambda x: x['name'].lower())
-        return JsonResponse({'folders': folders})
+        return JsonResponse({'folders': folders, 'path': folder_path, 'depth': depth})
     
     def password_changed(self, obj):
         return obj.userprofile.password_changed if hasattr(obj, 'userprofile') else False
@@ -104,23 +107,44 @@ class FolderPermissionAdmin(admin.ModelAdmin):
             kwargs["queryset"] = User.objects.filter(is_superuser=False)
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
+def format_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024.0:
+            return f"{size:.2f} {unit}"
+        size /= 1024.0
+    return f"{size:.2f} TB"
+
 class FileActivityAdmin(admin.ModelAdmin):
     list_display = ['user', 'filename', 'activity_type', 'file_size_display', 'timestamp', 'ip_address']
     list_filter = ['activity_type', 'timestamp', 'user']
     search_fields = ['user__username', 'filename', 'filepath']
     readonly_fields = ['user', 'filename', 'filepath', 'activity_type', 'timestamp', 'ip_address', 'file_size']
+    list_select_related = ['user']
+    # Newest first by (timestamp, id) pages; other sort orders would need a full scan
+    sortable_by = []
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
     
     def file_size_display(self, obj):
         if obj.file_size:
-            size = obj.file_size
-            for unit in ['B', 'KB', 'MB', 'GB']:
-                if size < 1024.0:
-                    return f"{size:.2f} {unit}"
-                size /= 1024.0
-            return f"{size:.2f} TB"
+            return format_size(obj.file_size)
         return "-"
     file_size_display.short_description = 'File Size'
 
+class ActivityRollupAdmin(admin.ModelAdmin):
+    list_display = ['day', 'user', 'activity_type', 'count', 'total_bytes_display']
+    list_filter = ['activity_type', 'user']
+    date_hierarchy = 'day'
+    list_select_related = ['user']
+    readonly_fields = ['day', 'user', 'activity_type', 'count', 'total_bytes']
+    
+    def total_bytes_display(self, obj):
+        return format_size(obj.total_bytes)
+    total_bytes_display.short_description = 'Bytes'
+
 # Quick actions for admin
 def grant_full_access(modeladmin, request, queryset):
     for user in queryset:
@@ -153,6 +177,7 @@ admin.site.unregister(User)
 admin.site.register(User, CustomUserAdmin)
 admin.site.register(FolderPermission, FolderPermissionAdmin)
 admin.site.register(FileActivity, FileActivityAdmin)
+admin.site.register(ActivityRollup, ActivityRollupAdmin)
 
 # Custom admin site header
 admin.site.site_header = "SNSeaFile Administration"
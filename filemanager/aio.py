@@ -0,0 +1,58 @@
+"""Helpers for the async views and for serving under ASGI.
+
+Blocking file work (stat, scandir, reads) runs on a bounded thread pool
+of its own, so slow disks or many concurrent downloads cannot starve the
+thread that Django uses for database access from async code.
+"""
+import asyncio
+import functools
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_io_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.ASYNC_IO_THREADS, thread_name_prefix='file-io')
+    return _executor
+
+async def run_io(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Carries context variables (such as the request's metrics) into the pool thread
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_io_executor(), functools.partial(context.run, func, *args, **kwargs))
+
+async def aiter_sync(iterable):
+    """Iterate a blocking iterator from async code, one item per pool job"""
+    iterator = iter(iterable)
+    done = object()
+    try:
+        while True:
+            item = await run_io(next, iterator, done)
+            if item is done:
+                break
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await run_io(close)
+
+class StreamingASGIHandler(ASGIHandler):
+    """ASGIHandler that streams synchronous response iterators through the I/O pool.
+
+    Django's own handler reads a synchronous iterator completely into
+    memory before sending it, which for downloads and ZIP archives means
+    buffering whole files per connection.
+    """
+
+    async def send_response(self, response, send):
+        if response.streaming and not response.is_async:
+            response.streaming_content = aiter_sync(response.streaming_content)
+        await super().send_response(response, send)
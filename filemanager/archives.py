@@ -0,0 +1,110 @@
+import os
+import zipfile
+from django.conf import settings
+from .indexing import iter_storage_files
+from .utils import has_permission, resolve_path
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Formats that are already compressed gain nothing from deflate
+STORED_EXTENSIONS = {
+    '.zip', '.rar', '.7z', '.gz', '.tgz', '.bz2', '.xz', '.zst',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+    '.mp4', '.avi', '.mov', '.mkv', '.mp3', '.aac',
+    '.docx', '.xlsx', '.pptx', '.pdf',
+}
+
+class ZipStreamBuffer:
+    """Write-only file object that hands zipfile's output back to a generator"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def collect_archive_entries(user, paths):
+    """Resolve requested files and folders into (full_path, arcname, size) tuples.
+
+    Folders are expanded recursively; every file is checked for read
+    permission on its own folder. Returns None if any requested path is
+    not readable or does not exist.
+    """
+    base_path = settings.FILE_STORAGE_ROOT
+    entries = []
+    seen = set()
+
+    for path in paths:
+        rel_path, full_path = resolve_path(path)
+        if rel_path is None:
+            return None
+        parent = os.path.dirname(rel_path)
+
+        if os.path.isdir(full_path):
+            if not has_permission(user, rel_path, 'read'):
+                return None
+            for file_path, name, st in iter_storage_files(base_path, rel_path):
+                if not has_permission(user, os.path.dirname(file_path), 'read'):
+                    continue
+                arcname = file_path[len(parent) + 1:] if parent else file_path
+                if arcname not in seen:
+                    seen.add(arcname)
+                    entries.append((os.path.join(base_path, file_path), arcname, st.st_size))
+        elif os.path.isfile(full_path):
+            if not has_permission(user, parent, 'read'):
+                return None
+            arcname = os.path.basename(rel_path)
+            if arcname not in seen:
+                seen.add(arcname)
+                entries.append((full_path, arcname, os.path.getsize(full_path)))
+        else:
+            return None
+
+    return entries
+
+def iter_zip(entries):
+    """Stream a ZIP archive of entries without staging it anywhere.
+
+    zipfile writes data descriptors when the output is not seekable and
+    switches to ZIP64 by itself for large members and archives.
+    """
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as archive:
+        for full_path, arcname, size in entries:
+            try:
+                zinfo = zipfile.ZipInfo.from_file(full_path, arcname)
+                source = open(full_path, 'rb')
+            except OSError as e:
+                print(f"Skipping {full_path} in archive: {e}")
+                continue
+
+            if os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS:
+                zinfo.compress_type = zipfile.ZIP_STORED
+            else:
+                zinfo.compress_type = zipfile.ZIP_DEFLATED
+
+            with source, archive.open(zinfo, 'w') as dest:
+                while True:
+                    data = source.read(STREAM_CHUNK_SIZE)
+                    if not data:
+                        break
+                    dest.write(data)
+                    if buffer.chunks:
+                        yield buffer.drain()
+            if buffer.chunks:
+                yield buffer.drain()
+    yield buffer.drain()
@@ -0,0 +1,230 @@
+"""Synthetic fleet dataset for the benchmark suite.
+
+Builds vessel folder trees under FILE_STORAGE_ROOT in the shape the portal
+sees in production (one top-level folder and login per vessel, as in
+create_users.py) plus office users with read grants on other vessels.
+Everything is derived from the seed, so the same parameters always give
+the same tree. A JSON manifest describing the users, folders and sample
+files is written for run_benchmark.
+"""
+import os
+import re
+import json
+import math
+import time
+import random
+import shutil
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from .folderstats import reconcile_folder_stats
+from .indexing import refresh_file_index
+from .models import FolderPermission, UserProfile
+
+DEFAULT_PARAMS = {
+    'seed': 1,
+    'prefix': 'BV',
+    'vessels': 16,
+    'depth': 3,
+    'fanout': 3,
+    'files_per_folder': 10,
+    'median_size': 16 * 1024,
+    # Spread of the log-normal size distribution; 1.5 gives a long tail of large files
+    'size_sigma': 1.5,
+    'max_size': 20 * 1024 * 1024,
+    'users_per_vessel': 1,
+    'extra_grants': 2,
+    'password': 'benchmark',
+    'sparse': False,
+}
+
+CATEGORIES = [
+    'Certificates', 'Crew', 'Drawings', 'Logbooks', 'Maintenance', 'Manuals',
+    'Procurement', 'Reports', 'Safety', 'Surveys', 'Voyage', 'Correspondence',
+]
+
+# (extension, document kind, is text)
+FILE_KINDS = [
+    ('pdf', 'Certificate', False),
+    ('pdf', 'Survey', False),
+    ('docx', 'Report', False),
+    ('docx', 'Procedure', False),
+    ('xlsx', 'Inventory', False),
+    ('xlsx', 'Bunker', False),
+    ('csv', 'Noon', True),
+    ('log', 'Engine', True),
+    ('txt', 'Memo', True),
+    ('dat', 'VDR', False),
+]
+
+WORDS = (
+    'ballast bunker cargo hold hatch engine crankcase purifier boiler survey class certificate '
+    'inspection deck crew master chief officer voyage port draft trim stability pump valve '
+    'lube oil fuel sludge bilge incinerator generator alarm maintenance overhaul spare'
+).split()
+
+BLOCK_SIZE = 1024 * 1024
+
+# Modification times are spread over the four years before this (2025-12-31 UTC)
+REFERENCE_TIME = 1767139200
+
+def vessel_code(prefix, n):
+    return f'{prefix}{n:03d}'
+
+def folder_names(rng, depth, fanout):
+    """Names for the folders at one depth below a vessel"""
+    if depth == 1:
+        return rng.sample(CATEGORIES, min(fanout, len(CATEGORIES)))
+    if depth == 2:
+        return [str(year) for year in range(2025 - fanout + 1, 2026)]
+    return [f'Batch {n:02d}' for n in range(1, fanout + 1)]
+
+def file_size(rng, params):
+    size = rng.lognormvariate(math.log(params['median_size']), params['size_sigma'])
+    return min(int(size), params['max_size'])
+
+def make_blocks(seed):
+    """A block of random bytes and one of log-like text, sliced to fill files quickly"""
+    rng = random.Random(seed)
+    binary = rng.randbytes(BLOCK_SIZE)
+    lines = []
+    length = 0
+    while length < BLOCK_SIZE:
+        line = f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d} " + ' '.join(rng.choices(WORDS, k=rng.randint(4, 12))) + '\n'
+        lines.append(line)
+        length += len(line)
+    return binary, ''.join(lines).encode('ascii')[:BLOCK_SIZE]
+
+def write_file(path, size, block, offset, sparse):
+    with open(path, 'wb') as f:
+        if sparse:
+            f.truncate(size)
+            return
+        while size > 0:
+            start = offset % BLOCK_SIZE
+            data = block[start:start + size]
+            f.write(data)
+            size -= len(data)
+            offset += len(data)
+
+def build_vessel_tree(root, code, rng, params, blocks):
+    """Create one vessel's folders and files. Returns (folders, files) as rel paths; files with sizes."""
+    folders = [code]
+    files = []
+    level = [code]
+    for depth in range(1, params['depth'] + 1):
+        next_level = []
+        for parent in level:
+            for name in folder_names(rng, depth, params['fanout']):
+                next_level.append(f'{parent}/{name}')
+        folders += next_level
+        level = next_level
+
+    for rel_dir in folders:
+        os.makedirs(os.path.join(root, rel_dir), exist_ok=True)
+        count = max(0, round(params['files_per_folder'] * rng.uniform(0.5, 1.5)))
+        for n in range(count):
+            ext, kind, is_text = rng.choice(FILE_KINDS)
+            year = 2025 - rng.randint(0, 4)
+            name = f'{code} {kind} {year}-{rng.randint(1, 12):02d} {n + 1:04d}.{ext}'
+            rel_path = f'{rel_dir}/{name}'
+            size = file_size(rng, params)
+            full_path = os.path.join(root, rel_path)
+            write_file(full_path, size, blocks[1] if is_text else blocks[0], rng.randrange(BLOCK_SIZE), params['sparse'])
+            mtime = REFERENCE_TIME - rng.uniform(0, 4 * 365 * 86400)
+            os.utime(full_path, (mtime, mtime))
+            files.append((rel_path, size))
+    return folders, files
+
+def create_users(vessels, folders_by_vessel, rng, params):
+    """Create the vessel and office logins with their folder grants. Returns the manifest entries."""
+    password = make_password(params['password'])
+    entries = []
+    for code in vessels:
+        for k in range(params['users_per_vessel']):
+            username = code if k == 0 else f'{code}_{k}'
+            grants = {f'/{code}': 'write'}
+            others = [other for other in vessels if other != code]
+            for other in rng.sample(others, min(params['extra_grants'], len(others))):
+                grants[f'/{rng.choice(folders_by_vessel[other])}'] = 'read'
+            entries.append({'username': username, 'vessel': code, 'grants': grants})
+
+    with transaction.atomic():
+        users = User.objects.bulk_create([User(username=entry['username'], password=password) for entry in entries])
+        UserProfile.objects.bulk_create([
+            UserProfile(user=user, vessel_name=entry['vessel'], password_changed=True)
+            for user, entry in zip(users, entries)
+        ])
+        FolderPermission.objects.bulk_create([
+            FolderPermission(user=user, folder_path=folder, permission=permission)
+            for user, entry in zip(users, entries)
+            for folder, permission in entry['grants'].items()
+        ])
+        admin = User.objects.create(
+            username=f"{params['prefix']}_admin", password=password, is_staff=True, is_superuser=True
+        )
+        UserProfile.objects.create(user=admin, vessel_name='', password_changed=True)
+    return entries, admin.username
+
+def remove_dataset(root, params):
+    """Delete the folders and users a previous run with the same prefix created"""
+    prefix = params['prefix']
+    for name in os.listdir(root):
+        if name.startswith(prefix) and name[len(prefix):].isdigit() and os.path.isdir(os.path.join(root, name)):
+            shutil.rmtree(os.path.join(root, name))
+    User.objects.filter(username__regex=rf'^{re.escape(prefix)}([0-9]+(_[0-9]+)?|_admin)$').delete()
+
+def dataset_exists(root, params):
+    code = vessel_code(params['prefix'], 1)
+    return os.path.exists(os.path.join(root, code)) or User.objects.filter(username=code).exists()
+
+def generate_dataset(params):
+    """Build the dataset described by params (see DEFAULT_PARAMS) and return its manifest"""
+    params = {**DEFAULT_PARAMS, **params}
+    root = str(settings.FILE_STORAGE_ROOT)
+    os.makedirs(root, exist_ok=True)
+    rng = random.Random(params['seed'])
+    blocks = make_blocks(params['seed'])
+    started = time.monotonic()
+
+    vessels = [vessel_code(params['prefix'], n) for n in range(1, params['vessels'] + 1)]
+    folders_by_vessel = {}
+    files_by_vessel = {}
+    total_files = total_bytes = 0
+    for code in vessels:
+        folders, files = build_vessel_tree(root, code, rng, params, blocks)
+        folders_by_vessel[code] = folders
+        files_by_vessel[code] = files
+        total_files += len(files)
+        total_bytes += sum(size for rel_path, size in files)
+
+    users, admin = create_users(vessels, folders_by_vessel, rng, params)
+
+    # The indexes are part of production state, so benchmarks run against them built
+    refresh_file_index('')
+    reconcile_folder_stats('')
+
+    # A fixed sample keeps the benchmark's requests the same between runs
+    search_terms = sorted({kind for ext, kind, is_text in FILE_KINDS}) + [str(year) for year in range(2021, 2026)]
+    return {
+        'params': {key: value for key, value in params.items() if key != 'password'},
+        'password': params['password'],
+        'admin': admin,
+        'users': users,
+        'folders': {code: folders[:200] for code, folders in folders_by_vessel.items()},
+        'files': {code: [rel_path for rel_path, size in rng.sample(files, min(200, len(files)))] for code, files in files_by_vessel.items()},
+        'search_terms': search_terms,
+        'totals': {
+            'vessels': len(vessels),
+            'folders': sum(len(folders) for folders in folders_by_vessel.values()),
+            'files': total_files,
+            'bytes': total_bytes,
+            'users': len(users),
+            'seconds': round(time.monotonic() - started, 2),
+        },
+    }
+
+def load_manifest(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,395 @@
+"""Benchmark runner for the dataset made by generate_benchmark_data.
+
+Each scenario is driven through the Django test client (the view code
+alone) and through a real waitress server on a loopback port (the full
+HTTP path), at each requested concurrency. Every request of a run picks
+its user, folder or file from a generator seeded by the scenario name and
+request number, so two runs against the same dataset issue the same
+requests and their results can be compared.
+"""
+import os
+import time
+import random
+import resource
+import platform
+import threading
+import subprocess
+import uuid
+import django
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import close_old_connections, connections
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.urls import reverse
+from .client import PortalClient, PortalError, quote_path
+from .folderstats import reconcile_folder_stats
+from .indexing import remove_from_index
+from .utils import has_permission
+
+SCENARIOS = ['has_permission', 'file_browser', 'search_files', 'download_file', 'upload_file', 'admin_get_folder_tree']
+
+# has_permission is a function call, so it is timed once, outside both servers
+DIRECT_SCENARIOS = {'has_permission'}
+
+UPLOAD_FOLDER = 'benchmark-uploads'
+
+class QueryCounter:
+    """Counts SQL statements on every connection in the process, whichever thread runs them"""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def start(self):
+        connection_created.connect(self.install)
+        for connection in connections.all():
+            self.install(connection=connection)
+
+def read_proc_io():
+    """(read syscalls, write syscalls) made by this process so far, or None off Linux"""
+    try:
+        with open('/proc/self/io') as f:
+            values = dict(line.split(':') for line in f)
+        return int(values['syscr']), int(values['syscw'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def reset_peak_rss():
+    """Restart the kernel's peak RSS counter so each scenario reports its own peak"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss is in KB on Linux and bytes on macOS, and never resets
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(maxrss / (1024 * 1024 if platform.system() == 'Darwin' else 1024), 1)
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+class ClientSession:
+    """One logged-in user driving the views in-process"""
+
+    def __init__(self, username, password):
+        self.client = Client()
+        self.client.force_login(User.objects.get(username=username))
+
+    def get(self, path):
+        response = self.client.get('/' + path)
+        if response.streaming:
+            size = sum(len(data) for data in response.streaming_content)
+        else:
+            size = len(response.content)
+        response.close()
+        if response.status_code >= 400:
+            raise PortalError(f'{response.status_code} for {path}')
+        return size
+
+    def upload(self, folder, name, data):
+        response = self.client.post('/upload/', {'folder_path': folder, 'files': SimpleUploadedFile(name, data)})
+        if response.status_code >= 400:
+            raise PortalError(f'{response.status_code} for upload')
+        return len(response.content)
+
+class HTTPSession:
+    """One logged-in user driving a real server over HTTP"""
+
+    def __init__(self, server, username, password):
+        self.client = PortalClient(server, username, password)
+
+    def get(self, path):
+        size = 0
+        with self.client.open(path) as response:
+            while True:
+                data = response.read(64 * 1024)
+                if not data:
+                    return size
+                size += len(data)
+
+    def upload(self, folder, name, data):
+        boundary = uuid.uuid4().hex
+        body = b''.join([
+            f'--{boundary}\r\nContent-Disposition: form-data; name="folder_path"\r\n\r\n{folder}\r\n'.encode('utf-8'),
+            f'--{boundary}\r\nContent-Disposition: form-data; name="files"; filename="{name}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8'),
+            data,
+            f'\r\n--{boundary}--\r\n'.encode('utf-8'),
+        ])
+        headers = {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+        with self.client.open('upload/', data=body, headers=headers) as response:
+            return len(response.read())
+
+def user_folders(manifest, user):
+    """Folders of the manifest a user can read: their vessel's tree and the folders they were granted"""
+    folders = list(manifest['folders'][user['vessel']])
+    for folder in user['grants']:
+        folder = folder.strip('/')
+        if folder.split('/')[0] != user['vessel']:
+            folders.append(folder)
+    return folders
+
+def run_has_permission(session, user, manifest, rng):
+    folder = rng.choice(user_folders(manifest, user))
+    # A fresh user object per call, as request.user is per request
+    has_permission(User(pk=user['pk'], username=user['username']), folder, 'read')
+    return 0
+
+def run_file_browser(session, user, manifest, rng):
+    folder = rng.choice(user_folders(manifest, user))
+    return session.get(f'browser/{quote_path(folder)}/')
+
+def run_search_files(session, user, manifest, rng):
+    return session.get(f"search/?q={rng.choice(manifest['search_terms'])}")
+
+def run_download_file(session, user, manifest, rng):
+    return session.get(f"download/{quote_path(rng.choice(manifest['files'][user['vessel']]))}/")
+
+def run_upload_file(session, user, manifest, rng):
+    size = manifest['upload_size']
+    return session.upload(f"{user['vessel']}/{UPLOAD_FOLDER}", f'upload-{rng.getrandbits(32):08x}.bin', rng.randbytes(size))
+
+def run_admin_get_folder_tree(session, user, manifest, rng):
+    # The picker loads the top levels when it opens, then one node per expansion
+    url = reverse('admin:get_folders').lstrip('/')
+    if rng.random() < 0.5:
+        return session.get(url)
+    vessel = rng.choice(list(manifest['folders']))
+    return session.get(f"{url}?path={quote_path(vessel)}")
+
+RUNNERS = {
+    'has_permission': run_has_permission,
+    'file_browser': run_file_browser,
+    'search_files': run_search_files,
+    'download_file': run_download_file,
+    'upload_file': run_upload_file,
+    'admin_get_folder_tree': run_admin_get_folder_tree,
+}
+
+def start_waitress(threads):
+    """Serve the project on a free loopback port from a background thread"""
+    from waitress import create_server
+    from django.core.wsgi import get_wsgi_application
+    server = create_server(get_wsgi_application(), host='127.0.0.1', port=0, threads=threads)
+    threading.Thread(target=server.run, name='benchmark-waitress', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.effective_port}'
+
+class BenchmarkRunner:
+    def __init__(self, manifest, requests=200, warmup=20, seed=1, upload_size=256 * 1024, server_threads=8, report=print):
+        self.manifest = dict(manifest, upload_size=upload_size)
+        self.requests = requests
+        self.warmup = warmup
+        self.seed = seed
+        self.server_threads = server_threads
+        self.report = report
+        self.queries = QueryCounter()
+        self.server = None
+        self.server_url = None
+
+        pks = dict(User.objects.filter(username__in=[u['username'] for u in manifest['users']]).values_list('username', 'pk'))
+        self.users = [dict(user, pk=pks[user['username']]) for user in manifest['users'] if user['username'] in pks]
+        if not self.users:
+            raise ValueError('None of the dataset users exist; run generate_benchmark_data first')
+        self.admin = {'username': manifest['admin'], 'vessel': None, 'grants': {}}
+
+    def make_session(self, mode, user):
+        if mode == 'client':
+            return ClientSession(user['username'], self.manifest['password'])
+        if mode == 'waitress':
+            if self.server is None:
+                self.server, self.server_url = start_waitress(self.server_threads)
+            return HTTPSession(self.server_url, user['username'], self.manifest['password'])
+        return None
+
+    def run_requests(self, scenario, sessions, users, start, count, latencies, errors):
+        """Issue requests start..start+count over the sessions, one thread per session"""
+        runner = RUNNERS[scenario]
+        lock = threading.Lock()
+        next_index = iter(range(start, start + count))
+
+        def work(slot):
+            session, user = sessions[slot], users[slot]
+            try:
+                while True:
+                    with lock:
+                        index = next(next_index, None)
+                    if index is None:
+                        return
+                    rng = random.Random(f'{self.seed}:{scenario}:{index}')
+                    began = time.perf_counter()
+                    try:
+                        runner(session, user, self.manifest, rng)
+                    except Exception as e:
+                        with lock:
+                            errors.append(f'{type(e).__name__}: {e}')
+                        continue
+                    elapsed = time.perf_counter() - began
+                    if latencies is not None:
+                        with lock:
+                            latencies.append(elapsed)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+            list(executor.map(work, range(len(sessions))))
+
+    def run_scenario(self, scenario, mode, concurrency):
+        users = [self.admin] * concurrency if scenario == 'admin_get_folder_tree' else [
+            self.users[slot % len(self.users)] for slot in range(concurrency)
+        ]
+        # Logging in is not part of what is measured
+        sessions = [self.make_session(mode, user) for user in users]
+        close_old_connections()
+
+        warmup_errors = []
+        self.run_requests(scenario, sessions, users, -self.warmup, self.warmup, None, warmup_errors)
+
+        latencies = []
+        errors = []
+        reset_peak_rss()
+        queries_before = self.queries.count
+        io_before = read_proc_io()
+        began = time.perf_counter()
+        self.run_requests(scenario, sessions, users, 0, self.requests, latencies, errors)
+        elapsed = time.perf_counter() - began
+        io_after = read_proc_io()
+        queries = self.queries.count - queries_before
+
+        latencies.sort()
+        completed = len(latencies)
+        result = {
+            'scenario': scenario,
+            'mode': mode,
+            'concurrency': concurrency,
+            'requests': self.requests,
+            'errors': len(errors),
+            'first_error': errors[0] if errors else None,
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50) * 1000, 3) if completed else None,
+                'p95': round(percentile(latencies, 95) * 1000, 3) if completed else None,
+                'p99': round(percentile(latencies, 99) * 1000, 3) if completed else None,
+                'mean': round(sum(latencies) / completed * 1000, 3) if completed else None,
+                'max': round(latencies[-1] * 1000, 3) if completed else None,
+            },
+            'throughput_rps': round(completed / elapsed, 1) if elapsed else None,
+            'queries_per_request': round(queries / self.requests, 2),
+            # Whole process, so over HTTP this includes the load generator's socket I/O
+            'syscalls_per_request': {
+                'read': round((io_after[0] - io_before[0]) / self.requests, 1),
+                'write': round((io_after[1] - io_before[1]) / self.requests, 1),
+            } if io_before and io_after else None,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        self.report(
+            f"{scenario:<22} {mode:<8} c={concurrency:<3} p50={result['latency_ms']['p50']}ms "
+            f"p95={result['latency_ms']['p95']}ms p99={result['latency_ms']['p99']}ms "
+            f"{result['throughput_rps']} req/s {result['queries_per_request']} queries/req"
+            + (f" {len(errors)} errors ({errors[0]})" if errors else '')
+        )
+        return result
+
+    def remove_uploads(self):
+        """Delete what upload_file stored so repeated runs see the same tree"""
+        for vessel in {user['vessel'] for user in self.users}:
+            rel_folder = f'{vessel}/{UPLOAD_FOLDER}'
+            full_path = os.path.join(settings.FILE_STORAGE_ROOT, rel_folder)
+            if os.path.isdir(full_path):
+                for dirpath, dirnames, filenames in os.walk(full_path, topdown=False):
+                    for name in filenames:
+                        os.remove(os.path.join(dirpath, name))
+                    os.rmdir(dirpath)
+                remove_from_index(rel_folder)
+                reconcile_folder_stats(rel_folder)
+
+    def run(self, scenarios, modes, concurrency_levels):
+        self.queries.start()
+        results = []
+        try:
+            for scenario in scenarios:
+                scenario_modes = ['direct'] if scenario in DIRECT_SCENARIOS else modes
+                for mode in scenario_modes:
+                    for concurrency in concurrency_levels:
+                        results.append(self.run_scenario(scenario, mode, concurrency))
+        finally:
+            # The waitress thread is a daemon and goes with the process;
+            # closing the server under its running loop only makes it raise
+            if 'upload_file' in scenarios:
+                self.remove_uploads()
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'environment': environment_info(),
+            'dataset': {'params': self.manifest['params'], 'totals': self.manifest['totals']},
+            'options': {
+                'requests': self.requests,
+                'warmup': self.warmup,
+                'seed': self.seed,
+                'upload_size': self.manifest['upload_size'],
+                'server_threads': self.server_threads,
+            },
+            'results': results,
+        }
+
+def environment_info():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connections['default'].vendor,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+def result_key(result):
+    return (result['scenario'], result['mode'], result['concurrency'])
+
+def compare_results(baseline, current):
+    """Lines comparing p95 latency and throughput of two benchmark reports"""
+    old = {result_key(result): result for result in baseline['results']}
+    lines = []
+    for result in current['results']:
+        before = old.get(result_key(result))
+        if before is None:
+            continue
+        scenario, mode, concurrency = result_key(result)
+        parts = []
+        for label, a, b in [
+            ('p95', before['latency_ms']['p95'], result['latency_ms']['p95']),
+            ('rps', before['throughput_rps'], result['throughput_rps']),
+            ('queries', before['queries_per_request'], result['queries_per_request']),
+        ]:
+            if a and b is not None:
+                parts.append(f'{label} {a} -> {b} ({(b - a) / a * 100:+.1f}%)')
+        lines.append(f"{scenario:<22} {mode:<8} c={concurrency:<3} " + '  '.join(parts))
+    return lines
@@ -0,0 +1,67 @@
+"""Minimal HTTP client for scripts that talk to the portal from a vessel.
+
+Uses only the standard library so it runs on machines without Django.
+"""
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+import http.cookiejar
+
+class PortalError(Exception):
+    pass
+
+class PortalClient:
+    def __init__(self, server, username, password, timeout=60):
+        self.server = server.rstrip('/')
+        self.timeout = timeout
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+        self.login(username, password)
+
+    def url(self, path):
+        return f"{self.server}/{path.lstrip('/')}"
+
+    def cookie(self, name):
+        for cookie in self.cookies:
+            if cookie.name == name:
+                return cookie.value
+        return None
+
+    def login(self, username, password):
+        # The login page sets the CSRF cookie that the form post needs
+        self.opener.open(self.url('/'), timeout=self.timeout).read()
+        body = urllib.parse.urlencode({
+            'username': username,
+            'password': password,
+            'csrfmiddlewaretoken': self.cookie('csrftoken') or '',
+        }).encode('utf-8')
+        request = urllib.request.Request(self.url('/'), data=body, headers={'Referer': self.url('/')})
+        self.opener.open(request, timeout=self.timeout).read()
+        if not self.cookie('sessionid'):
+            raise PortalError('Login failed')
+
+    def open(self, path, data=None, headers=None, method=None):
+        headers = dict(headers or {})
+        if data is not None or method not in (None, 'GET', 'HEAD'):
+            headers.setdefault('X-CSRFToken', self.cookie('csrftoken') or '')
+            headers.setdefault('Referer', self.url('/'))
+        request = urllib.request.Request(self.url(path), data=data, headers=headers, method=method)
+        try:
+            return self.opener.open(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code in (206, 304, 416):
+                return e
+            raise PortalError(f'{e.code} {e.reason} for {path}') from e
+
+    def get_json(self, path, params=None):
+        if params:
+            path = f'{path}?{urllib.parse.urlencode(params, doseq=True)}'
+        with self.open(path) as response:
+            return json.load(response)
+
+    def post_json(self, path, payload):
+        return self.open(path, data=json.dumps(payload).encode('utf-8'), headers={'Content-Type': 'application/json'})
+
+def quote_path(path):
+    return urllib.parse.quote(path.strip('/'))
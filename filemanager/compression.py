@@ -0,0 +1,172 @@
+import os
+import zlib
+import mimetypes
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/xml', 'application/javascript', 'application/rtf',
+    'application/x-sh', 'application/sql', 'application/x-tar', 'image/svg+xml', 'image/bmp',
+    # Legacy binary office formats; the OOXML ones are zip files already
+    'application/msword', 'application/vnd.ms-excel', 'application/vnd.ms-powerpoint',
+}
+
+COMPRESSIBLE_EXTENSIONS = {'.log', '.csv', '.tsv', '.xml', '.json', '.txt', '.sql', '.dbf', '.mdb', '.nmea', '.ini', '.cfg'}
+
+SIDECAR_SUFFIXES = {'zstd': '.zst', 'br': '.br', 'gzip': '.gz'}
+
+def available_encodings():
+    """Encodings this server can produce, most effective first"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append('zstd')
+    if brotli is not None:
+        encodings.append('br')
+    encodings.append('gzip')
+    return encodings
+
+def is_compressible(filename):
+    if os.path.splitext(filename)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+        return True
+    content_type = mimetypes.guess_type(filename)[0] or ''
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+def accepted_encodings(accept_encoding):
+    """Encodings from available_encodings() that the client accepts, best first"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding] = quality
+
+    return [
+        encoding for encoding in available_encodings()
+        if accepted.get(encoding, accepted.get('*', 0)) > 0
+    ]
+
+def make_compressor(encoding):
+    """Return (compress, flush) callables for a streaming compressor"""
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=settings.COMPRESSION_ZSTD_LEVEL).compressobj()
+        return compressor.compress, compressor.flush
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+def compress_chunks(chunks, encoding):
+    """Compress an iterable of byte chunks on the fly"""
+    compress, flush = make_compressor(encoding)
+    for data in chunks:
+        out = compress(data)
+        if out:
+            yield out
+    yield flush()
+
+def iter_compressed(path, encoding, chunk_size=STREAM_CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        yield from compress_chunks(iter(lambda: f.read(chunk_size), b''), encoding)
+
+def sidecar_path(rel_path, encoding):
+    return os.path.join(settings.COMPRESSION_CACHE_ROOT, rel_path.strip('/') + SIDECAR_SUFFIXES[encoding])
+
+def fresh_sidecar(rel_path, encoding, st):
+    """Path of a pre-compressed copy made from the current version of the file, if any.
+
+    Sidecars carry the mtime of the source they were made from, so any
+    change to the source makes them stale.
+    """
+    path = sidecar_path(rel_path, encoding)
+    try:
+        if os.stat(path).st_mtime_ns == st.st_mtime_ns:
+            return path
+    except OSError:
+        pass
+    return None
+
+def choose_encoding(request, rel_path, st):
+    """Pick how to send a download: (encoding, sidecar path or None).
+
+    A fresh sidecar in any accepted encoding beats compressing on the fly.
+    Streamed compression has no stable byte offsets, so range requests
+    without a sidecar get the file as it is. Returns (None, None) for
+    identity.
+    """
+    if not settings.COMPRESSION_ENABLED or st.st_size < settings.COMPRESSION_MIN_SIZE or not is_compressible(rel_path):
+        return None, None
+
+    encodings = accepted_encodings(request.headers.get('Accept-Encoding'))
+    for encoding in encodings:
+        sidecar = fresh_sidecar(rel_path, encoding, st)
+        if sidecar:
+            return encoding, sidecar
+
+    if encodings and 'Range' not in request.headers:
+        return encodings[0], None
+    return None, None
+
+def write_sidecar(full_path, rel_path, encoding):
+    """Compress full_path into its sidecar. Returns the sidecar size."""
+    st = os.stat(full_path)
+    path = sidecar_path(rel_path, encoding)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as out:
+            for data in iter_compressed(full_path, encoding):
+                out.write(data)
+        os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return os.path.getsize(path)
+
+def prune_sidecars():
+    """Delete sidecars whose source is gone or has changed. Returns the number removed."""
+    removed = 0
+    root = settings.COMPRESSION_CACHE_ROOT
+    suffixes = tuple(SIDECAR_SUFFIXES.values())
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(dirpath, name)
+            source_name, suffix = os.path.splitext(name)
+            stale = suffix not in suffixes
+            if not stale:
+                rel_path = os.path.relpath(os.path.join(dirpath, source_name), root)
+                try:
+                    stale = os.stat(path).st_mtime_ns != os.stat(os.path.join(settings.FILE_STORAGE_ROOT, rel_path)).st_mtime_ns
+                except OSError:
+                    stale = True
+            if stale:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+    return removed
@@ -0,0 +1,252 @@
+"""Full-text index of document contents in a SQLite FTS5 database.
+
+The index lives in its own SQLite file next to whatever database Django
+uses, so it works the same on every backend. A file is re-extracted only
+when its size or mtime changes.
+"""
+import os
+import html
+import queue
+import sqlite3
+import threading
+from django.conf import settings
+from .extractors import can_extract, extract_text
+from .indexing import iter_storage_files, normalize_rel_path, readable_folders
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    error TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS contents USING fts5(
+    name, body, tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+COMMIT_EVERY = 100
+
+# snippet() marks matches with these; they cannot occur in extracted text
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+
+_local = threading.local()
+
+def get_connection():
+    """This thread's connection to the content index, created on first use.
+
+    A thread reconnects when CONTENT_INDEX_PATH changes (as it does between
+    tests), rather than keep using the old file.
+    """
+    path = str(settings.CONTENT_INDEX_PATH)
+    connection = getattr(_local, 'connection', None)
+    if connection is not None and _local.path != path:
+        connection.close()
+        connection = None
+    if connection is None:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        connection = sqlite3.connect(path, timeout=30)
+        # Readers are not blocked by the indexer while it writes
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(SCHEMA)
+        _local.connection = connection
+        _local.path = path
+    return connection
+
+def is_indexable(rel_path, st):
+    return can_extract(rel_path) and st.st_size <= settings.CONTENT_INDEX_MAX_FILE_SIZE
+
+def store_document(connection, rel_path, st):
+    """Extract one file and replace its row in the index. Returns False if extraction failed."""
+    full_path = os.path.join(settings.FILE_STORAGE_ROOT, rel_path)
+    error = None
+    try:
+        body = extract_text(full_path, settings.CONTENT_INDEX_MAX_CHARS)
+    except Exception as e:
+        print(f"Could not extract text from {rel_path}: {e}")
+        body = ''
+        error = str(e)[:500]
+
+    row = connection.execute('SELECT id FROM documents WHERE path = ?', (rel_path,)).fetchone()
+    if row is None:
+        doc_id = connection.execute(
+            'INSERT INTO documents (path, size, mtime_ns, error) VALUES (?, ?, ?, ?)',
+            (rel_path, st.st_size, st.st_mtime_ns, error)
+        ).lastrowid
+    else:
+        doc_id = row[0]
+        connection.execute(
+            'UPDATE documents SET size = ?, mtime_ns = ?, error = ? WHERE id = ?',
+            (st.st_size, st.st_mtime_ns, error, doc_id)
+        )
+        connection.execute('DELETE FROM contents WHERE rowid = ?', (doc_id,))
+    connection.execute(
+        'INSERT INTO contents (rowid, name, body) VALUES (?, ?, ?)',
+        (doc_id, os.path.basename(rel_path), body)
+    )
+    return error is None
+
+def delete_documents(connection, doc_ids):
+    for doc_id in doc_ids:
+        connection.execute('DELETE FROM contents WHERE rowid = ?', (doc_id,))
+        connection.execute('DELETE FROM documents WHERE id = ?', (doc_id,))
+
+def subtree_clause(rel_path):
+    """SQL condition and parameters matching rel_path and everything below it"""
+    rel_path = normalize_rel_path(rel_path)
+    if not rel_path:
+        return '1', []
+    prefix = rel_path + '/'
+    return '(d.path = ? OR substr(d.path, 1, ?) = ?)', [rel_path, len(prefix), prefix]
+
+def refresh_content_index(subtree=''):
+    """Extract new and changed files below subtree and drop the ones that are gone"""
+    connection = get_connection()
+    base_path = settings.FILE_STORAGE_ROOT
+    clause, params = subtree_clause(subtree)
+    existing = {
+        path: (doc_id, size, mtime_ns)
+        for doc_id, path, size, mtime_ns in connection.execute(
+            f'SELECT d.id, d.path, d.size, d.mtime_ns FROM documents d WHERE {clause}', params
+        )
+    }
+
+    stats = {'indexed': 0, 'failed': 0, 'removed': 0, 'unchanged': 0}
+    pending = 0
+    for rel_path, name, st in iter_storage_files(base_path, subtree):
+        if not is_indexable(rel_path, st):
+            continue
+        current = existing.pop(rel_path, None)
+        if current is not None and current[1] == st.st_size and current[2] == st.st_mtime_ns:
+            stats['unchanged'] += 1
+            continue
+
+        if store_document(connection, rel_path, st):
+            stats['indexed'] += 1
+        else:
+            stats['failed'] += 1
+        pending += 1
+        if pending >= COMMIT_EVERY:
+            connection.commit()
+            pending = 0
+
+    # Files that vanished, or grew past the size limit
+    delete_documents(connection, [doc_id for doc_id, size, mtime_ns in existing.values()])
+    stats['removed'] = len(existing)
+    connection.commit()
+    return stats
+
+def update_document(rel_path):
+    """Bring one file (or a removed folder) up to date in the index"""
+    rel_path = normalize_rel_path(rel_path)
+    connection = get_connection()
+    full_path = os.path.join(settings.FILE_STORAGE_ROOT, rel_path)
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        st = None
+
+    if st is not None and os.path.isfile(full_path) and is_indexable(rel_path, st):
+        row = connection.execute('SELECT size, mtime_ns FROM documents WHERE path = ?', (rel_path,)).fetchone()
+        if row != (st.st_size, st.st_mtime_ns):
+            store_document(connection, rel_path, st)
+    elif st is None or not os.path.isdir(full_path):
+        clause, params = subtree_clause(rel_path)
+        doc_ids = [doc_id for (doc_id,) in connection.execute(f'SELECT d.id FROM documents d WHERE {clause}', params)]
+        delete_documents(connection, doc_ids)
+    connection.commit()
+
+def fts_query(text):
+    """Turn user input into an FTS5 query: every word must match, the last one as a prefix"""
+    terms = [term.replace('"', '""') for term in text.split()]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+def search_contents(user_permissions, text, limit=None):
+    """Return (results, truncated) ranked best first, each with an HTML snippet.
+
+    Only files inside folders the user can read are returned.
+    """
+    if limit is None:
+        limit = settings.SEARCH_RESULT_LIMIT
+    query = fts_query(text)
+    folders = readable_folders(user_permissions)
+    if query is None or folders == []:
+        return [], False
+
+    clauses = []
+    params = [MATCH_START, MATCH_END, query]
+    if folders is not None:
+        for folder in folders:
+            clause, folder_params = subtree_clause(folder)
+            clauses.append(clause)
+            params += folder_params
+    where = f"AND ({' OR '.join(clauses)})" if clauses else ''
+    params.append(limit + 1)
+
+    rows = get_connection().execute(f"""
+        SELECT d.path, d.size, snippet(contents, 1, ?, ?, '…', 16)
+        FROM contents JOIN documents d ON d.id = contents.rowid
+        WHERE contents MATCH ? {where}
+        ORDER BY bm25(contents, 5.0, 1.0)
+        LIMIT ?
+    """, params).fetchall()
+
+    results = [
+        {'path': path, 'size': size, 'snippet': format_snippet(snippet)}
+        for path, size, snippet in rows[:limit]
+    ]
+    return results, len(rows) > limit
+
+def format_snippet(snippet):
+    return html.escape(snippet).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+def content_index_is_built():
+    return get_connection().execute('SELECT 1 FROM documents LIMIT 1').fetchone() is not None
+
+class ContentIndexer:
+    """Background thread that re-indexes files changed through the web views"""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name='content-indexer', daemon=True)
+        self.thread.start()
+
+    def submit(self, rel_path):
+        with self.lock:
+            if rel_path in self.pending:
+                return
+            self.pending.add(rel_path)
+        self.queue.put(rel_path)
+
+    def run(self):
+        while True:
+            rel_path = self.queue.get()
+            with self.lock:
+                self.pending.discard(rel_path)
+            try:
+                update_document(rel_path)
+            except Exception as e:
+                print(f"Content index update failed for {rel_path}: {e}")
+
+_indexer = None
+_indexer_lock = threading.Lock()
+
+def queue_content_update(rel_path):
+    """Re-index a file, or drop a deleted file or folder, in the background"""
+    global _indexer
+    if not settings.CONTENT_INDEX_ENABLED:
+        return
+    if _indexer is None:
+        with _indexer_lock:
+            if _indexer is None:
+                _indexer = ContentIndexer()
+    _indexer.submit(normalize_rel_path(rel_path))
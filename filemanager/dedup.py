@@ -0,0 +1,189 @@
+import os
+import stat
+import uuid
+import errno
+import shutil
+import hashlib
+from django.conf import settings
+from django.db import transaction
+from .models import ContentBlob, ContentReference
+from .uploads import unique_destination
+
+STREAM_CHUNK_SIZE = 64 * 1024
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+def blob_path(digest):
+    return os.path.join(settings.CONTENT_STORE_ROOT, digest[:2], digest[2:4], digest)
+
+def temp_path():
+    tmp_dir = os.path.join(settings.CONTENT_STORE_ROOT, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, f'{uuid.uuid4().hex}.part')
+
+def write_hashed(chunks):
+    """Write an iterable of byte chunks to a temp file in the store, hashing on the way.
+
+    Returns (temp_path, sha256 hex digest, size).
+    """
+    path = temp_path()
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, 'wb') as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        discard(path)
+        raise
+    return path, digest.hexdigest(), size
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(STREAM_CHUNK_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+def remove_file(path):
+    """os.remove that also works for a file linked to a read-only blob.
+
+    Windows refuses to delete a read-only file, so the bit is cleared
+    first; the other links share it, and release_path sets it again on a
+    blob that is still referenced.
+    """
+    try:
+        os.remove(path)
+    except PermissionError:
+        mode = os.stat(path).st_mode
+        if mode & stat.S_IWRITE:
+            raise
+        os.chmod(path, mode | stat.S_IWRITE)
+        try:
+            os.remove(path)
+        except OSError:
+            os.chmod(path, mode)
+            raise
+
+def discard(path):
+    try:
+        remove_file(path)
+    except FileNotFoundError:
+        pass
+
+def move_into_store(src_path, target):
+    """os.replace that also works when src_path is on another volume.
+
+    Across volumes the copy goes to a temp name next to target first, so
+    nobody can link a half-copied blob.
+    """
+    try:
+        os.replace(src_path, target)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    tmp_path = f'{target}.{uuid.uuid4().hex}.part'
+    try:
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        discard(tmp_path)
+        raise
+    discard(src_path)
+
+def copy_exclusive(src_path, dest_path):
+    """Copy to dest_path, raising FileExistsError instead of overwriting a file created meanwhile"""
+    with open(src_path, 'rb') as src, open(dest_path, 'xb') as dest:
+        shutil.copyfileobj(src, dest, STREAM_CHUNK_SIZE)
+
+def link_into_tree(src_path, digest, size, dest_dir, filename, rel_folder):
+    """Store src_path under its digest and hardlink it into the browsable tree.
+
+    src_path is consumed. When the digest is already stored the new bytes
+    are dropped and the existing blob is linked instead. Blobs are made
+    read-only so an in-place edit through one path cannot silently change
+    every other copy. Returns the filename actually used in dest_dir.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    target = blob_path(digest)
+
+    with transaction.atomic():
+        blob, created = ContentBlob.objects.get_or_create(digest=digest, defaults={'size': size})
+        if os.path.exists(target):
+            discard(src_path)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            move_into_store(src_path, target)
+            os.chmod(target, READ_ONLY)
+
+        while True:
+            filename, file_path = unique_destination(dest_dir, filename)
+            try:
+                os.link(target, file_path)
+                break
+            except FileExistsError:
+                # Another upload took the name in the meantime
+                continue
+            except OSError as e:
+                # No hardlinks here (different volume or filesystem): keep a plain copy
+                print(f"Could not hardlink {target} to {file_path}: {e}")
+                try:
+                    copy_exclusive(target, file_path)
+                except FileExistsError:
+                    continue
+                if not blob.references.exists():
+                    discard(target)
+                    blob.delete()
+                return filename
+
+        rel_path = os.path.join(rel_folder, filename).replace('\\', '/').lstrip('/')
+        ContentReference.objects.update_or_create(path=rel_path, defaults={'blob': blob})
+
+    return filename
+
+def release_path(rel_path):
+    """Drop the reference held by a deleted file and the blob once unreferenced"""
+    rel_path = rel_path.replace('\\', '/').strip('/')
+    with transaction.atomic():
+        reference = ContentReference.objects.select_related('blob').filter(path=rel_path).first()
+        if reference is None:
+            return
+        blob = reference.blob
+        reference.delete()
+        if not blob.references.exists():
+            discard(blob_path(blob.digest))
+            blob.delete()
+        else:
+            try:
+                os.chmod(blob_path(blob.digest), READ_ONLY)
+            except FileNotFoundError:
+                pass
+
+def prune_references():
+    """Remove references whose file was deleted or replaced outside the app.
+
+    Returns (references removed, blobs removed).
+    """
+    removed_refs = 0
+    removed_blobs = 0
+    for reference in ContentReference.objects.select_related('blob').iterator():
+        full_path = os.path.join(settings.FILE_STORAGE_ROOT, reference.path)
+        try:
+            still_linked = os.path.samefile(full_path, blob_path(reference.blob.digest))
+        except OSError:
+            still_linked = False
+        if not still_linked:
+            reference.delete()
+            removed_refs += 1
+
+    for blob in ContentBlob.objects.filter(references__isnull=True).iterator():
+        discard(blob_path(blob.digest))
+        blob.delete()
+        removed_blobs += 1
+
+    return removed_refs, removed_blobs
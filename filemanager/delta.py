@@ -0,0 +1,189 @@
+"""Block-signature delta transfer, in the style of rsync/zsync.
+
+The server publishes a signature for a file: for every fixed-size block a
+weak rolling checksum and a strong hash. A client that holds an older copy
+rolls the weak checksum over its own file to find the blocks it already
+has, fetches only the missing ones and rebuilds the new version locally.
+All the rolling work happens on the client; the server only reads blocks.
+
+This module has no Django imports so the client side can run on its own.
+"""
+import os
+import json
+import mmap
+import hashlib
+from itertools import accumulate
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def weak_checksum(block):
+    """rsync's rolling checksum: a is the byte sum, b the sum of the running sums"""
+    a = sum(block) & 0xffff
+    b = sum(accumulate(block)) & 0xffff
+    return a, b
+
+def strong_hash(block):
+    return hashlib.blake2b(block, digest_size=16).hexdigest()
+
+def compute_signature(path, block_size):
+    blocks = []
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+            a, b = weak_checksum(block)
+            blocks.append([a | (b << 16), strong_hash(block)])
+    return {
+        'block_size': block_size,
+        'size': os.path.getsize(path),
+        'sha256': digest.hexdigest(),
+        'blocks': blocks,
+    }
+
+def get_signature(path, block_size, cache_dir=None):
+    """Signature for path, reused from cache_dir while size and mtime are unchanged"""
+    if not cache_dir:
+        return compute_signature(path, block_size)
+
+    st = os.stat(path)
+    key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    cache_path = os.path.join(cache_dir, f'{key}-{block_size}.json')
+    stamp = [st.st_ino, st.st_size, st.st_mtime_ns]
+
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get('stamp') == stamp:
+            return cached['signature']
+    except (OSError, ValueError):
+        pass
+
+    signature = compute_signature(path, block_size)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'stamp': stamp, 'signature': signature}, f)
+    os.replace(tmp_path, cache_path)
+    return signature
+
+def iter_blocks(path, block_size, indices, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield the bytes of the given blocks, in the order requested"""
+    with open(path, 'rb') as f:
+        for index in indices:
+            f.seek(index * block_size)
+            remaining = block_size
+            while remaining > 0:
+                data = f.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+
+def blocks_length(size, block_size, indices):
+    total = 0
+    for index in indices:
+        start = index * block_size
+        total += max(0, min(block_size, size - start))
+    return total
+
+def match_blocks(path, signature):
+    """Find which blocks of the signature already exist in the local file.
+
+    Returns {block index: offset in the local file}.
+    """
+    block_size = signature['block_size']
+    blocks = signature['blocks']
+    if not blocks or not os.path.exists(path) or os.path.getsize(path) == 0:
+        return {}
+
+    table = {}
+    for index, (weak, strong) in enumerate(blocks):
+        table.setdefault(weak, []).append((index, strong))
+
+    found = {}
+
+    def check(data, pos, weak):
+        candidates = table.get(weak)
+        if not candidates:
+            return False
+        strong = strong_hash(data[pos:pos + block_size])
+        matched = False
+        for index, expected in candidates:
+            if expected == strong:
+                found.setdefault(index, pos)
+                matched = True
+        return matched
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        n = len(data)
+        pos = 0
+        if n >= block_size:
+            a, b = weak_checksum(data[0:block_size])
+            while True:
+                if check(data, pos, a | (b << 16)):
+                    pos += block_size
+                    if pos + block_size > n:
+                        break
+                    a, b = weak_checksum(data[pos:pos + block_size])
+                    continue
+                if pos + block_size >= n:
+                    break
+                out_byte = data[pos]
+                in_byte = data[pos + block_size]
+                a = (a - out_byte + in_byte) & 0xffff
+                b = (b - block_size * out_byte + a) & 0xffff
+                pos += 1
+
+        # The final block is usually short; look for it at the same offset and at the end
+        last = len(blocks) - 1
+        tail = signature['size'] - last * block_size
+        if last not in found and 0 < tail < block_size:
+            for pos in (last * block_size, n - tail):
+                if 0 <= pos and pos + tail <= n and strong_hash(data[pos:pos + tail]) == blocks[last][1]:
+                    found[last] = pos
+                    break
+
+    return found
+
+def reconstruct(local_path, signature, found, fetch_missing, out_path):
+    """Write the new version of the file to out_path.
+
+    fetch_missing(indices) must yield the bytes of the missing blocks in
+    ascending index order. Returns the number of bytes fetched.
+    """
+    block_size = signature['block_size']
+    size = signature['size']
+    missing = [index for index in range(len(signature['blocks'])) if index not in found]
+    fetched = 0
+    digest = hashlib.sha256()
+
+    local = open(local_path, 'rb') if found else None
+    try:
+        remote = iter(fetch_missing(missing)) if missing else iter(())
+        pending = b''
+        with open(out_path, 'wb') as out:
+            for index in range(len(signature['blocks'])):
+                length = min(block_size, size - index * block_size)
+                if index in found:
+                    local.seek(found[index])
+                    block = local.read(length)
+                else:
+                    while len(pending) < length:
+                        data = next(remote, None)
+                        if data is None:
+                            raise IOError(f'Server sent too little data for block {index}')
+                        pending += data
+                    block, pending = pending[:length], pending[length:]
+                    fetched += length
+                digest.update(block)
+                out.write(block)
+    finally:
+        if local:
+            local.close()
+
+    if digest.hexdigest() != signature['sha256']:
+        raise IOError('Reconstructed file does not match the server checksum')
+    return fetched
@@ -0,0 +1,253 @@
+import os
+import uuid
+import mimetypes
+import urllib.parse
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+from .compression import iter_compressed
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Requests asking for more ranges than this get the whole file instead
+MAX_RANGES = 32
+
+def file_etag(st):
+    """Strong validator for a file, derived from inode, size and mtime"""
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+def parse_range_header(header, size):
+    """Parse a bytes Range header (RFC 7233) against a file of the given size.
+
+    Returns None when the header is absent, malformed or should be ignored,
+    an empty list when no range is satisfiable, and otherwise a sorted list
+    of (start, end) tuples with inclusive ends and overlaps merged.
+    """
+    if not header:
+        return None
+
+    units, _, range_set = header.partition('=')
+    if units.strip().lower() != 'bytes' or not range_set:
+        return None
+
+    ranges = []
+    for spec in range_set.split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+        first, sep, last = spec.partition('-')
+        if not sep:
+            return None
+        first, last = first.strip(), last.strip()
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else max(start, size - 1)
+                if start < 0 or end < start:
+                    return None
+            else:
+                # Suffix range: the final N bytes
+                suffix = int(last)
+                if suffix < 0:
+                    return None
+                if suffix == 0:
+                    continue
+                start = max(size - suffix, 0)
+                end = size - 1
+        except ValueError:
+            return None
+
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def if_range_matches(request, etag, mtime):
+    """Evaluate If-Range; a Range header is only honoured when this is True"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return if_range == etag
+    if if_range.startswith('W/'):
+        # Weak validators are never good enough for If-Range
+        return False
+    header_mtime = parse_http_date_safe(if_range)
+    return header_mtime is not None and header_mtime == int(mtime)
+
+def conditional_response(request, etag, mtime=None):
+    """Answer If-None-Match / If-Modified-Since (304) or If-Match (412) up front.
+
+    Returns None when the request has to be served normally.
+    """
+    last_modified = int(mtime) if mtime else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+    return response
+
+def iter_file_range(path, start, length, chunk_size=STREAM_CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+def iter_multipart_ranges(path, parts, boundary):
+    for header, start, end in parts:
+        yield header
+        yield from iter_file_range(path, start, end - start + 1)
+    yield f'\r\n--{boundary}--\r\n'.encode('ascii')
+
+def set_validators(response, etag, mtime):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    response['Accept-Ranges'] = 'bytes'
+
+def set_cache_validators(response, etag, mtime):
+    """Validators for responses that the browser should revalidate on every use"""
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    response['Cache-Control'] = 'private, no-cache'
+
+def offload_target(full_path):
+    """Header and value handing full_path to the front-end server, or None to serve it here"""
+    backend = settings.DOWNLOAD_BACKEND
+    if backend == 'xsendfile':
+        return 'X-Sendfile', os.path.abspath(full_path)
+    if backend == 'xaccel':
+        # Only the storage root is mapped to the internal nginx location
+        rel_path = os.path.relpath(os.path.abspath(full_path), os.path.abspath(settings.FILE_STORAGE_ROOT))
+        if rel_path.startswith('..'):
+            return None
+        location = settings.DOWNLOAD_ACCEL_LOCATION.rstrip('/')
+        return 'X-Accel-Redirect', f"{location}/{urllib.parse.quote(rel_path.replace(os.sep, '/'))}"
+    return None
+
+def offload_file(request, header, target, st, filename, content_type, etag):
+    """Let Apache (mod_xsendfile) or nginx send the file, ranges included"""
+    response = HttpResponse(content_type=content_type)
+    response[header] = target
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    set_validators(response, etag, st.st_mtime)
+
+    # The front-end server answers Range itself; remember where it starts for logging
+    ranges = None
+    if if_range_matches(request, etag, st.st_mtime):
+        ranges = parse_range_header(request.headers.get('Range'), st.st_size)
+    response.requested_range_start = ranges[0][0] if ranges else 0
+    return response
+
+def serve_file(request, full_path, filename, etag=None):
+    """Serve a file as an attachment with byte-range support.
+
+    Handles single ranges (206), multiple ranges (206 multipart/byteranges)
+    and unsatisfiable ranges (416). If-Range is checked against the ETag
+    or Last-Modified date so resumed downloads never splice two versions.
+    etag overrides the file's own validator, e.g. when full_path holds a
+    compressed copy of the file the client asked for.
+    """
+    st = os.stat(full_path)
+    size = st.st_size
+    etag = etag or file_etag(st)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    target = offload_target(full_path)
+    if target is not None:
+        return offload_file(request, *target, st, filename, content_type, etag)
+
+    ranges = None
+    if request.method in ('GET', 'HEAD') and if_range_matches(request, etag, st.st_mtime):
+        ranges = parse_range_header(request.headers.get('Range'), size)
+
+    if ranges == []:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        set_validators(response, etag, st.st_mtime)
+        return response
+
+    if ranges is None:
+        # Returned to the WSGI server's wsgi.file_wrapper; waitress then sends it
+        # from its I/O thread and the worker thread is free again
+        response = FileResponse(open(full_path, 'rb'), as_attachment=True, filename=filename, content_type=content_type)
+        response.block_size = settings.DOWNLOAD_BLOCK_SIZE
+        set_validators(response, etag, st.st_mtime)
+        return response
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        length = end - start + 1
+        response = StreamingHttpResponse(iter_file_range(full_path, start, length), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(length)
+    else:
+        boundary = uuid.uuid4().hex
+        parts = []
+        content_length = 0
+        for start, end in ranges:
+            header = (
+                f'\r\n--{boundary}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+            ).encode('ascii')
+            parts.append((header, start, end))
+            content_length += len(header) + end - start + 1
+        content_length += len(f'\r\n--{boundary}--\r\n')
+        response = StreamingHttpResponse(
+            iter_multipart_ranges(full_path, parts, boundary),
+            status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}'
+        )
+        response['Content-Length'] = str(content_length)
+
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    set_validators(response, etag, st.st_mtime)
+    return response
+
+def encoded_etag(etag, encoding):
+    """Validator for the encoded representation of a file"""
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+def serve_encoded_file(request, full_path, filename, encoding, sidecar, etag):
+    """Serve a file with Content-Encoding, from its sidecar or compressed on the fly"""
+    if sidecar:
+        response = serve_file(request, sidecar, filename, etag=etag)
+    else:
+        st = os.stat(full_path)
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = StreamingHttpResponse(iter_compressed(full_path, encoding), content_type=content_type)
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(st.st_mtime)
+    response['Content-Encoding'] = encoding
+    return response
+
+def is_initial_transfer(response):
+    """True when a download response covers the start of the file.
+
+    Resumed and parallel segment requests are not logged as new downloads.
+    """
+    if response.status_code == 200:
+        return getattr(response, 'requested_range_start', 0) == 0
+    if response.status_code == 206:
+        return response.get('Content-Range', '').startswith('bytes 0-')
+    return False
@@ -0,0 +1,131 @@
+"""Plain-text extraction for the content index.
+
+Everything here uses the standard library, except PDFs, which need the
+optional pypdf package and are skipped without it.
+"""
+import os
+import zipfile
+import xml.etree.ElementTree as ET
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+TEXT_EXTENSIONS = {'.txt', '.csv', '.tsv', '.log', '.md', '.nmea', '.ini', '.cfg', '.json', '.xml'}
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+def read_text(path, max_chars):
+    with open(path, 'rb') as f:
+        data = f.read(max_chars)
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # A character cut in half by the size limit
+        if len(data) == max_chars and e.start >= len(data) - 3:
+            return data[:e.start].decode('utf-8')
+        # Legacy code page; latin-1 never fails
+        return data.decode('latin-1')
+
+def xml_texts(stream, tag, block_tag=None):
+    """Yield the text of every tag element, and a newline after each block_tag"""
+    for event, element in ET.iterparse(stream):
+        if element.tag == tag:
+            if element.text:
+                yield element.text
+        elif block_tag and element.tag == block_tag:
+            yield '\n'
+        # Keeps memory flat on large documents
+        element.clear()
+
+def read_docx(path, max_chars):
+    parts = []
+    size = 0
+    with zipfile.ZipFile(path) as archive:
+        names = [name for name in archive.namelist() if name.startswith('word/') and name.endswith('.xml')]
+        # Body first, then headers, footers, footnotes and the like
+        names.sort(key=lambda name: name != 'word/document.xml')
+        for name in names:
+            if not (name == 'word/document.xml' or name.startswith(('word/header', 'word/footer', 'word/footnotes', 'word/endnotes'))):
+                continue
+            with archive.open(name) as stream:
+                # Leaving the loop early stops the parse, so the rest is never read
+                for text in xml_texts(stream, f'{WORD_NS}t', f'{WORD_NS}p'):
+                    parts.append(text)
+                    size += len(text)
+                    if size >= max_chars:
+                        break
+            if size >= max_chars:
+                break
+    return ''.join(parts)[:max_chars]
+
+def read_xlsx(path, max_chars):
+    parts = []
+    size = 0
+    with zipfile.ZipFile(path) as archive:
+        names = archive.namelist()
+        # Cell text lives in the shared string table; numbers and inline strings in the sheets
+        if 'xl/sharedStrings.xml' in names:
+            with archive.open('xl/sharedStrings.xml') as stream:
+                for text in xml_texts(stream, f'{SHEET_NS}t', f'{SHEET_NS}si'):
+                    parts.append(text)
+                    size += len(text)
+                    if size >= max_chars:
+                        break
+        for name in sorted(names):
+            if size >= max_chars:
+                break
+            if not (name.startswith('xl/worksheets/') and name.endswith('.xml')):
+                continue
+            with archive.open(name) as stream:
+                for event, element in ET.iterparse(stream):
+                    if element.tag == f'{SHEET_NS}c':
+                        # Shared strings were read above; booleans and errors are noise
+                        if element.get('t') not in ('s', 'b', 'e'):
+                            text = ' '.join(
+                                child.text for child in element.iter()
+                                if child.tag in (f'{SHEET_NS}v', f'{SHEET_NS}t') and child.text
+                            )
+                            if text:
+                                parts.append(text + '\n')
+                                size += len(text) + 1
+                        element.clear()
+                        if size >= max_chars:
+                            break
+                    elif element.tag == f'{SHEET_NS}row':
+                        element.clear()
+    return ''.join(parts)[:max_chars]
+
+def read_pdf(path, max_chars):
+    parts = []
+    size = 0
+    reader = pypdf.PdfReader(path)
+    for page in reader.pages:
+        text = page.extract_text() or ''
+        parts.append(text)
+        size += len(text)
+        if size >= max_chars:
+            break
+    return '\n'.join(parts)[:max_chars]
+
+EXTRACTORS = {
+    '.docx': read_docx,
+    '.xlsx': read_xlsx,
+}
+if pypdf is not None:
+    EXTRACTORS['.pdf'] = read_pdf
+
+def can_extract(name):
+    ext = os.path.splitext(name)[1].lower()
+    return ext in TEXT_EXTENSIONS or ext in EXTRACTORS
+
+def extract_text(path, max_chars):
+    """Return up to max_chars of a document's text; raises on unreadable files"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in TEXT_EXTENSIONS:
+        return read_text(path, max_chars)
+    if ext in EXTRACTORS:
+        return EXTRACTORS[ext](path, max_chars)
+    raise ValueError(f'No extractor for {ext or "files without an extension"}')
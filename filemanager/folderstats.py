@@ -0,0 +1,165 @@
+import os
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .indexing import normalize_rel_path, subtree_filter
+from .models import FolderStats
+
+STATS_BATCH_SIZE = 1000
+
+def parent_path(rel_path):
+    return rel_path.rsplit('/', 1)[0] if '/' in rel_path else ''
+
+def ancestor_paths(rel_folder):
+    """The folder itself and every folder above it, root ('') first"""
+    rel_folder = normalize_rel_path(rel_folder)
+    paths = ['']
+    if rel_folder:
+        parts = rel_folder.split('/')
+        paths += ['/'.join(parts[:i + 1]) for i in range(len(parts))]
+    return paths
+
+def apply_delta(rel_folder, size, count, mtime=None):
+    """Add size bytes and count files to a folder and all folders above it.
+
+    Only folders that already have a row are touched; a missing row would
+    start from zero and be wrong, so it is left for the reconciler to create.
+    """
+    changes = {
+        'total_size': Greatest(F('total_size') + size, Value(0)),
+        'file_count': Greatest(F('file_count') + count, Value(0)),
+        'updated_at': timezone.now(),
+    }
+    if mtime is not None:
+        changes['latest_mtime'] = Greatest(F('latest_mtime'), Value(float(mtime)))
+    FolderStats.objects.filter(path__in=ancestor_paths(rel_folder)).update(**changes)
+
+def record_file_added(rel_path):
+    rel_path = normalize_rel_path(rel_path)
+    try:
+        st = os.stat(os.path.join(settings.FILE_STORAGE_ROOT, rel_path))
+    except OSError:
+        return
+    apply_delta(parent_path(rel_path), st.st_size, 1, st.st_mtime)
+
+def record_file_removed(rel_path, size):
+    # latest_mtime cannot be rolled back without a scan; the reconciler corrects it
+    apply_delta(parent_path(normalize_rel_path(rel_path)), -size, -1)
+
+def record_folder_created(rel_folder):
+    rel_folder = normalize_rel_path(rel_folder)
+    if not rel_folder or not FolderStats.objects.filter(path=parent_path(rel_folder)).exists():
+        return
+    FolderStats.objects.get_or_create(path=rel_folder, defaults={'parent': parent_path(rel_folder)})
+
+def record_folder_removed(rel_folder):
+    rel_folder = normalize_rel_path(rel_folder)
+    with transaction.atomic():
+        row = FolderStats.objects.filter(path=rel_folder).first()
+        if row is not None and (row.total_size or row.file_count):
+            apply_delta(parent_path(rel_folder), -row.total_size, -row.file_count)
+        FolderStats.objects.filter(subtree_filter(rel_folder)).delete()
+
+def get_folder_stats(rel_folder):
+    return FolderStats.objects.filter(path=normalize_rel_path(rel_folder)).first()
+
+def child_folder_stats(rel_folder):
+    """Stats for the folders directly inside rel_folder, keyed by path"""
+    rows = FolderStats.objects.filter(parent=normalize_rel_path(rel_folder)).exclude(path='')
+    return {row.path: row for row in rows}
+
+def scan_folder_totals(base_path, start=''):
+    """Walk a subtree once and return {rel_folder: [total_size, file_count, latest_mtime]}"""
+    start = normalize_rel_path(start)
+    totals = {}
+    order = []
+    stack = [start]
+    while stack:
+        rel_dir = stack.pop()
+        order.append(rel_dir)
+        size = count = 0
+        latest = 0.0
+        full_dir = os.path.join(base_path, rel_dir)
+        try:
+            with os.scandir(full_dir) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(f"{rel_dir}/{entry.name}" if rel_dir else entry.name)
+                        elif entry.is_file():
+                            st = entry.stat()
+                            size += st.st_size
+                            count += 1
+                            latest = max(latest, st.st_mtime)
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"Error reading directory {full_dir}: {e}")
+        totals[rel_dir] = [size, count, latest]
+
+    # Every folder is listed after its parent, so walking backwards rolls children up first
+    for rel_dir in reversed(order):
+        if rel_dir == start:
+            continue
+        size, count, latest = totals[rel_dir]
+        parent = totals[parent_path(rel_dir)]
+        parent[0] += size
+        parent[1] += count
+        parent[2] = max(parent[2], latest)
+    return totals
+
+def reconcile_folder_stats(subtree=''):
+    """Rebuild the stats for a subtree from the filesystem, writing only rows that drifted.
+
+    When only a subtree is reconciled, the folders above it get the
+    difference applied so their totals stay consistent.
+    """
+    subtree = normalize_rel_path(subtree)
+    base_path = settings.FILE_STORAGE_ROOT
+    if os.path.isdir(os.path.join(base_path, subtree)):
+        totals = scan_folder_totals(base_path, subtree)
+    else:
+        totals = {}
+
+    stats = {'created': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+    now = timezone.now()
+    with transaction.atomic():
+        existing = {row.path: row for row in FolderStats.objects.filter(subtree_filter(subtree))}
+        old_root = existing.get(subtree)
+        old_root_totals = (old_root.total_size, old_root.file_count) if old_root else None
+
+        to_create = []
+        to_update = []
+        for path, (size, count, latest) in totals.items():
+            row = existing.pop(path, None)
+            if row is None:
+                to_create.append(FolderStats(
+                    path=path, parent=parent_path(path),
+                    total_size=size, file_count=count, latest_mtime=latest
+                ))
+            elif (row.total_size, row.file_count, row.latest_mtime) != (size, count, latest):
+                row.total_size = size
+                row.file_count = count
+                row.latest_mtime = latest
+                row.updated_at = now
+                to_update.append(row)
+            else:
+                stats['unchanged'] += 1
+
+        FolderStats.objects.bulk_create(to_create, batch_size=STATS_BATCH_SIZE)
+        FolderStats.objects.bulk_update(to_update, ['total_size', 'file_count', 'latest_mtime', 'updated_at'], batch_size=STATS_BATCH_SIZE)
+        stale = [row.pk for row in existing.values()]
+        for i in range(0, len(stale), STATS_BATCH_SIZE):
+            FolderStats.objects.filter(pk__in=stale[i:i + STATS_BATCH_SIZE]).delete()
+
+        if subtree and old_root_totals is not None:
+            size, count, latest = totals.get(subtree, [0, 0, 0.0])
+            if (size, count) != old_root_totals:
+                apply_delta(parent_path(subtree), size - old_root_totals[0], count - old_root_totals[1], latest or None)
+
+        stats['created'] = len(to_create)
+        stats['updated'] = len(to_update)
+        stats['removed'] = len(stale)
+    return stats
@@ -0,0 +1,203 @@
+import os
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Substr
+from django.db.models.lookups import Exact
+from .models import FileIndexEntry
+
+INDEX_BATCH_SIZE = 1000
+
+def normalize_rel_path(path):
+    """Return a storage-relative path with forward slashes and no leading/trailing slash"""
+    return str(path).replace('\\', '/').strip('/')
+
+def iter_storage_files(base_path, start=''):
+    """Yield (rel_path, name, stat_result) for every file below start using scandir"""
+    start = normalize_rel_path(start)
+    stack = [start]
+    while stack:
+        rel_dir = stack.pop()
+        full_dir = os.path.join(base_path, rel_dir)
+        try:
+            with os.scandir(full_dir) as it:
+                for entry in it:
+                    rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(rel_path)
+                        elif entry.is_file():
+                            yield rel_path, entry.name, entry.stat()
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"Error reading directory {full_dir}: {e}")
+
+def build_index_entry(rel_path, name, st):
+    return FileIndexEntry(
+        path=rel_path,
+        folder=os.path.dirname(rel_path),
+        name=name[:255],
+        name_lower=name.lower()[:255],
+        extension=os.path.splitext(name)[1].lower()[:50],
+        size=st.st_size,
+        mtime=st.st_mtime,
+    )
+
+def subtree_filter(rel_path):
+    """Q matching rel_path and everything below it.
+
+    Compares a prefix of the path rather than using startswith, which
+    SQLite turns into a LIKE that ignores case, so 'VesselA' would match
+    'vessela/...' too.
+    """
+    rel_path = normalize_rel_path(rel_path)
+    if not rel_path:
+        return Q()
+    prefix = rel_path + '/'
+    return Q(path=rel_path) | Q(Exact(Substr('path', 1, len(prefix)), prefix))
+
+def refresh_file_index(subtree='', full=False):
+    """Bring the index for a subtree in line with the filesystem.
+
+    Only rows whose size or mtime changed are rewritten, so repeated runs
+    over an unchanged tree cost one scandir walk and no writes.
+    """
+    base_path = settings.FILE_STORAGE_ROOT
+    scope = FileIndexEntry.objects.filter(subtree_filter(subtree))
+    stats = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+
+    if full:
+        stats['removed'] = scope.delete()[0]
+        existing = {}
+    else:
+        existing = {
+            path: (pk, size, mtime)
+            for pk, path, size, mtime in scope.values_list('pk', 'path', 'size', 'mtime').iterator()
+        }
+
+    to_create = []
+    to_update = []
+
+    def flush():
+        with transaction.atomic():
+            if to_create:
+                FileIndexEntry.objects.bulk_create(to_create, batch_size=INDEX_BATCH_SIZE)
+            if to_update:
+                FileIndexEntry.objects.bulk_update(to_update, ['size', 'mtime', 'digest'], batch_size=INDEX_BATCH_SIZE)
+        to_create.clear()
+        to_update.clear()
+
+    for rel_path, name, st in iter_storage_files(base_path, subtree):
+        current = existing.pop(rel_path, None)
+        if current is None:
+            to_create.append(build_index_entry(rel_path, name, st))
+            stats['added'] += 1
+        elif current[1] != st.st_size or current[2] != st.st_mtime:
+            entry = build_index_entry(rel_path, name, st)
+            entry.pk = current[0]
+            to_update.append(entry)
+            stats['updated'] += 1
+        else:
+            stats['unchanged'] += 1
+
+        if len(to_create) + len(to_update) >= INDEX_BATCH_SIZE:
+            flush()
+    flush()
+
+    # Whatever is left in existing was not seen on disk any more
+    stale = [pk for pk, size, mtime in existing.values()]
+    for i in range(0, len(stale), INDEX_BATCH_SIZE):
+        FileIndexEntry.objects.filter(pk__in=stale[i:i + INDEX_BATCH_SIZE]).delete()
+    stats['removed'] += len(stale)
+
+    return stats
+
+def index_file(rel_path):
+    """Add or refresh a single file in the index after it was written by a view"""
+    rel_path = normalize_rel_path(rel_path)
+    full_path = os.path.join(settings.FILE_STORAGE_ROOT, rel_path)
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        return remove_from_index(rel_path)
+
+    entry = build_index_entry(rel_path, os.path.basename(rel_path), st)
+    FileIndexEntry.objects.update_or_create(
+        path=rel_path,
+        defaults={
+            'folder': entry.folder,
+            'name': entry.name,
+            'name_lower': entry.name_lower,
+            'extension': entry.extension,
+            'size': entry.size,
+            'mtime': entry.mtime,
+            'digest': '',
+        }
+    )
+
+def index_files(rel_paths):
+    """Add or refresh many files at once, with a few bulk statements instead of one per file"""
+    entries = []
+    for rel_path in rel_paths:
+        rel_path = normalize_rel_path(rel_path)
+        try:
+            st = os.stat(os.path.join(settings.FILE_STORAGE_ROOT, rel_path))
+        except OSError:
+            continue
+        entries.append(build_index_entry(rel_path, os.path.basename(rel_path), st))
+
+    paths = [entry.path for entry in entries]
+    with transaction.atomic():
+        for i in range(0, len(paths), INDEX_BATCH_SIZE):
+            FileIndexEntry.objects.filter(path__in=paths[i:i + INDEX_BATCH_SIZE]).delete()
+        FileIndexEntry.objects.bulk_create(entries, batch_size=INDEX_BATCH_SIZE)
+
+def remove_from_index(rel_path):
+    """Drop a file, or a folder and everything below it, from the index"""
+    FileIndexEntry.objects.filter(subtree_filter(rel_path)).delete()
+
+def readable_folders(user_permissions):
+    """Folders a user can read, or None when they can read everything"""
+    folders = []
+    for perm in user_permissions:
+        if perm['permission'] not in ['read', 'write', 'admin']:
+            continue
+        folder_path = normalize_rel_path(perm['folder_path'])
+        if not folder_path:
+            return None
+        folders.append(folder_path)
+    return folders
+
+def permission_filter(user_permissions):
+    """Build a Q restricting index rows to the folders a user can read.
+
+    Returns None when the user has no readable folders at all.
+    """
+    folders = readable_folders(user_permissions)
+    if folders is None:
+        return Q()
+    condition = None
+    for folder_path in folders:
+        q = subtree_filter(folder_path)
+        condition = q if condition is None else condition | q
+    return condition
+
+def search_index(user_permissions, query, file_type='', limit=None):
+    """Return (entries, truncated) for files whose name contains query"""
+    if limit is None:
+        limit = settings.SEARCH_RESULT_LIMIT
+
+    allowed = permission_filter(user_permissions)
+    if allowed is None:
+        return [], False
+
+    entries = FileIndexEntry.objects.filter(allowed, name_lower__contains=query.lower())
+    if file_type:
+        entries = entries.filter(extension=f'.{file_type.lower().lstrip(".")}')
+
+    entries = list(entries.order_by('name_lower', 'path')[:limit + 1])
+    return entries[:limit], len(entries) > limit
+
+def index_is_built():
+    return FileIndexEntry.objects.exists()
@@ -0,0 +1,340 @@
+"""Bulk ingest of many small files sent as one tar or zip archive.
+
+The request body is the archive itself. Tar streams (plain, gzip, bzip2,
+xz, or zstd with the optional zstandard package) are extracted as they
+arrive; zip needs its central directory at the end, so it is spooled to
+the staging area first. Every member is written to staging before
+anything is placed, so a rejected archive leaves the tree untouched.
+Placing the files then costs one directory listing per folder rather than
+an exists() probe per name, and the index, folder stats and activity log
+are updated with bulk statements in a single transaction.
+"""
+import os
+import stat
+import uuid
+import shutil
+import tarfile
+import zipfile
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+from .activity import record_activities
+from .contentindex import queue_content_update
+from .dedup import discard, link_into_tree, write_hashed
+from .folderstats import apply_delta, record_folder_created
+from .indexing import index_files, normalize_rel_path
+from .uploads import STREAM_CHUNK_SIZE
+from .utils import has_permission
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZIP_MAGIC = (b'PK\x03\x04', b'PK\x05\x06')
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Reported back to the client, not all of them
+MAX_SKIPPED_REPORTED = 100
+
+class IngestError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class LimitedReader:
+    """File-like view of the request body that refuses to read past limit bytes.
+
+    head holds bytes already read to sniff the format; they are returned first.
+    """
+
+    def __init__(self, stream, limit, head=b''):
+        self.stream = stream
+        self.limit = limit
+        self.head = head
+        self.consumed = len(head)
+
+    def read(self, size=-1):
+        if self.head:
+            data, self.head = (self.head, b'') if size < 0 or size >= len(self.head) else (self.head[:size], self.head[size:])
+            return data
+        data = self.stream.read(size if size is not None and size >= 0 else STREAM_CHUNK_SIZE * 16)
+        self.consumed += len(data)
+        if self.consumed > self.limit:
+            raise IngestError(f'Archive is larger than the {settings.INGEST_MAX_ARCHIVE_SIZE} byte limit', status=413)
+        return data
+
+def clean_member_path(name):
+    """Turn an archive member name into safe path segments, or None if it must be skipped.
+
+    Absolute paths, drive letters and '..' are rejected outright rather
+    than rewritten, so a hostile archive cannot land anything outside the
+    target folder.
+    """
+    name = name.replace('\\', '/')
+    if name.startswith('/') or (len(name) > 1 and name[1] == ':'):
+        return None
+    parts = []
+    for part in name.split('/'):
+        if part in ('', '.'):
+            continue
+        if part == '..':
+            return None
+        try:
+            part = get_valid_filename(part)
+        except SuspiciousFileOperation:
+            # Nothing usable is left of a segment like ' ' or '""'
+            return None
+        parts.append(part)
+    return parts or None
+
+class Ingest:
+    """One archive being ingested into rel_folder on behalf of user"""
+
+    def __init__(self, user, rel_folder, ip_address):
+        self.user = user
+        self.rel_folder = normalize_rel_path(rel_folder)
+        self.ip_address = ip_address
+        self.staging_dir = os.path.join(settings.UPLOAD_STAGING_ROOT, f'ingest-{uuid.uuid4().hex}')
+        # (folder below rel_folder as segments, filename, temp path, digest, size)
+        self.staged = []
+        self.folders = set()
+        self.skipped = []
+        self.total_size = 0
+        self.permissions = {}
+
+    def skip(self, name, reason):
+        if len(self.skipped) < MAX_SKIPPED_REPORTED:
+            self.skipped.append({'name': name, 'reason': reason})
+
+    def can_write(self, rel_folder):
+        # Deeper grants can narrow access, so every destination folder is checked
+        allowed = self.permissions.get(rel_folder)
+        if allowed is None:
+            allowed = self.permissions[rel_folder] = has_permission(self.user, rel_folder, 'write')
+        return allowed
+
+    def destination_folder(self, parts):
+        return '/'.join([self.rel_folder] + parts) if self.rel_folder else '/'.join(parts)
+
+    def add_folder(self, name):
+        parts = clean_member_path(name)
+        if parts is None:
+            self.skip(name, 'unsafe path')
+            return
+        for i in range(1, len(parts) + 1):
+            self.folders.add(tuple(parts[:i]))
+
+    def add_file(self, name, size, chunks):
+        """Stage one member; chunks yields its bytes"""
+        parts = clean_member_path(name)
+        if parts is None:
+            self.skip(name, 'unsafe path')
+            return
+        if size > settings.INGEST_MAX_FILE_SIZE:
+            self.skip(name, 'too large')
+            return
+        folder, filename = parts[:-1], parts[-1]
+        if not self.can_write(self.destination_folder(folder)):
+            raise IngestError(f'Permission denied for {name}', status=403)
+        if len(self.staged) >= settings.INGEST_MAX_FILES:
+            raise IngestError(f'Archive has more than {settings.INGEST_MAX_FILES} files', status=413)
+        if self.total_size + size > settings.INGEST_MAX_TOTAL_SIZE:
+            raise IngestError(f'Archive expands to more than {settings.INGEST_MAX_TOTAL_SIZE} bytes', status=413)
+
+        limited = self.check_size(chunks, name, size)
+        if settings.DEDUP_STORAGE_ENABLED:
+            tmp_path, digest, written = write_hashed(limited)
+        else:
+            digest = None
+            tmp_path = os.path.join(self.staging_dir, f'{len(self.staged)}.part')
+            written = 0
+            with open(tmp_path, 'wb') as f:
+                for chunk in limited:
+                    f.write(chunk)
+                    written += len(chunk)
+
+        self.staged.append((tuple(folder), filename, tmp_path, digest, written))
+        self.total_size += written
+        for i in range(1, len(folder) + 1):
+            self.folders.add(tuple(folder[:i]))
+
+    def check_size(self, chunks, name, size):
+        # Headers can lie about sizes (zip bombs); the bytes actually read are what count
+        written = 0
+        for chunk in chunks:
+            written += len(chunk)
+            if written > size:
+                raise IngestError(f'{name} is larger than its archive header says', status=413)
+            if self.total_size + written > settings.INGEST_MAX_TOTAL_SIZE:
+                raise IngestError(f'Archive expands to more than {settings.INGEST_MAX_TOTAL_SIZE} bytes', status=413)
+            yield chunk
+
+    def read_tar(self, reader):
+        try:
+            archive = tarfile.open(fileobj=reader, mode='r|*')
+        except tarfile.TarError:
+            raise IngestError('Not a tar or zip archive')
+        with archive:
+            try:
+                for member in archive:
+                    if member.isdir():
+                        self.add_folder(member.name)
+                    elif member.isreg():
+                        source = archive.extractfile(member)
+                        self.add_file(member.name, member.size, iter(lambda: source.read(STREAM_CHUNK_SIZE), b''))
+                    else:
+                        self.skip(member.name, 'not a regular file')
+            except (tarfile.TarError, EOFError, OSError) as e:
+                raise IngestError(f'Damaged archive: {e}')
+
+    def read_zip(self, reader):
+        spool_path = os.path.join(self.staging_dir, 'archive.zip')
+        with open(spool_path, 'wb') as f:
+            shutil.copyfileobj(reader, f, STREAM_CHUNK_SIZE)
+        try:
+            with zipfile.ZipFile(spool_path) as archive:
+                for info in archive.infolist():
+                    mode = info.external_attr >> 16
+                    if info.is_dir():
+                        self.add_folder(info.filename)
+                    elif stat.S_ISLNK(mode):
+                        self.skip(info.filename, 'not a regular file')
+                    elif info.flag_bits & 0x1:
+                        self.skip(info.filename, 'encrypted')
+                    else:
+                        with archive.open(info) as source:
+                            self.add_file(info.filename, info.file_size, iter(lambda: source.read(STREAM_CHUNK_SIZE), b''))
+        except (zipfile.BadZipFile, zipfile.LargeZipFile, NotImplementedError, EOFError) as e:
+            raise IngestError(f'Damaged archive: {e}')
+        finally:
+            discard(spool_path)
+
+    def read(self, stream, content_length):
+        if content_length and content_length > settings.INGEST_MAX_ARCHIVE_SIZE:
+            raise IngestError(f'Archive is larger than the {settings.INGEST_MAX_ARCHIVE_SIZE} byte limit', status=413)
+        head = stream.read(4)
+        reader = LimitedReader(stream, settings.INGEST_MAX_ARCHIVE_SIZE, head)
+        if head.startswith(ZIP_MAGIC):
+            self.read_zip(reader)
+        elif head == ZSTD_MAGIC:
+            if zstandard is None:
+                raise IngestError('zstd archives need the zstandard package on the server', status=415)
+            self.read_tar(zstandard.ZstdDecompressor().stream_reader(reader))
+        else:
+            self.read_tar(reader)
+
+    def place(self):
+        """Move the staged files into the tree and record them. Returns the placed rel paths."""
+        base_path = settings.FILE_STORAGE_ROOT
+        taken = {}
+        placed = []
+        created_folders = []
+
+        try:
+            # The target folder itself may be new as well
+            for folder in [()] + sorted(self.folders, key=len):
+                rel_folder = self.destination_folder(list(folder))
+                full_folder = os.path.join(base_path, rel_folder)
+                if not os.path.isdir(full_folder):
+                    if not self.can_write(rel_folder):
+                        raise IngestError(f'Permission denied for {rel_folder}', status=403)
+                    os.makedirs(full_folder, exist_ok=True)
+                    created_folders.append(rel_folder)
+
+            with transaction.atomic():
+                for rel_folder in created_folders:
+                    record_folder_created(rel_folder)
+
+                folder_totals = {}
+                for folder, filename, tmp_path, digest, size in self.staged:
+                    rel_folder = self.destination_folder(list(folder))
+                    full_folder = os.path.join(base_path, rel_folder)
+                    names = taken.get(rel_folder)
+                    if names is None:
+                        names = taken[rel_folder] = set(os.listdir(full_folder))
+                    filename = self.unique_name(names, filename)
+
+                    if digest is not None:
+                        filename = link_into_tree(tmp_path, digest, size, full_folder, filename, rel_folder)
+                    else:
+                        target = os.path.join(full_folder, filename)
+                        try:
+                            os.replace(tmp_path, target)
+                        except OSError:
+                            # Staging area on a different volume
+                            shutil.move(tmp_path, target)
+                    names.add(filename)
+                    rel_path = f'{rel_folder}/{filename}' if rel_folder else filename
+                    placed.append((rel_path, filename, size))
+                    totals = folder_totals.setdefault(rel_folder, [0, 0])
+                    totals[0] += size
+                    totals[1] += 1
+
+                index_files([rel_path for rel_path, filename, size in placed])
+                now = timezone.now().timestamp()
+                for rel_folder, (size, count) in folder_totals.items():
+                    apply_delta(rel_folder, size, count, now)
+        except BaseException:
+            # Nothing was recorded, so nothing may stay behind in the tree either
+            for rel_path, filename, size in placed:
+                discard(os.path.join(base_path, rel_path))
+            # Deepest first, so each folder is empty by the time it is removed
+            for rel_folder in reversed(created_folders):
+                try:
+                    os.rmdir(os.path.join(base_path, rel_folder))
+                except OSError:
+                    pass
+            raise
+
+        timestamp = timezone.now().isoformat()
+        record_activities([
+            {
+                'user_id': self.user.pk,
+                'filename': filename,
+                'filepath': rel_path,
+                'activity_type': 'upload',
+                'ip_address': self.ip_address,
+                'file_size': size,
+                'timestamp': timestamp,
+            }
+            for rel_path, filename, size in placed
+        ])
+        for rel_path, filename, size in placed:
+            queue_content_update(rel_path)
+        return placed
+
+    @staticmethod
+    def unique_name(names, filename):
+        """Same renaming scheme as unique_destination, checked against a listing taken once"""
+        if filename not in names:
+            return filename
+        name, ext = os.path.splitext(filename)
+        counter = 1
+        while f'{name}_{counter}{ext}' in names:
+            counter += 1
+        return f'{name}_{counter}{ext}'
+
+    def cleanup(self):
+        for folder, filename, tmp_path, digest, size in self.staged:
+            discard(tmp_path)
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+def ingest_archive(user, rel_folder, stream, content_length, ip_address):
+    """Extract an archive from stream into rel_folder. Raises IngestError when it is refused."""
+    ingest = Ingest(user, rel_folder, ip_address)
+    os.makedirs(ingest.staging_dir, exist_ok=True)
+    try:
+        ingest.read(stream, content_length)
+        placed = ingest.place()
+    finally:
+        ingest.cleanup()
+    return {
+        'files': len(placed),
+        'total_size': sum(size for rel_path, filename, size in placed),
+        'folders': len(ingest.folders),
+        'renamed': sum(1 for (rel_path, filename, size), staged in zip(placed, ingest.staged) if filename != staged[1]),
+        'skipped': ingest.skipped,
+    }
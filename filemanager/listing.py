@@ -0,0 +1,264 @@
+import os
+import json
+import base64
+import heapq
+import hashlib
+import threading
+from collections import OrderedDict
+from django.db.models import Max, Q
+from .utils import format_file_size, get_file_icon
+from .models import FolderStats
+from .permissions import get_permission_trie
+from .previews import is_previewable
+
+SORT_FIELDS = {
+    'name': lambda item: item['name'].lower(),
+    'size': lambda item: item['size_bytes'],
+    'modified': lambda item: item['modified'],
+}
+
+def scan_directory(full_path, rel_folder, folder_stats=None):
+    """List a directory with a single scandir pass and one stat per entry.
+
+    folder_stats maps subfolder paths to their FolderStats rows; folders
+    found there are listed with their total size and file count.
+    """
+    folder_stats = folder_stats or {}
+    items = []
+    with os.scandir(full_path) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+                st = entry.stat()
+            except OSError:
+                continue
+
+            rel_path = f"{rel_folder.rstrip('/')}/{entry.name}" if rel_folder.strip('/') else entry.name
+            if is_dir:
+                item = {
+                    'name': entry.name,
+                    'type': 'folder',
+                    'path': rel_path,
+                    'size': '-',
+                    'size_bytes': 0,
+                    'modified': st.st_mtime,
+                    'icon': '📁'
+                }
+                stats = folder_stats.get(rel_path.strip('/'))
+                if stats is not None:
+                    item['size'] = format_file_size(stats.total_size)
+                    item['size_bytes'] = stats.total_size
+                    item['file_count'] = stats.file_count
+                items.append(item)
+            else:
+                extension = os.path.splitext(entry.name)[1].lower()
+                items.append({
+                    'name': entry.name,
+                    'type': 'file',
+                    'path': rel_path,
+                    'size': format_file_size(st.st_size),
+                    'size_bytes': st.st_size,
+                    'modified': st.st_mtime,
+                    'extension': extension,
+                    'icon': get_file_icon(extension),
+                    'previewable': is_previewable(entry.name)
+                })
+    return items
+
+def sort_key(item, sort):
+    return (SORT_FIELDS[sort](item), item['name'].lower(), item['name'])
+
+# Type of the sort field in a cursor key; the name fields that follow are strings
+SORT_KEY_TYPES = {
+    'name': (str,),
+    'size': (int,),
+    'modified': (int, float),
+}
+
+def encode_cursor(item, sort):
+    group = 0 if item['type'] == 'folder' else 1
+    data = json.dumps([sort, group, *sort_key(item, sort)]).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+def decode_cursor(cursor, sort):
+    """Return (group, key) from a cursor, or None when it is malformed or was made for another sort"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(data, list) or len(data) != 5:
+        return None
+    cursor_sort, group, field, lower_name, name = data
+    if cursor_sort != sort or group not in (0, 1) or isinstance(group, bool):
+        return None
+    if isinstance(field, bool) or not isinstance(field, SORT_KEY_TYPES[sort]):
+        return None
+    if not isinstance(lower_name, str) or not isinstance(name, str):
+        return None
+    return group, (field, lower_name, name)
+
+def list_directory(full_path, rel_folder, sort='name', order='asc', cursor=None, limit=200, folder_stats=None):
+    """Return one page of a directory listing plus totals for the whole folder.
+
+    Folders always come before files; within each group items are ordered by
+    the sort field and then by name. The cursor encodes the position of the
+    last item returned, so pages stay consistent while files are added.
+    """
+    if sort not in SORT_FIELDS:
+        sort = 'name'
+    descending = order == 'desc'
+
+    items = scan_directory(full_path, rel_folder, folder_stats)
+    folders = [item for item in items if item['type'] == 'folder']
+    files = [item for item in items if item['type'] == 'file']
+
+    # A cursor that does not fit this listing starts again from the first page
+    position = decode_cursor(cursor, sort) if cursor else None
+    if position is not None:
+        cursor_group, cursor_key = position
+
+        def after(item, group):
+            if group != cursor_group:
+                return group > cursor_group
+            key = sort_key(item, sort)
+            return key < cursor_key if descending else key > cursor_key
+
+        remaining = [[item for item in folders if after(item, 0)], [item for item in files if after(item, 1)]]
+    else:
+        remaining = [folders, files]
+
+    pick = heapq.nlargest if descending else heapq.nsmallest
+    page = []
+    for group in remaining:
+        if len(page) > limit:
+            break
+        page.extend(pick(limit + 1 - len(page), group, key=lambda item: sort_key(item, sort)))
+
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    return {
+        'items': page,
+        'next_cursor': encode_cursor(page[-1], sort) if has_more and page else None,
+        'sort': sort,
+        'order': 'desc' if descending else 'asc',
+        'total_size': sum(item['size_bytes'] for item in files),
+        'file_count': len(files),
+        'folder_count': len(folders),
+    }
+
+def listing_validators(request, full_path, rel_folder):
+    """Weak ETag and Last-Modified for a rendered listing of rel_folder.
+
+    The directory mtime changes whenever an entry is added, removed or
+    renamed; subfolder sizes come from FolderStats, so their last update
+    counts too. The user's permission version and the full query string
+    are part of the tag because both change what the page shows.
+    """
+    rel_folder = rel_folder.strip('/')
+    st = os.stat(full_path)
+    stats_updated = FolderStats.objects.filter(Q(path=rel_folder) | Q(parent=rel_folder)).aggregate(latest=Max('updated_at'))['latest']
+    key = '|'.join([
+        str(st.st_mtime_ns),
+        stats_updated.isoformat() if stats_updated else '',
+        str(request.user.pk),
+        get_permission_trie(request.user).version,
+        request.get_full_path(),
+        # A page rendered before a new login carries a stale CSRF token
+        request.META.get('CSRF_COOKIE', ''),
+    ])
+    etag = f'W/"{hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]}"'
+    mtime = max(st.st_mtime, stats_updated.timestamp() if stats_updated else 0)
+    return etag, mtime
+
+# Subfolder names per directory, validated against the directory's mtime
+# (which changes whenever an entry is added, removed or renamed)
+_subfolder_cache = OrderedDict()
+_has_children_cache = OrderedDict()
+_subfolder_lock = threading.Lock()
+SUBFOLDER_CACHE_MAX_ENTRIES = 20000
+
+def list_subfolders(full_path):
+    """Return the sorted names of the folders directly inside full_path"""
+    mtime_ns = os.stat(full_path).st_mtime_ns
+    with _subfolder_lock:
+        cached = _subfolder_cache.get(full_path)
+        if cached is not None and cached[0] == mtime_ns:
+            _subfolder_cache.move_to_end(full_path)
+            return cached[1]
+
+    names = []
+    with os.scandir(full_path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir():
+                    names.append(entry.name)
+            except OSError:
+                continue
+    names.sort(key=str.lower)
+
+    with _subfolder_lock:
+        _subfolder_cache[full_path] = (mtime_ns, names)
+        _subfolder_cache.move_to_end(full_path)
+        while len(_subfolder_cache) > SUBFOLDER_CACHE_MAX_ENTRIES:
+            _subfolder_cache.popitem(last=False)
+    return names
+
+def has_subfolders(full_path):
+    """True if full_path contains at least one folder, stopping at the first hit"""
+    try:
+        mtime_ns = os.stat(full_path).st_mtime_ns
+    except OSError:
+        return False
+
+    with _subfolder_lock:
+        cached = _subfolder_cache.get(full_path)
+        if cached is None or cached[0] != mtime_ns:
+            cached = _has_children_cache.get(full_path)
+    if cached is not None and cached[0] == mtime_ns:
+        return bool(cached[1])
+
+    found = False
+    try:
+        with os.scandir(full_path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        found = True
+                        break
+                except OSError:
+                    continue
+    except OSError:
+        return False
+
+    with _subfolder_lock:
+        _has_children_cache[full_path] = (mtime_ns, found)
+        _has_children_cache.move_to_end(full_path)
+        while len(_has_children_cache) > SUBFOLDER_CACHE_MAX_ENTRIES:
+            _has_children_cache.popitem(last=False)
+    return found
+
+def build_folder_tree(base_path, rel_path='', depth=1):
+    """Folder tree below rel_path, expanded depth levels deep.
+
+    Every node reports has_children, so a client can fetch deeper levels
+    lazily by asking again with the node's path.
+    """
+    nodes = []
+    full_path = os.path.join(base_path, rel_path.lstrip('/'))
+    for name in list_subfolders(full_path):
+        child_path = f"{rel_path.rstrip('/')}/{name}" if rel_path else name
+        child_full_path = os.path.join(full_path, name)
+        node = {
+            'name': name,
+            'path': child_path,
+            'has_children': has_subfolders(child_full_path),
+        }
+        if depth > 1 and node['has_children']:
+            try:
+                node['children'] = build_folder_tree(base_path, child_path, depth - 1)
+            except OSError:
+                # Left out, so the picker fetches it again when the node is expanded
+                pass
+        nodes.append(node)
+    return nodes
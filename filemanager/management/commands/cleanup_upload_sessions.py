@@ -0,0 +1,30 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from filemanager.models import UploadSession
+from filemanager.progress import set_progress_status
+from filemanager.uploads import cleanup_upload_temps, discard_staging_file
+
+class Command(BaseCommand):
+    help = 'Expire chunked upload sessions that have not received data for a while and remove abandoned upload files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=72, help='Expire sessions idle for longer than this')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        sessions = UploadSession.objects.filter(status='uploading', updated_at__lt=cutoff)
+
+        expired = 0
+        for session in sessions:
+            discard_staging_file(session.session_id)
+            session.chunks.all().delete()
+            session.status = 'expired'
+            session.save()
+            set_progress_status(session.session_id, 'expired')
+            expired += 1
+
+        # Form uploads whose request died before the view could claim them
+        removed = cleanup_upload_temps(options['hours'] * 3600)
+
+        self.stdout.write(self.style.SUCCESS(f'Expired {expired} upload session(s) and removed {removed} abandoned upload file(s)'))
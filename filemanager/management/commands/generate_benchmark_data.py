@@ -0,0 +1,44 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from filemanager.benchdata import DEFAULT_PARAMS, dataset_exists, generate_dataset, remove_dataset
+from filemanager.utils import format_file_size
+
+class Command(BaseCommand):
+    help = 'Create a synthetic fleet of vessel folders, files and users for run_benchmark'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--manifest', default='benchmark_dataset.json', help='Where to write the dataset description')
+        parser.add_argument('--seed', type=int, default=DEFAULT_PARAMS['seed'])
+        parser.add_argument('--prefix', default=DEFAULT_PARAMS['prefix'], help='Vessel folder and username prefix')
+        parser.add_argument('--vessels', type=int, default=DEFAULT_PARAMS['vessels'])
+        parser.add_argument('--depth', type=int, default=DEFAULT_PARAMS['depth'], help='Folder levels below each vessel')
+        parser.add_argument('--fanout', type=int, default=DEFAULT_PARAMS['fanout'], help='Subfolders per folder')
+        parser.add_argument('--files-per-folder', type=int, default=DEFAULT_PARAMS['files_per_folder'], help='Average; each folder gets 50-150%% of this')
+        parser.add_argument('--median-size', type=int, default=DEFAULT_PARAMS['median_size'], help='Median file size in bytes')
+        parser.add_argument('--size-sigma', type=float, default=DEFAULT_PARAMS['size_sigma'], help='Spread of the log-normal size distribution')
+        parser.add_argument('--max-size', type=int, default=DEFAULT_PARAMS['max_size'], help='Largest file in bytes')
+        parser.add_argument('--users-per-vessel', type=int, default=DEFAULT_PARAMS['users_per_vessel'])
+        parser.add_argument('--extra-grants', type=int, default=DEFAULT_PARAMS['extra_grants'], help="Read grants per user on other vessels' folders")
+        parser.add_argument('--password', default=DEFAULT_PARAMS['password'], help='Password of every generated user')
+        parser.add_argument('--sparse', action='store_true', help='Write sparse files (sizes without data) to test metadata paths at scale')
+        parser.add_argument('--replace', action='store_true', help='Remove an existing dataset with the same prefix first')
+
+    def handle(self, *args, **options):
+        params = {key: options[key] for key in DEFAULT_PARAMS}
+        root = str(settings.FILE_STORAGE_ROOT)
+        if dataset_exists(root, params):
+            if not options['replace']:
+                raise CommandError(f"A dataset with prefix {params['prefix']} already exists; use --replace to rebuild it")
+            remove_dataset(root, params)
+
+        manifest = generate_dataset(params)
+        with open(options['manifest'], 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+        totals = manifest['totals']
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {totals['vessels']} vessels, {totals['folders']} folders, {totals['files']} files "
+            f"({format_file_size(totals['bytes'])}) and {totals['users']} users in {totals['seconds']}s; "
+            f"manifest written to {options['manifest']}"
+        ))
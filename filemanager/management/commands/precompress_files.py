@@ -0,0 +1,58 @@
+import os
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+from filemanager.compression import available_encodings, fresh_sidecar, is_compressible, prune_sidecars, write_sidecar
+from filemanager.models import FileActivity
+
+class Command(BaseCommand):
+    help = 'Pre-compress frequently downloaded compressible files into the sidecar cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Count downloads from this many days back')
+        parser.add_argument('--min-downloads', type=int, default=3, help='Only files downloaded at least this often')
+        parser.add_argument('--min-size', type=int, default=settings.PRECOMPRESS_MIN_SIZE, help='Only files at least this many bytes')
+        parser.add_argument('--prune', action='store_true', help='Also delete sidecars of changed or deleted files')
+
+    def handle(self, *args, **options):
+        if options['prune']:
+            self.stdout.write(f'Removed {prune_sidecars()} stale sidecar(s)')
+
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        hot = (
+            FileActivity.objects
+            .filter(activity_type='download', timestamp__gte=cutoff)
+            .values('filepath')
+            .annotate(downloads=Count('id'))
+            .filter(downloads__gte=options['min_downloads'])
+            .order_by('-downloads')
+        )
+
+        written = 0
+        saved = 0
+        for row in hot:
+            rel_path = row['filepath'].strip('/')
+            full_path = os.path.join(settings.FILE_STORAGE_ROOT, rel_path)
+            if not is_compressible(rel_path):
+                continue
+            try:
+                st = os.stat(full_path)
+            except OSError:
+                continue
+            if st.st_size < options['min_size']:
+                continue
+
+            for encoding in available_encodings():
+                if fresh_sidecar(rel_path, encoding, st):
+                    continue
+                try:
+                    size = write_sidecar(full_path, rel_path, encoding)
+                except OSError as e:
+                    self.stderr.write(f'Could not compress {rel_path}: {e}')
+                    continue
+                written += 1
+                saved += st.st_size - size
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} sidecar(s), {saved} bytes smaller than the originals'))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from filemanager.dedup import prune_references
+
+class Command(BaseCommand):
+    help = 'Drop content store references to files removed outside the app and delete unreferenced blobs'
+
+    def handle(self, *args, **options):
+        removed_refs, removed_blobs = prune_references()
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed_refs} stale reference(s) and {removed_blobs} blob(s)'))
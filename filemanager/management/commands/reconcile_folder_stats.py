@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from filemanager.folderstats import reconcile_folder_stats
+
+class Command(BaseCommand):
+    help = 'Repair folder size and file count totals after changes made outside the app'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='', help='Only reconcile this folder (relative to FILE_STORAGE_ROOT)')
+        parser.add_argument('--interval', type=int, default=0, help='Keep running, reconciling every this many seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            stats = reconcile_folder_stats(options['path'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Folder stats reconciled: {stats['created']} created, {stats['updated']} updated, "
+                f"{stats['removed']} removed, {stats['unchanged']} unchanged"
+            ))
+            if not options['interval']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from filemanager.activity import retention_cutoff, roll_up_activity
+
+class Command(BaseCommand):
+    help = 'Move file activity older than the retention period into daily rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ACTIVITY_RETENTION_DAYS, help='Keep individual activity rows for this many days')
+
+    def handle(self, *args, **options):
+        cutoff = retention_cutoff(options['days'])
+        removed, days = roll_up_activity(cutoff)
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {removed} activity record(s) from {days} day(s) before {cutoff:%Y-%m-%d}'))
@@ -0,0 +1,60 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from filemanager.benchdata import load_manifest
+from filemanager.benchmark import SCENARIOS, BenchmarkRunner, compare_results
+
+def comma_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+class Command(BaseCommand):
+    help = 'Measure latency, throughput, queries, syscalls and memory of the main views against a generated dataset'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--manifest', default='benchmark_dataset.json', help='Written by generate_benchmark_data')
+        parser.add_argument('--scenarios', type=comma_list, default=SCENARIOS, help=f"Comma-separated; default: {','.join(SCENARIOS)}")
+        parser.add_argument('--modes', type=comma_list, default=['client', 'waitress'], help='client (test client, in-process) and/or waitress (real HTTP)')
+        parser.add_argument('--concurrency', type=comma_list, default=['1', '4', '16'], help='Comma-separated concurrency levels')
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario, mode and concurrency')
+        parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests before each measurement')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--upload-size', type=int, default=256 * 1024, help='Bytes per upload_file request')
+        parser.add_argument('--server-threads', type=int, default=8, help='waitress worker threads')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+        parser.add_argument('--compare', help='A previous JSON report to compare against')
+
+    def handle(self, *args, **options):
+        unknown = set(options['scenarios']) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        unknown = set(options['modes']) - {'client', 'waitress'}
+        if unknown:
+            raise CommandError(f"Unknown modes: {', '.join(sorted(unknown))}")
+        try:
+            concurrency = [int(level) for level in options['concurrency']]
+            manifest = load_manifest(options['manifest'])
+            runner = BenchmarkRunner(
+                manifest,
+                requests=options['requests'],
+                warmup=options['warmup'],
+                seed=options['seed'],
+                upload_size=options['upload_size'],
+                server_threads=options['server_threads'],
+                report=self.stderr.write,
+            )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        report = runner.run(options['scenarios'], options['modes'], concurrency)
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output)
+            self.stderr.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+            for line in compare_results(baseline, report):
+                self.stderr.write(line)
@@ -0,0 +1,21 @@
+import time
+from django.core.management.base import BaseCommand
+from filemanager.contentindex import refresh_content_index
+
+class Command(BaseCommand):
+    help = 'Extract the text of new and changed documents into the full-text content index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='', help='Only index this folder (relative to FILE_STORAGE_ROOT)')
+        parser.add_argument('--interval', type=int, default=0, help='Keep running, refreshing every this many seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            stats = refresh_content_index(options['path'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Content index updated: {stats['indexed']} indexed, {stats['failed']} failed, "
+                f"{stats['removed']} removed, {stats['unchanged']} unchanged"
+            ))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from filemanager.indexing import refresh_file_index
+from filemanager.manifest import fill_digests
+
+class Command(BaseCommand):
+    help = 'Build or incrementally refresh the filename index used by search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='', help='Only refresh this folder (relative to FILE_STORAGE_ROOT)')
+        parser.add_argument('--full', action='store_true', help='Drop the existing entries and rebuild from scratch')
+        parser.add_argument('--digests', action='store_true', help='Also hash files that have no digest yet, for folder manifests')
+
+    def handle(self, *args, **options):
+        stats = refresh_file_index(options['path'], full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Index updated: {stats['added']} added, {stats['updated']} updated, "
+            f"{stats['removed']} removed, {stats['unchanged']} unchanged"
+        ))
+        if options['digests']:
+            missing = fill_digests(options['path'])
+            self.stdout.write(self.style.SUCCESS(f"Digests stored; {missing} files could not be hashed"))
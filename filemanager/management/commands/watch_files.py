@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from filemanager.watcher import Watcher
+
+class Command(BaseCommand):
+    help = 'Watch FILE_STORAGE_ROOT and keep the file index, folder stats and content index up to date'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', action='store_true', help='Do not use inotify; only reconcile every WATCHER_POLL_INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        try:
+            Watcher(use_inotify=not options['poll'], report=self.stdout.write).run()
+        except KeyboardInterrupt:
+            pass
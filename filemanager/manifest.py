@@ -0,0 +1,213 @@
+"""Folder manifests for keeping vessel-side mirrors in sync.
+
+A manifest lists every file below a folder with its size, mtime and
+SHA-256 digest, read from the filename index rather than the disk. Each
+distinct listing is saved as a snapshot under a random cursor; passing the
+cursor back returns only the differences against that snapshot. Only the
+newest few snapshots per user and folder are kept, so an unknown or
+expired cursor simply gets the full listing again.
+"""
+import os
+import re
+import gzip
+import json
+import time
+import hashlib
+import secrets
+from django.conf import settings
+from .dedup import hash_file
+from .indexing import normalize_rel_path, refresh_file_index, subtree_filter
+from .models import ContentReference, FileIndexEntry
+from .permissions import get_permission_trie
+
+CURSOR_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+def fill_digests(rel_root, budget=None):
+    """Store the digest of indexed files below rel_root that do not have one yet.
+
+    Files in the content store already have theirs, as long as the file
+    was not rewritten in the tree since it was linked. Others are hashed,
+    at most budget bytes' worth per call (None for no limit). A digest is
+    only saved when the file still has the size and mtime it was indexed
+    with, so it can never describe a different version. Returns the number
+    of files that still have no digest.
+    """
+    pending = list(
+        FileIndexEntry.objects.filter(subtree_filter(rel_root), digest='')
+        .order_by('size')
+        .values_list('pk', 'path', 'size', 'mtime')
+    )
+    if not pending:
+        return 0
+
+    stored = {}
+    paths = [path for pk, path, size, mtime in pending]
+    for i in range(0, len(paths), 500):
+        references = ContentReference.objects.filter(path__in=paths[i:i + 500]).values_list('path', 'blob__digest', 'blob__size', 'created_at')
+        stored.update((path, (digest, blob_size, created_at.timestamp())) for path, digest, blob_size, created_at in references)
+
+    missing = 0
+    for pk, path, size, mtime in pending:
+        digest = None
+        reference = stored.get(path)
+        # A file edited in place keeps its reference, so only an untouched one is trusted
+        if reference is not None and reference[1] == size and mtime <= reference[2]:
+            digest = reference[0]
+        if digest is None:
+            if budget is not None and size > budget:
+                missing += 1
+                continue
+            full_path = os.path.join(settings.FILE_STORAGE_ROOT, path)
+            try:
+                digest = hash_file(full_path)
+                st = os.stat(full_path)
+            except OSError:
+                missing += 1
+                continue
+            if budget is not None:
+                budget -= size
+            if st.st_size != size or st.st_mtime != mtime:
+                missing += 1
+                continue
+        # Matching on size and mtime too, in case the row changed while hashing
+        FileIndexEntry.objects.filter(pk=pk, size=size, mtime=mtime).update(digest=digest)
+    return missing
+
+def collect_manifest(user, rel_root):
+    """Return {path: [size, mtime, digest]} for every file below rel_root the user can read"""
+    trie = get_permission_trie(user)
+    readable = {}
+    entries = {}
+    rows = FileIndexEntry.objects.filter(subtree_filter(rel_root)).values_list('path', 'folder', 'size', 'mtime', 'digest')
+    for path, folder, size, mtime, digest in rows.iterator():
+        # Deeper grants can narrow access, so each folder is checked once
+        allowed = readable.get(folder)
+        if allowed is None:
+            allowed = readable[folder] = trie.allows(folder, 'read')
+        if allowed:
+            entries[path] = [size, mtime, digest or None]
+    return entries
+
+def snapshot_prefix(user, rel_root):
+    root_key = hashlib.md5(rel_root.encode('utf-8')).hexdigest()[:16]
+    return f'{user.pk}-{root_key}-'
+
+def snapshot_path(user, rel_root, cursor):
+    return os.path.join(settings.MANIFEST_SNAPSHOT_ROOT, f'{snapshot_prefix(user, rel_root)}{cursor}.json.gz')
+
+def load_snapshot(user, rel_root, cursor):
+    """Entries saved under cursor, or None when it is unknown or has expired"""
+    if not cursor or not CURSOR_PATTERN.match(cursor):
+        return None
+    try:
+        with gzip.open(snapshot_path(user, rel_root, cursor), 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_snapshot(user, rel_root, entries):
+    """Save entries under a new cursor and drop snapshots that are no longer needed"""
+    os.makedirs(settings.MANIFEST_SNAPSHOT_ROOT, exist_ok=True)
+    cursor = secrets.token_hex(16)
+    path = snapshot_path(user, rel_root, cursor)
+    tmp_path = f'{path}.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+        json.dump(entries, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    prune_snapshots(snapshot_prefix(user, rel_root))
+    return cursor
+
+def touch_snapshot(user, rel_root, cursor):
+    # Age is counted from the last time a cursor was used, not when it was made
+    try:
+        os.utime(snapshot_path(user, rel_root, cursor))
+    except OSError:
+        pass
+
+def prune_snapshots(prefix):
+    """Keep the newest MANIFEST_SNAPSHOTS_KEPT snapshots for prefix, and none past MANIFEST_SNAPSHOT_MAX_AGE"""
+    cutoff = time.time() - settings.MANIFEST_SNAPSHOT_MAX_AGE * 86400
+    own = []
+    with os.scandir(settings.MANIFEST_SNAPSHOT_ROOT) as it:
+        for entry in it:
+            try:
+                mtime = entry.stat().st_mtime
+            except OSError:
+                continue
+            if mtime < cutoff:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+            elif entry.name.startswith(prefix):
+                own.append((mtime, entry.path))
+    own.sort(reverse=True)
+    for mtime, path in own[settings.MANIFEST_SNAPSHOTS_KEPT:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def build_manifest(user, rel_root, cursor=None):
+    """Return (header, changes) for rel_root since cursor.
+
+    changes is a list of [path, size, mtime, digest] for new and changed
+    files and [path, None, None, None] for removed ones. Without a usable
+    cursor every file is listed and header['full'] is True.
+    """
+    rel_root = normalize_rel_path(rel_root)
+    if settings.MANIFEST_REFRESH_INDEX:
+        refresh_file_index(rel_root)
+    fill_digests(rel_root, settings.MANIFEST_DIGEST_BUDGET)
+    current = collect_manifest(user, rel_root)
+
+    previous = load_snapshot(user, rel_root, cursor)
+    if previous is None:
+        changes = [[path] + current[path] for path in sorted(current)]
+        new_cursor = save_snapshot(user, rel_root, current)
+    else:
+        changes = [
+            [path] + entry for path, entry in sorted(current.items())
+            if previous.get(path) != entry
+        ]
+        changes += [[path, None, None, None] for path in sorted(previous) if path not in current]
+        changes.sort(key=lambda change: change[0])
+        if changes:
+            new_cursor = save_snapshot(user, rel_root, current)
+        else:
+            # An unchanged folder keeps its cursor instead of piling up identical snapshots
+            new_cursor = cursor
+            touch_snapshot(user, rel_root, cursor)
+
+    header = {
+        'root': rel_root,
+        'cursor': new_cursor,
+        'since': cursor if previous is not None else None,
+        'full': previous is None,
+        'files': len(current),
+        'total_size': sum(entry[0] for entry in current.values()),
+    }
+    return header, changes
+
+def iter_manifest_lines(header, changes):
+    """The manifest as newline-delimited JSON: the header, one line per change, then an end marker.
+
+    A client only trusts the new cursor once it has seen the end marker,
+    so a stream cut off halfway is never mistaken for a complete one.
+    """
+    yield json.dumps(header, separators=(',', ':')).encode('utf-8') + b'\n'
+    batch = []
+    removed = 0
+    for path, size, mtime, digest in changes:
+        if size is None:
+            removed += 1
+            line = {'path': path, 'deleted': True}
+        else:
+            line = {'path': path, 'size': size, 'mtime': mtime, 'digest': digest}
+        batch.append(json.dumps(line, separators=(',', ':')))
+        if len(batch) >= 500:
+            yield ('\n'.join(batch) + '\n').encode('utf-8')
+            batch = []
+    if batch:
+        yield ('\n'.join(batch) + '\n').encode('utf-8')
+    yield json.dumps({'end': True, 'changes': len(changes), 'deleted': removed}, separators=(',', ':')).encode('utf-8') + b'\n'
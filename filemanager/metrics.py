@@ -0,0 +1,379 @@
+"""Per-view request metrics, exposed in the Prometheus text format.
+
+MetricsMiddleware times every request and counts the database queries,
+time spent in the database, filesystem calls and response bytes it caused,
+aggregated per view into fixed-bucket histograms and counters held in
+process memory. Each server process keeps its own numbers.
+
+Requests slower than METRICS_SLOW_REQUEST_SECONDS are printed. A fraction
+(METRICS_PROFILE_SAMPLE_RATE) of requests also have their stacks sampled
+while they run; when such a request turns out slow, its collapsed stacks
+are appended to METRICS_SLOW_LOG in a form flamegraph tools can read.
+"""
+import os
+import sys
+import json
+import time
+import random
+import threading
+import contextvars
+from bisect import bisect_left
+from collections import Counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# Audit events (see sys.addaudithook) that touch the filesystem. os.stat()
+# raises no audit event, so stats are not included.
+FS_EVENTS = frozenset({
+    'open', 'os.listdir', 'os.scandir', 'os.remove', 'os.rename', 'os.link', 'os.symlink',
+    'os.mkdir', 'os.rmdir', 'os.chmod', 'os.chown', 'os.utime', 'os.truncate',
+    'shutil.copyfile', 'shutil.move', 'shutil.rmtree',
+})
+
+MAX_PROFILE_STACKS = 50
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # The last slot is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, count) pairs as Prometheus expects them, ending with +Inf"""
+        total = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            yield bound, total
+
+class ViewStats:
+    __slots__ = ('duration', 'queries', 'db_seconds', 'fs_calls', 'responses')
+
+    def __init__(self):
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_seconds = 0.0
+        self.fs_calls = 0
+        self.responses = Counter()
+
+class Registry:
+    """All metrics of this process. Updates take one short lock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.bytes_sent = Counter()
+        self.in_progress = 0
+
+    def start(self):
+        with self.lock:
+            self.in_progress += 1
+
+    def record(self, view, method, status, duration, metrics):
+        with self.lock:
+            self.in_progress -= 1
+            stats = self.views.get((view, method))
+            if stats is None:
+                stats = self.views[(view, method)] = ViewStats()
+            stats.duration.observe(duration)
+            stats.queries.observe(metrics.queries)
+            stats.db_seconds += metrics.db_seconds
+            stats.fs_calls += metrics.fs_calls
+            stats.responses[status] += 1
+
+    def add_bytes(self, view, nbytes):
+        with self.lock:
+            self.bytes_sent[view] += nbytes
+
+    def snapshot(self):
+        """Copies taken under the lock, so rendering never blocks requests"""
+        with self.lock:
+            views = {}
+            for key, stats in self.views.items():
+                copy = ViewStats()
+                copy.duration.counts = list(stats.duration.counts)
+                copy.duration.sum, copy.duration.count = stats.duration.sum, stats.duration.count
+                copy.queries.counts = list(stats.queries.counts)
+                copy.queries.sum, copy.queries.count = stats.queries.sum, stats.queries.count
+                copy.db_seconds = stats.db_seconds
+                copy.fs_calls = stats.fs_calls
+                copy.responses = Counter(stats.responses)
+                views[key] = copy
+            return views, Counter(self.bytes_sent), self.in_progress
+
+registry = Registry()
+
+class RequestMetrics:
+    __slots__ = ('queries', 'db_seconds', 'fs_calls', 'threads')
+
+    def __init__(self, profiled=False):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.fs_calls = 0
+        # Threads that did work for a profiled request; async views run partly off the request thread
+        self.threads = {threading.get_ident()} if profiled else None
+
+def count_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_seconds += time.perf_counter() - started
+        if metrics.threads is not None:
+            metrics.threads.add(threading.get_ident())
+
+def install_query_counter(sender=None, connection=None, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+def count_fs_call(event, args):
+    if event in FS_EVENTS:
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.fs_calls += 1
+            if metrics.threads is not None:
+                metrics.threads.add(threading.get_ident())
+
+_hooks_installed = False
+_hooks_lock = threading.Lock()
+
+def install_hooks():
+    """Hook query and filesystem counting into the process, once"""
+    global _hooks_installed
+    with _hooks_lock:
+        if _hooks_installed:
+            return
+        connection_created.connect(install_query_counter)
+        for connection in connections.all():
+            install_query_counter(connection=connection)
+        # Audit hooks cannot be removed again; this one is a set lookup for unrelated events
+        sys.addaudithook(count_fs_call)
+        _hooks_installed = True
+
+class StackSampler:
+    """Samples the stacks of a request's threads from a helper thread"""
+
+    def __init__(self, metrics, interval):
+        self.metrics = metrics
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='request-profiler', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()
+            self.samples += 1
+            for thread_id in list(self.metrics.threads):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[collapse_stack(frame)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+def collapse_stack(frame):
+    """A stack as 'outer;...;inner', the folded format flamegraph tools read"""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(parts))
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.view_name or 'unnamed'
+
+def count_bytes(iterator, view):
+    sent = 0
+    try:
+        for chunk in iterator:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        registry.add_bytes(view, sent)
+
+async def acount_bytes(iterator, view):
+    sent = 0
+    try:
+        async for chunk in iterator:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        registry.add_bytes(view, sent)
+
+def track_bytes(response, view):
+    if not response.streaming:
+        registry.add_bytes(view, len(response.content))
+    elif getattr(response, 'file_to_stream', None) is not None:
+        # Left untouched so the server can still hand the file to wsgi.file_wrapper
+        registry.add_bytes(view, int(response.get('Content-Length') or 0))
+    elif response.is_async:
+        response.streaming_content = acount_bytes(response.streaming_content, view)
+    else:
+        response.streaming_content = count_bytes(response.streaming_content, view)
+
+def log_slow_request(request, view, status, duration, metrics, sampler):
+    print(
+        f"Slow request: {request.method} {request.path} ({view}) returned {status} in {duration:.2f}s, "
+        f"{metrics.queries} queries ({metrics.db_seconds:.2f}s), {metrics.fs_calls} filesystem calls"
+    )
+    if sampler is None or not settings.METRICS_SLOW_LOG:
+        return
+    entry = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'method': request.method,
+        'path': request.path,
+        'view': view,
+        'status': status,
+        'duration': round(duration, 4),
+        'queries': metrics.queries,
+        'db_seconds': round(metrics.db_seconds, 4),
+        'fs_calls': metrics.fs_calls,
+        'interval': settings.METRICS_PROFILE_INTERVAL,
+        'samples': sampler.samples,
+        'stacks': sampler.stacks.most_common(MAX_PROFILE_STACKS),
+    }
+    try:
+        os.makedirs(os.path.dirname(str(settings.METRICS_SLOW_LOG)) or '.', exist_ok=True)
+        with open(settings.METRICS_SLOW_LOG, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+    except OSError as e:
+        print(f"Could not write slow request profile: {e}")
+
+class MetricsMiddleware:
+    """Records wall time, queries, database time, filesystem calls and bytes sent per view.
+
+    Wall time runs until the view returns its response; the bytes of a
+    streamed response are counted as they are sent.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        install_hooks()
+
+    def begin(self):
+        profiled = settings.METRICS_PROFILE_SAMPLE_RATE > 0 and random.random() < settings.METRICS_PROFILE_SAMPLE_RATE
+        metrics = RequestMetrics(profiled)
+        sampler = StackSampler(metrics, settings.METRICS_PROFILE_INTERVAL) if profiled else None
+        registry.start()
+        return metrics, sampler, _current.set(metrics), time.perf_counter()
+
+    def end(self, request, response, metrics, sampler, token, started):
+        duration = time.perf_counter() - started
+        _current.reset(token)
+        if sampler is not None:
+            sampler.stop()
+        view = view_name(request)
+        status = response.status_code if response is not None else 500
+        registry.record(view, request.method, status, duration, metrics)
+        if response is not None:
+            track_bytes(response, view)
+        if settings.METRICS_SLOW_REQUEST_SECONDS and duration >= settings.METRICS_SLOW_REQUEST_SECONDS:
+            log_slow_request(request, view, status, duration, metrics, sampler)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = self.begin()
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            self.end(request, response, *state)
+        return response
+
+    async def __acall__(self, request):
+        state = self.begin()
+        response = None
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.end(request, response, *state)
+        return response
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+def render_metrics():
+    """This process's metrics in the Prometheus text exposition format"""
+    views, bytes_sent, in_progress = registry.snapshot()
+    lines = []
+
+    def header(name, kind, text):
+        lines.append(f'# HELP {name} {text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    def histogram(name, attr):
+        for (view, method), stats in sorted(views.items()):
+            hist = getattr(stats, attr)
+            labels = f'view="{escape_label(view)}",method="{method}"'
+            for bound, count in hist.cumulative():
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_sum{{{labels}}} {format_number(hist.sum)}')
+            lines.append(f'{name}_count{{{labels}}} {hist.count}')
+
+    header('portal_requests_total', 'counter', 'Responses by view, method and status')
+    for (view, method), stats in sorted(views.items()):
+        for status, count in sorted(stats.responses.items()):
+            lines.append(f'portal_requests_total{{view="{escape_label(view)}",method="{method}",status="{status}"}} {count}')
+
+    header('portal_request_duration_seconds', 'histogram', 'Time until the view returned its response')
+    histogram('portal_request_duration_seconds', 'duration')
+
+    header('portal_request_queries', 'histogram', 'Database queries per request')
+    histogram('portal_request_queries', 'queries')
+
+    header('portal_db_seconds_total', 'counter', 'Time spent in database queries')
+    for (view, method), stats in sorted(views.items()):
+        lines.append(f'portal_db_seconds_total{{view="{escape_label(view)}",method="{method}"}} {format_number(stats.db_seconds)}')
+
+    header('portal_fs_calls_total', 'counter', 'Files opened, folders listed and files created, moved or removed')
+    for (view, method), stats in sorted(views.items()):
+        lines.append(f'portal_fs_calls_total{{view="{escape_label(view)}",method="{method}"}} {stats.fs_calls}')
+
+    header('portal_response_bytes_total', 'counter', 'Response body bytes sent, including streamed downloads')
+    for view, nbytes in sorted(bytes_sent.items()):
+        lines.append(f'portal_response_bytes_total{{view="{escape_label(view)}"}} {nbytes}')
+
+    header('portal_requests_in_progress', 'gauge', 'Requests currently inside a view')
+    lines.append(f'portal_requests_in_progress {in_progress}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemanager', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileIndexEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1000, unique=True)),
+                ('folder', models.CharField(db_index=True, max_length=1000)),
+                ('name', models.CharField(max_length=255)),
+                ('name_lower', models.CharField(db_index=True, max_length=255)),
+                ('extension', models.CharField(db_index=True, max_length=50)),
+                ('size', models.BigIntegerField(default=0)),
+                ('mtime', models.FloatField(default=0)),
+                ('indexed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
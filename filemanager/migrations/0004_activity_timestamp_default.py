@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:35
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemanager', '0003_upload_chunks'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fileactivity',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemanager', '0005_content_store'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FolderStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1000, unique=True)),
+                ('parent', models.CharField(db_index=True, max_length=1000)),
+                ('total_size', models.BigIntegerField(default=0)),
+                ('file_count', models.IntegerField(default=0)),
+                ('latest_mtime', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
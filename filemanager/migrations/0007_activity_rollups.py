@@ -0,0 +1,55 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemanager', '0006_folder_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('activity_type', models.CharField(choices=[('upload', 'File Upload'), ('download', 'File Download'), ('delete', 'File Delete'), ('view', 'File View')], max_length=10)),
+                ('count', models.IntegerField(default=0)),
+                ('total_bytes', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterModelOptions(
+            name='fileactivity',
+            options={'verbose_name_plural': 'file activities'},
+        ),
+        migrations.AddIndex(
+            model_name='fileactivity',
+            index=models.Index(fields=['user', 'timestamp'], name='activity_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fileactivity',
+            index=models.Index(fields=['activity_type', 'timestamp'], name='activity_type_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fileactivity',
+            index=models.Index(fields=['timestamp', 'id'], name='activity_time_id_idx'),
+        ),
+        migrations.AddField(
+            model_name='activityrollup',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='activityrollup',
+            index=models.Index(fields=['user', 'day'], name='rollup_user_day_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='activityrollup',
+            unique_together={('day', 'user', 'activity_type')},
+        ),
+    ]
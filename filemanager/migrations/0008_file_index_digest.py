@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemanager', '0007_activity_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileindexentry',
+            name='digest',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.utils import timezone
 import os
 
 class FolderPermission(models.Model):
@@ -37,21 +38,109 @@ class FileActivity(models.Model):
     filename = models.CharField(max_length=255)
     filepath = models.CharField(max_length=1000)
     activity_type = models.CharField(max_length=10, choices=ACTIVITY_CHOICES)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     file_size = models.BigIntegerField(null=True, blank=True)
     
+    class Meta:
+        verbose_name_plural = 'file activities'
+        indexes = [
+            models.Index(fields=['user', 'timestamp'], name='activity_user_time_idx'),
+            models.Index(fields=['activity_type', 'timestamp'], name='activity_type_time_idx'),
+            # Retention sweeps and the admin's keyset pagination walk this one
+            models.Index(fields=['timestamp', 'id'], name='activity_time_id_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.user.username} - {self.activity_type} - {self.filename}"
 
+class ActivityRollup(models.Model):
+    """Daily totals per user and activity type for activity past its retention period"""
+    day = models.DateField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    activity_type = models.CharField(max_length=10, choices=FileActivity.ACTIVITY_CHOICES)
+    count = models.IntegerField(default=0)
+    total_bytes = models.BigIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['day', 'user', 'activity_type']
+        indexes = [
+            models.Index(fields=['user', 'day'], name='rollup_user_day_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} - {self.user.username} - {self.activity_type}"
+
 class UploadSession(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    session_id = models.CharField(max_length=100)
+    session_id = models.CharField(max_length=100, db_index=True)
     folder_path = models.CharField(max_length=1000)
+    filename = models.CharField(max_length=255, blank=True)
+    chunk_size = models.IntegerField(default=0)
     total_files = models.IntegerField(default=0)
     completed_files = models.IntegerField(default=0)
     total_size = models.BigIntegerField(default=0)
     uploaded_size = models.BigIntegerField(default=0)
     status = models.CharField(max_length=20, default='uploading')
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
\ No newline at end of file
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    @property
+    def total_chunks(self):
+        if not self.chunk_size:
+            return 0
+        return (self.total_size + self.chunk_size - 1) // self.chunk_size
+    
+    def expected_chunk_size(self, index):
+        return min(self.chunk_size, self.total_size - index * self.chunk_size)
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()
+    size = models.BigIntegerField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ['session', 'index']
+
+class FileIndexEntry(models.Model):
+    path = models.CharField(max_length=1000, unique=True)
+    folder = models.CharField(max_length=1000, db_index=True)
+    name = models.CharField(max_length=255)
+    name_lower = models.CharField(max_length=255, db_index=True)
+    extension = models.CharField(max_length=50, db_index=True)
+    size = models.BigIntegerField(default=0)
+    mtime = models.FloatField(default=0)
+    # SHA-256 of the content, filled in lazily for manifests; cleared whenever size or mtime change
+    digest = models.CharField(max_length=64, blank=True, default='')
+    indexed_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return self.path
+
+class ContentBlob(models.Model):
+    digest = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.digest
+
+class ContentReference(models.Model):
+    path = models.CharField(max_length=1000, unique=True)
+    blob = models.ForeignKey(ContentBlob, on_delete=models.PROTECT, related_name='references')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.path} -> {self.blob.digest}"
+
+class FolderStats(models.Model):
+    path = models.CharField(max_length=1000, unique=True)
+    parent = models.CharField(max_length=1000, db_index=True)
+    total_size = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
+    latest_mtime = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return self.path or '/'
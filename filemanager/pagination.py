@@ -0,0 +1,110 @@
+"""Changelist pagination for tables too large to count or page by offset.
+
+Pages are addressed by the (timestamp, id) of the last row shown, so
+every page is an index range scan no matter how far back it is, and the
+total is an estimate rather than a COUNT(*) over the whole table.
+"""
+import copy
+from datetime import datetime
+from django.contrib.admin.views.main import ChangeList
+from django.db import DatabaseError, connections
+from django.db.models import Q
+
+CURSOR_VAR = 'before'
+
+# Filtered lists count at most this many rows and show "N+" beyond it
+COUNT_CAP = 10000
+
+def table_row_estimate(model, using='default'):
+    """Row count from the database's statistics, or None when it has none"""
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass'
+    elif connection.vendor == 'mysql':
+        sql = 'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s'
+    elif connection.vendor == 'sqlite':
+        # Only filled in once ANALYZE has run
+        sql = 'SELECT stat FROM sqlite_stat1 WHERE tbl = %s'
+    else:
+        return None
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None or row[0] is None:
+        return None
+    try:
+        estimate = int(str(row[0]).split()[0])
+    except ValueError:
+        return None
+    # PostgreSQL reports -1 for tables that were never analyzed
+    return estimate if estimate >= 0 else None
+
+def estimated_count(queryset, cap=COUNT_CAP):
+    """Return (count, qualifier) without scanning more than cap rows.
+
+    qualifier is 'about' for a statistics estimate, 'more' when the count
+    stopped at cap, and '' when the count is exact.
+    """
+    if not queryset.query.where:
+        estimate = table_row_estimate(queryset.model, queryset.db)
+        if estimate is not None:
+            return estimate, 'about'
+    count = queryset[:cap + 1].count()
+    if count > cap:
+        return cap, 'more'
+    return count, ''
+
+class KeysetChangeList(ChangeList):
+    """ChangeList that pages newest first on (timestamp, id) instead of by offset"""
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = parse_cursor(request.GET.get(CURSOR_VAR))
+        if CURSOR_VAR in request.GET:
+            # Hidden from the filters and from every link they build, so
+            # changing a filter or the search starts again from the newest rows
+            request = copy.copy(request)
+            request.GET = request.GET.copy()
+            del request.GET[CURSOR_VAR]
+        super().__init__(request, *args, **kwargs)
+
+    def get_results(self, request):
+        queryset = self.queryset.order_by('-timestamp', '-pk')
+        if self.cursor is not None:
+            timestamp, pk = self.cursor
+            queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk))
+
+        rows = list(queryset[:self.list_per_page + 1])
+        has_next = len(rows) > self.list_per_page
+        self.result_list = rows[:self.list_per_page]
+        self.next_cursor = None
+        if has_next:
+            last = self.result_list[-1]
+            self.next_cursor = f'{last.timestamp.isoformat()}_{last.pk}'
+
+        self.result_count, self.result_count_qualifier = estimated_count(self.queryset)
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = has_next or self.cursor is not None
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+
+    def next_page_url(self):
+        return self.get_query_string({CURSOR_VAR: self.next_cursor}) if self.next_cursor else None
+
+    def first_page_url(self):
+        return self.get_query_string() if self.cursor is not None else None
+
+def parse_cursor(value):
+    if not value:
+        return None
+    timestamp, _, pk = value.rpartition('_')
+    try:
+        return datetime.fromisoformat(timestamp), int(pk)
+    except ValueError:
+        return None
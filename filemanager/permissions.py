@@ -0,0 +1,108 @@
+import hashlib
+import threading
+import time
+from django.conf import settings
+from .models import FolderPermission
+
+PERMISSION_LEVELS = {'read': 1, 'write': 2, 'admin': 3}
+
+def split_path(path):
+    """Split a folder path into segments, or None when it has a '..' segment.
+
+    '..' is refused rather than resolved: the filesystem path is built
+    from the same segments (see utils.resolve_path), so the folder that
+    was checked is always the folder that gets opened.
+    """
+    parts = [part for part in str(path).replace('\\', '/').split('/') if part not in ('', '.')]
+    return None if '..' in parts else parts
+
+class PermissionNode:
+    __slots__ = ('children', 'permission')
+
+    def __init__(self):
+        self.children = {}
+        self.permission = None
+
+class PermissionTrie:
+    """Path-segment trie of a user's folder permissions.
+
+    A lookup walks the path one segment at a time and keeps the deepest
+    permission seen, so the most specific grant wins.
+    """
+
+    def __init__(self, permissions):
+        self.permissions = permissions
+        self.root = PermissionNode()
+        for perm in permissions:
+            parts = split_path(perm['folder_path'])
+            if parts is None:
+                continue
+            node = self.root
+            for part in parts:
+                node = node.children.setdefault(part, PermissionNode())
+            node.permission = perm['permission']
+
+        # Stable across processes, so it can be used in cache validators
+        signature = '\n'.join(sorted(f"{p['folder_path']}:{p['permission']}" for p in permissions))
+        self.version = hashlib.sha1(signature.encode('utf-8')).hexdigest()[:12]
+
+    def resolve(self, path):
+        parts = split_path(path)
+        if parts is None:
+            return None
+        node = self.root
+        permission = node.permission
+        for part in parts:
+            node = node.children.get(part)
+            if node is None:
+                break
+            if node.permission is not None:
+                permission = node.permission
+        return permission
+
+    def allows(self, path, required_permission):
+        permission = self.resolve(path)
+        if permission is None:
+            return False
+        return PERMISSION_LEVELS.get(permission, 0) >= PERMISSION_LEVELS[required_permission]
+
+SUPERUSER_TRIE = PermissionTrie([{'folder_path': '/', 'permission': 'admin'}])
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def compile_permissions(user):
+    permissions = FolderPermission.objects.filter(user=user)
+    return PermissionTrie([{'folder_path': perm.folder_path, 'permission': perm.permission} for perm in permissions])
+
+def get_permission_trie(user):
+    """Return the compiled permissions for a user.
+
+    The trie is memoized on the user object for the rest of the request and
+    in a process-level cache that signals clear whenever a FolderPermission
+    changes. PERMISSION_CACHE_TIMEOUT bounds how long other processes may
+    keep serving a stale copy.
+    """
+    if user.is_superuser:
+        return SUPERUSER_TRIE
+
+    trie = getattr(user, '_permission_trie', None)
+    if trie is not None:
+        return trie
+
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(user.pk)
+    if cached is not None and cached[0] > now:
+        trie = cached[1]
+    else:
+        trie = compile_permissions(user)
+        with _cache_lock:
+            _cache[user.pk] = (now + settings.PERMISSION_CACHE_TIMEOUT, trie)
+
+    user._permission_trie = trie
+    return trie
+
+def invalidate_user_permissions(user_id):
+    with _cache_lock:
+        _cache.pop(user_id, None)
@@ -0,0 +1,158 @@
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from PIL import Image, ImageOps
+
+PREVIEW_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif', '.tiff', '.webp'}
+
+PREVIEW_FORMATS = {
+    'jpeg': ('JPEG', '.jpg', 'image/jpeg'),
+    'webp': ('WEBP', '.webp', 'image/webp'),
+}
+
+def is_previewable(name):
+    return os.path.splitext(name)[1].lower() in PREVIEW_EXTENSIONS
+
+def preview_sizes():
+    return {
+        'thumb': settings.PREVIEW_THUMB_SIZE,
+        'medium': settings.PREVIEW_MEDIUM_SIZE,
+    }
+
+def cache_path(rel_path, st, size_name, fmt):
+    """Location of a cached preview; a changed file gets a new key instead of a stale hit"""
+    key = f'{rel_path}\0{st.st_mtime_ns}\0{st.st_size}\0{size_name}'
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(settings.PREVIEW_CACHE_ROOT, digest[:2], digest + PREVIEW_FORMATS[fmt][1])
+
+def render_preview(full_path, out_path, max_px, fmt):
+    """Downscale an image to fit in max_px x max_px and write it to out_path"""
+    pil_format = PREVIEW_FORMATS[fmt][0]
+    with Image.open(full_path) as img:
+        # Lets the JPEG decoder skip most of the work for large photos
+        img.draft('RGB', (max_px, max_px))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_px, max_px), Image.Resampling.LANCZOS)
+
+        if img.mode not in ('RGB', 'L') and not (fmt == 'webp' and img.mode == 'RGBA'):
+            if 'A' in img.getbands() or img.mode == 'P':
+                img = img.convert('RGBA')
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                background.paste(img, mask=img.getchannel('A'))
+                img = background
+            else:
+                img = img.convert('RGB')
+
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        tmp_path = f'{out_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            img.save(tmp_path, pil_format, quality=settings.PREVIEW_QUALITY)
+            os.replace(tmp_path, out_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return os.path.getsize(out_path)
+
+class PreviewCache:
+    """Generates previews on a worker pool and keeps the cache under max_bytes.
+
+    Requests for a preview that is already being rendered wait for the same
+    job. A cache hit refreshes the file's mtime, so eviction removes the
+    least recently used previews first.
+    """
+
+    def __init__(self, root, max_bytes, workers):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='preview')
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.total_bytes = None
+
+    def get(self, full_path, out_path, max_px, fmt, timeout=None):
+        try:
+            os.utime(out_path)
+            return out_path
+        except FileNotFoundError:
+            pass
+
+        with self.lock:
+            future = self.pending.get(out_path)
+            if future is None:
+                future = self.executor.submit(self.generate, full_path, out_path, max_px, fmt)
+                self.pending[out_path] = future
+        future.result(timeout)
+        return out_path
+
+    def generate(self, full_path, out_path, max_px, fmt):
+        try:
+            if os.path.exists(out_path):
+                return
+            size = render_preview(full_path, out_path, max_px, fmt)
+            with self.lock:
+                if self.total_bytes is None:
+                    self.total_bytes = self.scan()[1]
+                else:
+                    self.total_bytes += size
+                over = self.total_bytes > self.max_bytes
+            if over:
+                self.evict()
+        finally:
+            with self.lock:
+                self.pending.pop(out_path, None)
+
+    def scan(self):
+        entries = []
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        return entries, total
+
+    def evict(self):
+        """Drop least recently used previews until the cache is at 90% of its limit"""
+        entries, total = self.scan()
+        target = self.max_bytes * 0.9
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self.lock:
+            self.total_bytes = total
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_preview_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PreviewCache(
+                    settings.PREVIEW_CACHE_ROOT,
+                    settings.PREVIEW_CACHE_MAX_BYTES,
+                    settings.PREVIEW_WORKERS,
+                )
+    return _cache
+
+def get_preview(full_path, rel_path, size_name='thumb', fmt='jpeg'):
+    """Return the path of a cached preview of full_path, rendering it if needed"""
+    st = os.stat(full_path)
+    out_path = cache_path(rel_path, st, size_name, fmt)
+    return get_preview_cache().get(full_path, out_path, preview_sizes()[size_name], fmt, settings.PREVIEW_TIMEOUT)
@@ -0,0 +1,152 @@
+"""Live progress of chunked uploads.
+
+Bytes are counted in a cache while chunks are being written, so progress
+can be read every second without touching the database. UploadSession
+only gets the running total every UPLOAD_PROGRESS_FLUSH_INTERVAL seconds.
+"""
+import json
+import time
+import asyncio
+from collections import deque
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Sum
+from django.utils import timezone
+from .aio import run_io
+from .models import UploadSession
+
+# Progress is pushed to the cache in steps of this many bytes
+REPORT_BYTES = 256 * 1024
+PROGRESS_TTL = 24 * 3600
+RATE_WINDOW = 5
+HEARTBEAT_INTERVAL = 15
+
+def progress_cache():
+    return caches[settings.UPLOAD_PROGRESS_CACHE]
+
+def received_key(session_id):
+    return f'upload-progress:{session_id}:received'
+
+def status_key(session_id):
+    return f'upload-progress:{session_id}:status'
+
+def add_received(session_id, nbytes, seed=0):
+    cache = progress_cache()
+    # Seeds the counter from the database after a restart or eviction
+    cache.add(received_key(session_id), seed, PROGRESS_TTL)
+    try:
+        cache.incr(received_key(session_id), nbytes)
+    except ValueError:
+        pass
+
+def set_progress_status(session_id, status, received=None):
+    values = {status_key(session_id): status}
+    if received is not None:
+        values[received_key(session_id)] = received
+    progress_cache().set_many(values, PROGRESS_TTL)
+
+def stored_bytes(session):
+    return session.chunks.aggregate(total=Sum('size'))['total'] or 0
+
+def get_progress(session):
+    """(bytes received, status) of a session, from the cache when it has them"""
+    values = progress_cache().get_many([received_key(session.session_id), status_key(session.session_id)])
+    received = values.get(received_key(session.session_id))
+    if received is None:
+        # uploaded_size lags behind by up to UPLOAD_PROGRESS_FLUSH_INTERVAL while uploading
+        received = stored_bytes(session) if session.status == 'uploading' else session.uploaded_size
+    status = values.get(status_key(session.session_id), session.status)
+    return received, status
+
+class ChunkProgress:
+    """Counts the bytes of one chunk into the cache as they are written.
+
+    Passed to write_chunk as its progress callback. finish() takes the
+    bytes back out again when the chunk is rejected, so retries are not
+    counted twice.
+    """
+
+    def __init__(self, session_id, seed=0):
+        self.session_id = session_id
+        self.seed = seed
+        self.reported = 0
+        self.unreported = 0
+
+    def __call__(self, nbytes):
+        self.unreported += nbytes
+        if self.unreported >= REPORT_BYTES:
+            self.flush()
+
+    def flush(self):
+        if self.unreported:
+            add_received(self.session_id, self.unreported, self.seed)
+            self.reported += self.unreported
+            self.unreported = 0
+
+    def finish(self, accepted):
+        if accepted:
+            self.flush()
+        elif self.reported:
+            add_received(self.session_id, -self.reported, self.seed)
+            self.reported = 0
+
+def should_flush(session_id):
+    """True at most once per UPLOAD_PROGRESS_FLUSH_INTERVAL for a session"""
+    return progress_cache().add(f'upload-progress:{session_id}:flushed', 1, settings.UPLOAD_PROGRESS_FLUSH_INTERVAL)
+
+def flush_progress(session):
+    """Write the bytes held in stored chunks to UploadSession.uploaded_size"""
+    uploaded = stored_bytes(session)
+    UploadSession.objects.filter(pk=session.pk).update(uploaded_size=uploaded, updated_at=timezone.now())
+
+class ProgressStream:
+    """Turns cache snapshots of one upload into server-sent events with throughput and ETA"""
+
+    def __init__(self, session):
+        self.session = session
+        self.samples = deque()
+        self.last_data = None
+        self.last_sent = 0
+        self.started = time.monotonic()
+
+    def poll(self):
+        """Return (event bytes or None, finished)"""
+        received, status = get_progress(self.session)
+        now = time.monotonic()
+        self.samples.append((now, received))
+        while len(self.samples) > 2 and now - self.samples[0][0] > RATE_WINDOW:
+            self.samples.popleft()
+
+        first_time, first_received = self.samples[0]
+        rate = (received - first_received) / (now - first_time) if now > first_time else 0
+        rate = max(rate, 0)
+        total = self.session.total_size
+        eta = round((total - received) / rate) if rate and received < total else None
+
+        finished = status != 'uploading'
+        data = {
+            'uploaded_size': min(received, total),
+            'total_size': total,
+            'rate': round(rate),
+            'eta': eta,
+            'status': status,
+        }
+        if data == self.last_data and now - self.last_sent < HEARTBEAT_INTERVAL:
+            return None, finished
+        self.last_data = data
+        self.last_sent = now
+        return f'event: progress\ndata: {json.dumps(data)}\n\n'.encode('utf-8'), finished
+
+    def expired(self):
+        return time.monotonic() - self.started > settings.UPLOAD_PROGRESS_STREAM_TIMEOUT
+
+async def aiter_progress_events(session):
+    stream = ProgressStream(session)
+    yield b'retry: 2000\n\n'
+    while True:
+        event, finished = await run_io(stream.poll)
+        if event:
+            yield event
+        if finished or stream.expired():
+            return
+        await asyncio.sleep(settings.UPLOAD_PROGRESS_EVENT_INTERVAL)
@@ -0,0 +1,9 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import FolderPermission
+from .permissions import invalidate_user_permissions
+
+@receiver(post_save, sender=FolderPermission)
+@receiver(post_delete, sender=FolderPermission)
+def folder_permission_changed(sender, instance, **kwargs):
+    invalidate_user_permissions(instance.user_id)
@@ -0,0 +1,72 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+def make_temp_dir(test):
+    path = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def response_body(response):
+    return b''.join(response.streaming_content) if response.streaming else response.content
+
+def make_tar(members):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    buf.seek(0)
+    return buf
+
+class StorageTestCase(TestCase):
+    """TestCase with the file tree and every cache folder in a fresh temporary directory.
+
+    Activity is written straight away and the background content indexer
+    is off, so tests see their effects without waiting on threads.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.root = make_temp_dir(self)
+        self.scratch = make_temp_dir(self)
+        overrides = override_settings(
+            FILE_STORAGE_ROOT=self.root,
+            UPLOAD_STAGING_ROOT=os.path.join(self.scratch, 'staging'),
+            CONTENT_STORE_ROOT=os.path.join(self.scratch, 'content_store'),
+            DELTA_CACHE_ROOT=os.path.join(self.scratch, 'delta'),
+            PREVIEW_CACHE_ROOT=os.path.join(self.scratch, 'previews'),
+            COMPRESSION_CACHE_ROOT=os.path.join(self.scratch, 'compressed'),
+            MANIFEST_SNAPSHOT_ROOT=os.path.join(self.scratch, 'manifests'),
+            CONTENT_INDEX_PATH=os.path.join(self.scratch, 'content_index.sqlite3'),
+            METRICS_SLOW_LOG=os.path.join(self.scratch, 'slow_requests.jsonl'),
+            ACTIVITY_LOG_ASYNC=False,
+            ACTIVITY_LOG_SPOOL_DIR=None,
+            CONTENT_INDEX_ENABLED=False,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        os.makedirs(os.path.join(self.scratch, 'staging'))
+        for cache in caches.all():
+            cache.clear()
+
+    def path(self, rel_path):
+        return os.path.join(self.root, rel_path)
+
+    def write(self, rel_path, data):
+        write_file(self.path(rel_path), data)
+        return self.path(rel_path)
@@ -0,0 +1,86 @@
+import os
+import json
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from ..activity import ActivitySpool, claim_journal, read_journal
+from ..models import FileActivity
+from .helpers import make_temp_dir
+
+class ActivitySpoolTests(TestCase):
+    def setUp(self):
+        self.dir = make_temp_dir(self)
+        self.user = User.objects.create_user('spool', password='pw')
+
+    def record(self, filename):
+        return {
+            'user_id': self.user.pk,
+            'filename': filename,
+            'filepath': f'ship/{filename}',
+            'activity_type': 'download',
+            'ip_address': '127.0.0.1',
+            'file_size': 1,
+            'timestamp': timezone.now().isoformat(),
+        }
+
+    def test_checkpoint_skips_written_records(self):
+        spool = ActivitySpool(self.dir)
+        self.addCleanup(spool.close)
+        for name in ('a', 'b', 'c'):
+            spool.append(self.record(name))
+        spool.checkpoint(2)
+        self.assertEqual([record['filename'] for record in read_journal(spool.path)], ['c'])
+
+        # Checkpoints may arrive out of order; an older one never moves back
+        spool.checkpoint(1)
+        self.assertEqual([record['seq'] for record in read_journal(spool.path)], [3])
+
+        spool.checkpoint(3)
+        self.assertEqual(os.path.getsize(spool.path), 0)
+        spool.append(self.record('d'))
+        self.assertEqual([record['seq'] for record in read_journal(spool.path)], [4])
+
+    def write_journal(self, name, done=None):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            for seq, filename in enumerate(('a', 'b', 'c'), start=1):
+                f.write(json.dumps({**self.record(filename), 'seq': seq}) + '\n')
+            f.write('{"partial')
+        if done is not None:
+            with open(f'{path}.done', 'w') as f:
+                f.write(str(done))
+        return path
+
+    def test_journal_of_a_dead_process_is_replayed(self):
+        # Far above any pid a test run would get
+        path = self.write_journal('activity-999999999.jsonl', done=1)
+
+        spool = ActivitySpool(self.dir)
+        self.addCleanup(spool.close)
+        self.assertEqual(spool.recover(), 2)
+        self.assertEqual(sorted(FileActivity.objects.values_list('filename', flat=True)), ['b', 'c'])
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(f'{path}.done'))
+
+    def test_journal_claimed_by_a_running_process_is_left_alone(self):
+        # pid 1 is always running
+        path = self.write_journal('activity-999999999.jsonl.claimed-1')
+        spool = ActivitySpool(self.dir)
+        self.addCleanup(spool.close)
+        self.assertEqual(spool.recover(), 0)
+        self.assertTrue(os.path.exists(path))
+
+    def test_claim_of_a_process_that_died_replaying_is_taken_over(self):
+        path = self.write_journal('activity-999999998.jsonl.claimed-999999999', done=2)
+        spool = ActivitySpool(self.dir)
+        self.addCleanup(spool.close)
+        self.assertEqual(spool.recover(), 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(f'{path}.done'))
+
+    def test_journal_taken_by_another_process_is_skipped(self):
+        path = self.write_journal('activity-999999999.jsonl', done=1)
+        claimed = claim_journal(path)
+        self.assertEqual(claimed, f'{path}.claimed-{os.getpid()}')
+        self.assertTrue(os.path.exists(f'{claimed}.done'))
+        self.assertIsNone(claim_journal(path))
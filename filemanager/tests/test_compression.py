@@ -0,0 +1,91 @@
+import os
+import zlib
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from ..compression import accepted_encodings, choose_encoding, prune_sidecars, sidecar_path, write_sidecar
+from ..models import FolderPermission
+from .helpers import StorageTestCase, response_body
+
+class AcceptEncodingTests(SimpleTestCase):
+    @mock.patch('filemanager.compression.available_encodings', return_value=['zstd', 'br', 'gzip'])
+    def test_server_preference_among_accepted(self, available):
+        self.assertEqual(accepted_encodings('gzip, br'), ['br', 'gzip'])
+        self.assertEqual(accepted_encodings('GZIP;q=0.5, zstd;q=0'), ['gzip'])
+        self.assertEqual(accepted_encodings('*, br;q=0'), ['zstd', 'gzip'])
+        self.assertEqual(accepted_encodings('gzip;q=bad, deflate'), [])
+        self.assertEqual(accepted_encodings(None), [])
+
+class ChooseEncodingTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.rel_path = 'ship/engine.log'
+        self.full_path = self.write(self.rel_path, b'temperature 80\n' * 200)
+
+    def choose(self, rel_path=None, **headers):
+        rel_path = rel_path or self.rel_path
+        request = RequestFactory().get('/', **headers)
+        return choose_encoding(request, rel_path, os.stat(self.path(rel_path)))
+
+    def test_compressible_files_are_compressed_on_the_fly(self):
+        self.assertEqual(self.choose(HTTP_ACCEPT_ENCODING='gzip'), ('gzip', None))
+        self.assertEqual(self.choose(), (None, None))
+        # Byte offsets of a stream compressed on the fly are not stable
+        self.assertEqual(self.choose(HTTP_ACCEPT_ENCODING='gzip', HTTP_RANGE='bytes=0-9'), (None, None))
+
+    def test_small_and_incompressible_files_are_sent_as_they_are(self):
+        self.write('ship/small.log', b'x' * 100)
+        self.write('ship/photo.jpg', b'x' * 5000)
+        self.assertEqual(self.choose('ship/small.log', HTTP_ACCEPT_ENCODING='gzip'), (None, None))
+        self.assertEqual(self.choose('ship/photo.jpg', HTTP_ACCEPT_ENCODING='gzip'), (None, None))
+        with override_settings(COMPRESSION_ENABLED=False):
+            self.assertEqual(self.choose(HTTP_ACCEPT_ENCODING='gzip'), (None, None))
+
+    def test_fresh_sidecar_is_preferred_and_serves_ranges(self):
+        write_sidecar(self.full_path, self.rel_path, 'gzip')
+        sidecar = sidecar_path(self.rel_path, 'gzip')
+        self.assertEqual(self.choose(HTTP_ACCEPT_ENCODING='gzip', HTTP_RANGE='bytes=0-9'), ('gzip', sidecar))
+        with open(sidecar, 'rb') as f:
+            self.assertEqual(zlib.decompress(f.read(), 31), b'temperature 80\n' * 200)
+
+    def test_changed_source_makes_the_sidecar_stale(self):
+        write_sidecar(self.full_path, self.rel_path, 'gzip')
+        st = os.stat(self.full_path)
+        os.utime(self.full_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        self.assertEqual(self.choose(HTTP_ACCEPT_ENCODING='gzip'), ('gzip', None))
+
+        self.write('ship/gone.log', b'x' * 2000)
+        write_sidecar(self.path('ship/gone.log'), 'ship/gone.log', 'gzip')
+        os.remove(self.path('ship/gone.log'))
+        self.assertEqual(prune_sidecars(), 2)
+        self.assertEqual(prune_sidecars(), 0)
+
+class EncodedDownloadTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = b'temperature 80\n' * 200
+        self.full_path = self.write('ship/engine.log', self.data)
+        user = User.objects.create_user('crew', password='pw')
+        FolderPermission.objects.create(user=user, folder_path='ship', permission='read')
+        self.client.force_login(user)
+
+    def test_gzip_download_has_its_own_etag(self):
+        plain = self.client.get('/download/ship/engine.log/')
+        encoded = self.client.get('/download/ship/engine.log/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertEqual(encoded['Content-Encoding'], 'gzip')
+        self.assertEqual(zlib.decompress(response_body(encoded), 31), self.data)
+        self.assertNotEqual(plain['ETag'], encoded['ETag'])
+        self.assertIn('Accept-Encoding', encoded['Vary'])
+
+        response = self.client.get('/download/ship/engine.log/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=encoded['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_sidecar_download_resumes(self):
+        write_sidecar(self.full_path, 'ship/engine.log', 'gzip')
+        with open(sidecar_path('ship/engine.log', 'gzip'), 'rb') as f:
+            compressed = f.read()
+        response = self.client.get('/download/ship/engine.log/', HTTP_ACCEPT_ENCODING='gzip', HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response_body(response), compressed[10:])
@@ -0,0 +1,91 @@
+import os
+import zipfile
+from django.contrib.auth.models import User
+from ..contentindex import fts_query, refresh_content_index, search_contents, update_document
+from ..extractors import extract_text
+from ..models import FolderPermission
+from .helpers import StorageTestCase
+
+DOCX_BODY = (
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+    '<w:p><w:r><w:t>Ballast water </w:t></w:r><w:r><w:t>exchange report</w:t></w:r></w:p>'
+    '<w:p><w:r><w:t>Second paragraph</w:t></w:r></w:p>'
+    '</w:body></w:document>'
+)
+
+def grants(*folders):
+    return [{'folder_path': folder, 'permission': 'read'} for folder in folders]
+
+class ContentIndexTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write('VesselA/engine.log', 'Main engine overheat alarm at 03:00 <b>check</b>'.encode('utf-8'))
+        self.write('VesselA/crew.csv', b'name,rank\nJensen,chief engineer\n')
+        self.write('vessela/notes.txt', b'overheat drill')
+        self.write('VesselA/photo.jpg', b'overheat')
+        with zipfile.ZipFile(self.path('VesselA/ballast.docx'), 'w') as archive:
+            archive.writestr('word/document.xml', DOCX_BODY)
+
+    def search(self, folders, text):
+        return [result['path'] for result in search_contents(grants(*folders), text)[0]]
+
+    def test_refresh_extracts_only_what_changed(self):
+        self.assertEqual(refresh_content_index(), {'indexed': 4, 'failed': 0, 'removed': 0, 'unchanged': 0})
+        self.assertEqual(refresh_content_index(), {'indexed': 0, 'failed': 0, 'removed': 0, 'unchanged': 4})
+
+        self.write('VesselA/crew.csv', b'name,rank\nHansen,master\n')
+        os.remove(self.path('vessela/notes.txt'))
+        self.assertEqual(refresh_content_index(), {'indexed': 1, 'failed': 0, 'removed': 1, 'unchanged': 2})
+        self.assertEqual(self.search(['/'], 'hansen'), ['VesselA/crew.csv'])
+        self.assertEqual(self.search(['/'], 'jensen'), [])
+
+    def test_docx_text_is_searchable(self):
+        self.assertEqual(extract_text(self.path('VesselA/ballast.docx'), 1000), 'Ballast water exchange report\nSecond paragraph\n')
+        refresh_content_index()
+        self.assertEqual(self.search(['VesselA'], 'ballast exch'), ['VesselA/ballast.docx'])
+
+    def test_results_are_limited_to_readable_folders(self):
+        refresh_content_index()
+        self.assertEqual(self.search(['VesselA'], 'overheat'), ['VesselA/engine.log'])
+        self.assertEqual(self.search(['vessela'], 'overheat'), ['vessela/notes.txt'])
+        self.assertEqual(sorted(self.search(['/'], 'overheat')), ['VesselA/engine.log', 'vessela/notes.txt'])
+        self.assertEqual(self.search([], 'overheat'), [])
+
+    def test_user_input_is_quoted_and_snippets_escaped(self):
+        self.assertEqual(fts_query('engine "alarm OR'), '"engine" """alarm" "OR"*')
+        self.assertIsNone(fts_query('   '))
+        refresh_content_index()
+        results, truncated = search_contents(grants('/'), 'alarm AND')
+        self.assertEqual(results, [])
+        results, truncated = search_contents(grants('/'), 'overheat alarm')
+        self.assertIn('<mark>overheat</mark> <mark>alarm</mark>', results[0]['snippet'])
+        self.assertIn('&lt;b&gt;check&lt;/b&gt;', results[0]['snippet'])
+
+    def test_single_file_and_folder_updates(self):
+        refresh_content_index()
+        self.write('VesselA/new.txt', b'bilge pump log')
+        update_document('VesselA/new.txt')
+        self.assertEqual(self.search(['/'], 'bilge'), ['VesselA/new.txt'])
+
+        for name in os.listdir(self.path('vessela')):
+            os.remove(self.path(f'vessela/{name}'))
+        os.rmdir(self.path('vessela'))
+        update_document('vessela')
+        self.assertEqual(self.search(['/'], 'overheat'), ['VesselA/engine.log'])
+
+class ContentSearchViewTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write('ship/engine.log', b'overheat alarm')
+        self.write('other/engine.log', b'overheat alarm')
+        user = User.objects.create_user('crew', password='pw')
+        FolderPermission.objects.create(user=user, folder_path='ship', permission='read')
+        self.client.force_login(user)
+
+    def test_search_before_and_after_the_index_is_built(self):
+        self.assertEqual(self.client.get('/search/content/', {'q': 'overheat'}).status_code, 503)
+        refresh_content_index()
+        data = self.client.get('/search/content/', {'q': 'overh'}).json()
+        self.assertEqual([result['path'] for result in data['results']], ['ship/engine.log'])
+        self.assertEqual(data['results'][0]['snippet'], '<mark>overheat</mark> alarm')
+        self.assertEqual(self.client.get('/search/content/', {'q': ' '}).json(), {'results': []})
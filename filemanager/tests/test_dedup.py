@@ -0,0 +1,93 @@
+import os
+import json
+import stat
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from ..dedup import blob_path, hash_file, prune_references, release_path, remove_file
+from ..models import ContentBlob, ContentReference, FolderPermission
+from .helpers import StorageTestCase, read_file
+
+real_remove = os.remove
+
+def windows_remove(path):
+    """os.remove as on Windows, where a read-only file cannot be deleted"""
+    if not os.stat(path).st_mode & stat.S_IWRITE:
+        raise PermissionError(13, 'Access is denied', path)
+    real_remove(path)
+
+@override_settings(DEDUP_STORAGE_ENABLED=True)
+class DedupTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('crew', password='pw')
+        FolderPermission.objects.create(user=self.user, folder_path='ship', permission='admin')
+        self.client.force_login(self.user)
+
+    def upload(self, folder_path, name, data):
+        response = self.client.post('/upload/', {'folder_path': folder_path, 'files': SimpleUploadedFile(name, data)})
+        return response.json()['uploaded_files'][0]['name']
+
+    def delete(self, rel_path):
+        return self.client.post('/delete/', json.dumps({'path': rel_path}), content_type='application/json')
+
+    def test_same_content_is_stored_once(self):
+        self.upload('ship/a', 'log.txt', b'same bytes')
+        self.upload('ship/b', 'copy.txt', b'same bytes')
+        self.upload('ship/b', 'other.txt', b'other bytes')
+
+        self.assertEqual(ContentBlob.objects.count(), 2)
+        blob = ContentBlob.objects.get(digest=hash_file(self.path('ship/a/log.txt')))
+        self.assertEqual(sorted(blob.references.values_list('path', flat=True)), ['ship/a/log.txt', 'ship/b/copy.txt'])
+        self.assertTrue(os.path.samefile(self.path('ship/a/log.txt'), self.path('ship/b/copy.txt')))
+        self.assertFalse(os.stat(blob_path(blob.digest)).st_mode & stat.S_IWRITE)
+
+    def test_blob_goes_with_the_last_reference(self):
+        self.upload('ship', 'a.txt', b'same bytes')
+        self.upload('ship', 'a.txt', b'same bytes')
+        digest = hash_file(self.path('ship/a.txt'))
+
+        self.assertEqual(self.delete('ship/a.txt').status_code, 200)
+        self.assertTrue(os.path.exists(blob_path(digest)))
+        self.assertEqual(read_file(self.path('ship/a_1.txt')), b'same bytes')
+
+        self.assertEqual(self.delete('ship/a_1.txt').status_code, 200)
+        self.assertFalse(os.path.exists(blob_path(digest)))
+        self.assertFalse(ContentBlob.objects.exists())
+
+    def test_read_only_links_can_be_deleted_on_windows(self):
+        self.upload('ship', 'a.txt', b'same bytes')
+        self.upload('ship', 'b.txt', b'same bytes')
+        digest = hash_file(self.path('ship/a.txt'))
+
+        with mock.patch('os.remove', windows_remove):
+            self.assertEqual(self.delete('ship/a.txt').status_code, 200)
+            self.assertFalse(os.path.exists(self.path('ship/a.txt')))
+            # The remaining copy is protected again
+            self.assertFalse(os.stat(blob_path(digest)).st_mode & stat.S_IWRITE)
+
+            self.assertEqual(self.delete('ship/b.txt').status_code, 200)
+            self.assertFalse(os.path.exists(blob_path(digest)))
+
+    def test_failed_remove_keeps_the_file_read_only(self):
+        path = self.write('ship/a.txt', b'x')
+        os.chmod(path, stat.S_IRUSR)
+        self.addCleanup(os.chmod, path, stat.S_IRUSR | stat.S_IWUSR)
+        with mock.patch('os.remove', side_effect=PermissionError):
+            with self.assertRaises(PermissionError):
+                remove_file(path)
+        self.assertFalse(os.stat(path).st_mode & stat.S_IWRITE)
+
+    def test_prune_drops_references_to_replaced_files(self):
+        self.upload('ship', 'a.txt', b'same bytes')
+        self.upload('ship', 'b.txt', b'same bytes')
+        os.remove(self.path('ship/a.txt'))
+        self.write('ship/a.txt', b'edited elsewhere')
+        self.assertEqual(prune_references(), (1, 0))
+        os.remove(self.path('ship/b.txt'))
+        self.assertEqual(prune_references(), (1, 1))
+        self.assertFalse(ContentReference.objects.exists())
+
+    def test_release_of_an_unknown_path_is_ignored(self):
+        release_path('ship/never-uploaded.txt')
@@ -0,0 +1,99 @@
+import os
+import json
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, override_settings
+from ..delta import compute_signature, match_blocks, reconstruct, weak_checksum
+from ..models import FolderPermission
+from .helpers import StorageTestCase, make_temp_dir, write_file
+
+class DeltaTests(SimpleTestCase):
+    block_size = 64
+
+    def setUp(self):
+        self.dir = make_temp_dir(self)
+
+    def path(self, name, data):
+        path = os.path.join(self.dir, name)
+        write_file(path, data)
+        return path
+
+    def test_rolled_checksum_matches_a_fresh_one(self):
+        data = os.urandom(300)
+        a, b = weak_checksum(data[0:self.block_size])
+        for pos in range(1, 100):
+            out_byte, in_byte = data[pos - 1], data[pos - 1 + self.block_size]
+            a = (a - out_byte + in_byte) & 0xffff
+            b = (b - self.block_size * out_byte + a) & 0xffff
+            self.assertEqual((a, b), weak_checksum(data[pos:pos + self.block_size]))
+
+    def test_shifted_blocks_are_found(self):
+        new = os.urandom(self.block_size * 5 + 10)
+        # The local copy lacks the first 7 bytes and one block was changed
+        old = new[7:self.block_size * 3] + os.urandom(self.block_size) + new[self.block_size * 4:]
+        signature = compute_signature(self.path('new.bin', new), self.block_size)
+        found = match_blocks(self.path('old.bin', old), signature)
+
+        self.assertNotIn(0, found)
+        self.assertNotIn(3, found)
+        self.assertEqual(found[1], self.block_size - 7)
+        self.assertEqual(found[2], self.block_size * 2 - 7)
+        # The short final block
+        self.assertIn(5, found)
+
+    def test_reconstruct_fetches_only_missing_blocks(self):
+        new = os.urandom(self.block_size * 4 + 20)
+        old = new[:self.block_size * 2] + os.urandom(self.block_size) + new[self.block_size * 3:]
+        signature = compute_signature(self.path('new.bin', new), self.block_size)
+        old_path = self.path('old.bin', old)
+        found = match_blocks(old_path, signature)
+        requested = []
+
+        def fetch_missing(indices):
+            requested.extend(indices)
+            for index in indices:
+                yield new[index * self.block_size:(index + 1) * self.block_size]
+
+        out_path = os.path.join(self.dir, 'out.bin')
+        fetched = reconstruct(old_path, signature, found, fetch_missing, out_path)
+        self.assertEqual(requested, [2])
+        self.assertEqual(fetched, self.block_size)
+        with open(out_path, 'rb') as f:
+            self.assertEqual(f.read(), new)
+
+@override_settings(DELTA_BLOCK_SIZE=4096, DELTA_MIN_BLOCK_SIZE=4096, DELTA_MAX_BLOCKS_PER_REQUEST=2)
+class DeltaViewTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = os.urandom(4096 * 3 + 100)
+        self.write('ship/track.bin', self.data)
+        user = User.objects.create_user('crew', password='pw')
+        FolderPermission.objects.create(user=user, folder_path='ship', permission='read')
+        self.client.force_login(user)
+
+    def blocks(self, body):
+        if not isinstance(body, (str, bytes)):
+            body = json.dumps(body)
+        return self.client.post('/delta/blocks/ship/track.bin/', body, content_type='application/json')
+
+    def test_blocks_for_the_signed_version(self):
+        signature = self.client.get('/delta/signature/ship/track.bin/').json()
+        self.assertEqual((signature['block_size'], len(signature['blocks'])), (4096, 4))
+        response = self.blocks({'etag': signature['etag'], 'indices': [3, 1]})
+        self.assertEqual(b''.join(response.streaming_content), self.data[4096:8192] + self.data[12288:])
+        self.assertEqual(int(response['Content-Length']), 4096 + 100)
+
+    def test_changed_file_needs_a_new_signature(self):
+        etag = self.client.get('/delta/signature/ship/track.bin/').json()['etag']
+        self.write('ship/track.bin', b'changed')
+        self.assertEqual(self.blocks({'etag': etag, 'indices': [0]}).status_code, 412)
+
+    def test_bad_requests(self):
+        etag = self.client.get('/delta/signature/ship/track.bin/').json()['etag']
+        for body in ('not json', '[1, 2]', '"etag"', b'\xff'):
+            self.assertEqual(self.blocks(body).status_code, 400, body)
+        for indices in (['x'], [4], [-1], [0, 1, 2], 5):
+            self.assertEqual(self.blocks({'etag': etag, 'indices': indices}).status_code, 400, indices)
+
+    def test_unreadable_file(self):
+        self.assertEqual(self.client.get('/delta/signature/other/track.bin/').status_code, 403)
+        self.assertEqual(self.client.get('/delta/signature/ship/missing.bin/').status_code, 404)
@@ -0,0 +1,172 @@
+import os
+from django.contrib.auth.models import User
+from django.http import FileResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.utils.http import http_date
+from ..downloads import if_range_matches, offload_target, parse_range_header, serve_file
+from ..models import FileActivity, FolderPermission
+from .helpers import StorageTestCase, make_temp_dir, response_body, write_file
+
+class RangeHeaderTests(SimpleTestCase):
+    def test_absent_or_malformed_header_is_ignored(self):
+        for header in (None, '', 'items=0-1', 'bytes=', 'bytes=abc', 'bytes=5', 'bytes=5-2'):
+            self.assertIsNone(parse_range_header(header, 100), header)
+
+    def test_single_and_open_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-9', 100), [(0, 9)])
+        self.assertEqual(parse_range_header('bytes=90-', 100), [(90, 99)])
+        self.assertEqual(parse_range_header('bytes=90-500', 100), [(90, 99)])
+
+    def test_suffix_range(self):
+        self.assertEqual(parse_range_header('bytes=-10', 100), [(90, 99)])
+        self.assertEqual(parse_range_header('bytes=-500', 100), [(0, 99)])
+
+    def test_overlapping_ranges_are_merged(self):
+        self.assertEqual(parse_range_header('bytes=50-59, 0-9, 5-20, 21-30', 100), [(0, 30), (50, 59)])
+
+    def test_unsatisfiable_ranges(self):
+        self.assertEqual(parse_range_header('bytes=100-200', 100), [])
+        self.assertEqual(parse_range_header('bytes=-0', 100), [])
+
+    def test_too_many_ranges_fall_back_to_the_whole_file(self):
+        header = 'bytes=' + ','.join(f'{i * 2}-{i * 2}' for i in range(40))
+        self.assertIsNone(parse_range_header(header, 1000))
+
+class IfRangeTests(SimpleTestCase):
+    etag = '"1-2-3"'
+    mtime = 1700000000.5
+
+    def matches(self, if_range):
+        headers = {'HTTP_IF_RANGE': if_range} if if_range is not None else {}
+        return if_range_matches(RequestFactory().get('/', **headers), self.etag, self.mtime)
+
+    def test_without_if_range(self):
+        self.assertTrue(self.matches(None))
+
+    def test_etag(self):
+        self.assertTrue(self.matches(self.etag))
+        self.assertFalse(self.matches('"other"'))
+        self.assertFalse(self.matches(f'W/{self.etag}'))
+
+    def test_date(self):
+        self.assertTrue(self.matches(http_date(int(self.mtime))))
+        self.assertFalse(self.matches(http_date(int(self.mtime) - 60)))
+        self.assertFalse(self.matches('not a date'))
+
+class ServeFileRangeTests(SimpleTestCase):
+    def setUp(self):
+        self.path = os.path.join(make_temp_dir(self), 'data.bin')
+        self.data = bytes(range(256)) * 4
+        write_file(self.path, self.data)
+
+    def serve(self, **headers):
+        response = serve_file(RequestFactory().get('/', **headers), self.path, 'data.bin')
+        return response, response_body(response)
+
+    def test_whole_file(self):
+        response, body = self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+
+    def test_single_range(self):
+        response, body = self.serve(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.data)}')
+        self.assertEqual(body, self.data[10:20])
+
+    def test_unsatisfiable_range(self):
+        response, body = self.serve(HTTP_RANGE='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+    def test_multiple_ranges(self):
+        response, body = self.serve(HTTP_RANGE='bytes=0-3,100-103')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+        self.assertIn(self.data[0:4], body)
+        self.assertIn(self.data[100:104], body)
+        self.assertIn(f'Content-Range: bytes 100-103/{len(self.data)}'.encode(), body)
+
+    def test_stale_if_range_sends_the_whole_file(self):
+        response, body = self.serve(HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+
+class DownloadViewTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = os.urandom(4096)
+        self.write('ship/logs/track.bin', self.data)
+        self.user = User.objects.create_user('crew', password='pw')
+        FolderPermission.objects.create(user=self.user, folder_path='ship', permission='read')
+        self.client.force_login(self.user)
+
+    def get(self, path='ship/logs/track.bin', **headers):
+        response = self.client.get(f'/download/{path}/', **headers)
+        return response, response_body(response)
+
+    def test_whole_file_is_logged_once(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(body, self.data)
+        self.assertEqual(FileActivity.objects.filter(activity_type='download').count(), 1)
+
+    def test_resumed_download(self):
+        st = os.stat(self.path('ship/logs/track.bin'))
+        response, body = self.get(HTTP_RANGE='bytes=1000-', HTTP_IF_RANGE=http_date(st.st_mtime))
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[1000:])
+        # Resuming is not a new download
+        self.assertFalse(FileActivity.objects.exists())
+
+    def test_resume_against_a_changed_file_starts_over(self):
+        response, body = self.get(HTTP_RANGE='bytes=1000-', HTTP_IF_RANGE=http_date(0))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+
+    def test_unreadable_and_missing_files(self):
+        self.write('other/secret.bin', b'secret')
+        self.assertEqual(self.get('other/secret.bin')[0].status_code, 403)
+        self.assertEqual(self.get('ship/missing.bin')[0].status_code, 404)
+
+class OffloadTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.full_path = self.write('ship/Engine Log #1.txt', b'x' * 2000)
+        user = User.objects.create_user('crew', password='pw')
+        FolderPermission.objects.create(user=user, folder_path='ship', permission='read')
+        self.client.force_login(user)
+
+    def get(self, **headers):
+        return self.client.get('/download/ship/Engine%20Log%20%231.txt/', HTTP_ACCEPT_ENCODING='identity', **headers)
+
+    def test_targets(self):
+        self.assertIsNone(offload_target(self.full_path))
+        with override_settings(DOWNLOAD_BACKEND='xsendfile'):
+            self.assertEqual(offload_target(self.full_path), ('X-Sendfile', os.path.abspath(self.full_path)))
+        with override_settings(DOWNLOAD_BACKEND='xaccel', DOWNLOAD_ACCEL_LOCATION='/protected/'):
+            self.assertEqual(offload_target(self.full_path), ('X-Accel-Redirect', '/protected/ship/Engine%20Log%20%231.txt'))
+            # Sidecars and other files outside the mapped root are served here
+            self.assertIsNone(offload_target(os.path.join(self.scratch, 'elsewhere.txt')))
+
+    def test_wsgi_backend_hands_the_file_to_the_server(self):
+        response = self.get()
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(response.block_size, 1024 * 1024)
+        response_body(response)
+
+    @override_settings(DOWNLOAD_BACKEND='xaccel', DOWNLOAD_ACCEL_LOCATION='/protected/')
+    def test_offloaded_download_has_no_body(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/ship/Engine%20Log%20%231.txt')
+        self.assertEqual(response.content, b'')
+        self.assertIn('ETag', response)
+        self.assertEqual(FileActivity.objects.filter(activity_type='download').count(), 1)
+
+        # The front-end server answers the range; a resume is not logged again
+        st = os.stat(self.full_path)
+        response = self.get(HTTP_RANGE='bytes=100-', HTTP_IF_RANGE=http_date(st.st_mtime))
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/ship/Engine%20Log%20%231.txt')
+        self.assertEqual(FileActivity.objects.filter(activity_type='download').count(), 1)
@@ -0,0 +1,60 @@
+import os
+from ..folderstats import (
+    reconcile_folder_stats, record_file_added, record_file_removed, record_folder_created, record_folder_removed,
+)
+from ..models import FolderStats
+from .helpers import StorageTestCase
+
+class FolderStatsTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write('ship/a.txt', b'x' * 10)
+        self.write('ship/logs/b.txt', b'x' * 5)
+        self.write('other/c.txt', b'x' * 3)
+        reconcile_folder_stats()
+
+    def totals(self):
+        return {row.path: (row.total_size, row.file_count) for row in FolderStats.objects.all()}
+
+    def test_reconcile_rolls_children_up(self):
+        self.assertEqual(self.totals(), {'': (18, 3), 'ship': (15, 2), 'ship/logs': (5, 1), 'other': (3, 1)})
+        self.assertEqual(reconcile_folder_stats(), {'created': 0, 'updated': 0, 'removed': 0, 'unchanged': 4})
+
+    def test_file_deltas_reach_every_ancestor(self):
+        self.write('ship/logs/d.txt', b'x' * 7)
+        record_file_added('ship/logs/d.txt')
+        self.assertEqual(self.totals()['ship/logs'], (12, 2))
+        self.assertEqual(self.totals()['ship'], (22, 3))
+        self.assertEqual(self.totals()[''], (25, 4))
+
+        os.remove(self.path('ship/a.txt'))
+        record_file_removed('ship/a.txt', 10)
+        self.assertEqual(self.totals()['ship'], (12, 2))
+        self.assertEqual(self.totals()['other'], (3, 1))
+        self.assertEqual(reconcile_folder_stats()['updated'], 0)
+
+    def test_folder_rows_follow_create_and_remove(self):
+        os.makedirs(self.path('ship/new'))
+        record_folder_created('ship/new')
+        self.assertEqual(self.totals()['ship/new'], (0, 0))
+        # No row for the parent means nothing to attach to; the reconciler fills it in later
+        record_folder_created('missing/new')
+        self.assertNotIn('missing/new', self.totals())
+
+        record_folder_removed('ship/logs')
+        self.assertNotIn('ship/logs', self.totals())
+        self.assertEqual(self.totals()['ship'], (10, 1))
+        self.assertEqual(self.totals()[''], (13, 2))
+
+    def test_removing_a_folder_keeps_siblings_that_differ_in_case(self):
+        self.write('Ship/e.txt', b'x')
+        self.write('Ship/logs/f.txt', b'x')
+        reconcile_folder_stats()
+        record_folder_removed('Ship')
+        self.assertEqual(sorted(self.totals()), ['', 'other', 'ship', 'ship/logs'])
+
+    def test_reconcile_of_a_subtree_corrects_the_ancestors(self):
+        self.write('ship/logs/d.txt', b'x' * 7)
+        self.assertEqual(reconcile_folder_stats('ship/logs')['updated'], 1)
+        self.assertEqual(self.totals()['ship'], (22, 3))
+        self.assertEqual(self.totals()[''], (25, 4))
@@ -0,0 +1,71 @@
+import os
+from django.contrib.auth.models import User
+from ..indexing import refresh_file_index, remove_from_index, search_index
+from ..models import FileIndexEntry, FolderPermission
+from .helpers import StorageTestCase
+
+class FileIndexTests(StorageTestCase):
+    def indexed(self):
+        return set(FileIndexEntry.objects.values_list('path', flat=True))
+
+    def test_refresh_only_touches_what_changed(self):
+        self.write('ship/a.txt', b'a')
+        self.write('ship/logs/b.txt', b'b')
+        self.assertEqual(refresh_file_index(), {'added': 2, 'updated': 0, 'removed': 0, 'unchanged': 0})
+        self.assertEqual(refresh_file_index(), {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 2})
+
+        self.write('ship/a.txt', b'longer')
+        os.remove(self.path('ship/logs/b.txt'))
+        self.assertEqual(refresh_file_index(), {'added': 0, 'updated': 1, 'removed': 1, 'unchanged': 0})
+        self.assertEqual(FileIndexEntry.objects.get(path='ship/a.txt').size, 6)
+
+    def test_refresh_of_a_subtree_leaves_the_rest_alone(self):
+        self.write('ship/a.txt', b'a')
+        refresh_file_index()
+        os.remove(self.path('ship/a.txt'))
+        self.write('other/b.txt', b'b')
+        refresh_file_index('other')
+        self.assertEqual(self.indexed(), {'ship/a.txt', 'other/b.txt'})
+
+    def test_removing_a_folder_keeps_siblings_that_differ_in_case(self):
+        self.write('VesselA/log.txt', b'a')
+        self.write('vessela/log.txt', b'b')
+        self.write('VesselAB/log.txt', b'c')
+        refresh_file_index()
+        remove_from_index('VesselA')
+        self.assertEqual(self.indexed(), {'vessela/log.txt', 'VesselAB/log.txt'})
+
+class SearchIndexTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        for rel_path in ('VesselA/engine log.txt', 'VesselA/deck/Log.csv', 'vessela/log.txt', 'VesselB/log.txt'):
+            self.write(rel_path, b'x')
+        refresh_file_index()
+
+    def search(self, folders, query, file_type=''):
+        permissions = [{'folder_path': folder, 'permission': 'read'} for folder in folders]
+        entries, truncated = search_index(permissions, query, file_type)
+        return [entry.path for entry in entries]
+
+    def test_only_readable_folders_are_searched(self):
+        self.assertEqual(self.search(['VesselA'], 'log'), ['VesselA/engine log.txt', 'VesselA/deck/Log.csv'])
+
+    def test_folder_grants_are_case_sensitive(self):
+        self.assertEqual(self.search(['vessela'], 'log'), ['vessela/log.txt'])
+
+    def test_root_grant_and_no_grant(self):
+        self.assertEqual(len(self.search(['/'], 'log')), 4)
+        self.assertEqual(self.search([], 'log'), [])
+
+    def test_file_type_and_limit(self):
+        self.assertEqual(self.search(['/'], 'LOG', '.CSV'), ['VesselA/deck/Log.csv'])
+        entries, truncated = search_index([{'folder_path': '/', 'permission': 'read'}], 'log', limit=2)
+        self.assertEqual(len(entries), 2)
+        self.assertTrue(truncated)
+
+    def test_search_view(self):
+        user = User.objects.create_user('crew', password='pw')
+        FolderPermission.objects.create(user=user, folder_path='VesselA', permission='read')
+        self.client.force_login(user)
+        results = self.client.get('/search/', {'q': 'log'}).json()['results']
+        self.assertEqual(sorted(result['path'] for result in results), ['VesselA/deck/Log.csv', 'VesselA/engine log.txt'])
@@ -0,0 +1,88 @@
+import os
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, override_settings
+from ..ingest import Ingest, IngestError, clean_member_path, ingest_archive
+from ..models import FileActivity, FileIndexEntry, FolderPermission
+from .helpers import StorageTestCase, make_tar, read_file
+
+class CleanMemberPathTests(SimpleTestCase):
+    def test_plain_paths(self):
+        self.assertEqual(clean_member_path('a/b c/d.txt'), ['a', 'b_c', 'd.txt'])
+        self.assertEqual(clean_member_path('./a//b\\c.txt'), ['a', 'b', 'c.txt'])
+
+    def test_unsafe_paths_are_rejected(self):
+        for name in ('/etc/passwd', 'C:/x.txt', '../x.txt', 'a/../../x.txt', 'a/ /b', 'a/""/b', './'):
+            self.assertIsNone(clean_member_path(name), name)
+
+@override_settings(DEDUP_STORAGE_ENABLED=False, ACTIVITY_LOG_ASYNC=False, CONTENT_INDEX_ENABLED=False)
+
+@override_settings(DEDUP_STORAGE_ENABLED=False)
+class IngestTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('ingest', password='pw')
+        FolderPermission.objects.create(user=self.user, folder_path='/', permission='write')
+
+    def ingest(self, members):
+        return ingest_archive(self.user, 'target', make_tar(members), None, '127.0.0.1')
+
+    def test_files_are_placed_and_unsafe_members_skipped(self):
+        result = self.ingest([('a/one.txt', b'1'), ('../evil.txt', b'2'), ('x/ /y.txt', b'3')])
+        self.assertEqual(result['files'], 1)
+        self.assertEqual([skipped['reason'] for skipped in result['skipped']], ['unsafe path', 'unsafe path'])
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'target', 'a', 'one.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'evil.txt')))
+        self.assertTrue(FileIndexEntry.objects.filter(path='target/a/one.txt').exists())
+        self.assertEqual(FileActivity.objects.filter(user=self.user, activity_type='upload').count(), 1)
+
+    def test_oversized_file_is_skipped(self):
+        with self.settings(INGEST_MAX_FILE_SIZE=5):
+            result = self.ingest([('small.txt', b'12345'), ('big.txt', b'123456')])
+        self.assertEqual(result['files'], 1)
+        self.assertEqual(result['skipped'], [{'name': 'big.txt', 'reason': 'too large'}])
+
+    def test_file_count_limit(self):
+        with self.settings(INGEST_MAX_FILES=2):
+            with self.assertRaisesMessage(IngestError, 'more than 2 files'):
+                self.ingest([('1.txt', b'1'), ('2.txt', b'2'), ('3.txt', b'3')])
+        # A refused archive leaves nothing behind
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'target')))
+
+    def test_total_size_limit(self):
+        with self.settings(INGEST_MAX_TOTAL_SIZE=10):
+            with self.assertRaises(IngestError) as raised:
+                self.ingest([('1.txt', b'x' * 6), ('2.txt', b'y' * 6)])
+        self.assertEqual(raised.exception.status, 413)
+        self.assertIn('expands to more than 10 bytes', str(raised.exception))
+
+    def test_member_larger_than_its_header(self):
+        ingest = Ingest(self.user, 'target', '127.0.0.1')
+        with self.assertRaisesMessage(IngestError, 'larger than its archive header says'):
+            list(ingest.check_size(iter([b'123', b'456']), 'liar.txt', 4))
+        with self.settings(INGEST_MAX_TOTAL_SIZE=4):
+            with self.assertRaisesMessage(IngestError, 'expands to more than 4 bytes'):
+                list(ingest.check_size(iter([b'123', b'456']), 'honest.txt', 6))
+
+@override_settings(DEDUP_STORAGE_ENABLED=False)
+class UploadArchiveViewTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user('crew', password='pw')
+        FolderPermission.objects.create(user=user, folder_path='ship', permission='write')
+        self.client.force_login(user)
+
+    def post(self, folder_path, members):
+        return self.client.post(f'/upload/archive/?folder_path={folder_path}', make_tar(members).getvalue(), content_type='application/x-tar')
+
+    def test_archive_is_extracted_into_the_folder(self):
+        self.write('ship/logs/a.txt', b'old')
+        result = self.post('ship', [('logs/a.txt', b'new'), ('logs/b.txt', b'bb')]).json()
+        self.assertEqual((result['uploaded_files'], result['total_size']), (2, 5))
+        self.assertEqual(read_file(self.path('ship/logs/a.txt')), b'old')
+        self.assertEqual(sorted(os.listdir(self.path('ship/logs'))), ['a.txt', 'a_1.txt', 'b.txt'])
+
+    def test_refused_requests(self):
+        self.assertEqual(self.post('other', [('a.txt', b'a')]).status_code, 403)
+        self.assertEqual(self.post('ship/..', [('a.txt', b'a')]).status_code, 403)
+        response = self.client.post('/upload/archive/?folder_path=ship', b'not an archive', content_type='application/x-tar')
+        self.assertEqual(response.status_code, 400)
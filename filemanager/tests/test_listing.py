@@ -0,0 +1,72 @@
+import os
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase
+from ..listing import decode_cursor, encode_cursor, list_directory
+from ..models import FolderPermission
+from .helpers import StorageTestCase, make_temp_dir, write_file
+
+class ListingCursorTests(SimpleTestCase):
+    def setUp(self):
+        self.root = make_temp_dir(self)
+        for name in ('f1', 'f2', 'f3'):
+            os.makedirs(os.path.join(self.root, name))
+        for i in range(7):
+            write_file(os.path.join(self.root, f'file{i}.txt'), b'x' * (i * 10))
+
+    def pages(self, sort, order, limit=3):
+        names = []
+        cursor = None
+        while True:
+            listing = list_directory(self.root, '', sort, order, cursor=cursor, limit=limit)
+            names.extend(item['name'] for item in listing['items'])
+            cursor = listing['next_cursor']
+            if cursor is None:
+                return names, listing
+
+    def test_pages_cover_every_item_once(self):
+        names, listing = self.pages('name', 'asc')
+        self.assertEqual(names, ['f1', 'f2', 'f3'] + [f'file{i}.txt' for i in range(7)])
+        self.assertEqual(listing['file_count'], 7)
+        self.assertEqual(listing['folder_count'], 3)
+
+    def test_descending_size(self):
+        names, listing = self.pages('size', 'desc', limit=4)
+        files = [name for name in names if name.startswith('file')]
+        self.assertEqual(files, [f'file{i}.txt' for i in reversed(range(7))])
+        self.assertEqual(len(names), 10)
+
+    def test_cursor_for_another_sort_restarts(self):
+        first = list_directory(self.root, '', 'size', 'asc', limit=4)
+        self.assertIsNone(decode_cursor(first['next_cursor'], 'name'))
+        restarted = list_directory(self.root, '', 'name', 'asc', cursor=first['next_cursor'], limit=4)
+        self.assertEqual(restarted['items'][0]['name'], 'f1')
+
+    def test_malformed_cursors_are_ignored(self):
+        for cursor in ('garbage', '', 'e30=', encode_cursor({'type': 'file', 'name': 'a', 'size_bytes': 1, 'modified': 0}, 'size')[:-4]):
+            self.assertEqual(list_directory(self.root, '', 'name', cursor=cursor, limit=2)['items'][0]['name'], 'f1')
+
+class ListFolderViewTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(5):
+            self.write(f'ship/file{i}.txt', b'x' * i)
+        os.makedirs(self.path('ship/logs'))
+        user = User.objects.create_user('crew', password='pw')
+        FolderPermission.objects.create(user=user, folder_path='ship', permission='read')
+        self.client.force_login(user)
+
+    def test_pages_follow_the_cursor(self):
+        listing = self.client.get('/api/list/', {'path': 'ship', 'limit': 4}).json()
+        self.assertEqual([item['name'] for item in listing['items']], ['logs', 'file0.txt', 'file1.txt', 'file2.txt'])
+        listing = self.client.get('/api/list/', {'path': 'ship', 'limit': 4, 'cursor': listing['next_cursor']}).json()
+        self.assertEqual([item['name'] for item in listing['items']], ['file3.txt', 'file4.txt'])
+        self.assertIsNone(listing['next_cursor'])
+
+    def test_unchanged_listing_is_not_modified(self):
+        response = self.client.get('/api/list/', {'path': 'ship'})
+        response = self.client.get('/api/list/', {'path': 'ship'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_permission_and_missing_folder(self):
+        self.assertEqual(self.client.get('/api/list/', {'path': 'other'}).status_code, 403)
+        self.assertEqual(self.client.get('/api/list/', {'path': 'ship/missing'}).status_code, 404)
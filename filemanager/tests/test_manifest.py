@@ -0,0 +1,128 @@
+import os
+import json
+import zlib
+import hashlib
+from django.contrib.auth.models import User
+from django.test import override_settings
+from ..dedup import link_into_tree, write_hashed
+from ..indexing import refresh_file_index
+from ..manifest import build_manifest, fill_digests, prune_snapshots, snapshot_prefix
+from ..models import FileIndexEntry, FolderPermission
+from .helpers import StorageTestCase, response_body, write_file
+
+@override_settings(MANIFEST_REFRESH_INDEX=True, MANIFEST_DIGEST_BUDGET=None)
+class ManifestTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('vessel', password='pw')
+        FolderPermission.objects.create(user=self.user, folder_path='ship', permission='read')
+        write_file(os.path.join(self.root, 'ship', 'a.txt'), b'alpha')
+        write_file(os.path.join(self.root, 'ship', 'logs', 'b.txt'), b'bravo')
+        write_file(os.path.join(self.root, 'other', 'c.txt'), b'charlie')
+
+    def test_full_listing_without_cursor(self):
+        header, changes = build_manifest(self.user, 'ship')
+        self.assertTrue(header['full'])
+        self.assertEqual(header['files'], 2)
+        self.assertEqual([change[0] for change in changes], ['ship/a.txt', 'ship/logs/b.txt'])
+        self.assertEqual(changes[0][3], hashlib.sha256(b'alpha').hexdigest())
+
+    def test_unreadable_folders_are_left_out(self):
+        header, changes = build_manifest(self.user, '')
+        self.assertNotIn('other/c.txt', [change[0] for change in changes])
+
+    def test_cursor_returns_only_differences(self):
+        header, changes = build_manifest(self.user, 'ship')
+        write_file(os.path.join(self.root, 'ship', 'new.txt'), b'new')
+        os.remove(os.path.join(self.root, 'ship', 'logs', 'b.txt'))
+
+        header2, changes2 = build_manifest(self.user, 'ship', header['cursor'])
+        self.assertFalse(header2['full'])
+        self.assertEqual(header2['since'], header['cursor'])
+        self.assertNotEqual(header2['cursor'], header['cursor'])
+        self.assertEqual(changes2, [
+            ['ship/logs/b.txt', None, None, None],
+            ['ship/new.txt', 3, changes2[1][2], hashlib.sha256(b'new').hexdigest()],
+        ])
+
+    def test_unchanged_folder_keeps_its_cursor(self):
+        header, changes = build_manifest(self.user, 'ship')
+        header2, changes2 = build_manifest(self.user, 'ship', header['cursor'])
+        self.assertEqual(changes2, [])
+        self.assertEqual(header2['cursor'], header['cursor'])
+
+    def test_unknown_cursor_gets_the_full_listing(self):
+        for cursor in ('0' * 32, '../../etc/passwd'):
+            header, changes = build_manifest(self.user, 'ship', cursor)
+            self.assertTrue(header['full'])
+            self.assertIsNone(header['since'])
+            self.assertEqual(len(changes), 2)
+
+class FillDigestsTests(StorageTestCase):
+    def digests(self):
+        return dict(FileIndexEntry.objects.values_list('path', 'digest'))
+
+    def test_budget_limits_the_bytes_hashed(self):
+        self.write('ship/small.txt', b'x' * 10)
+        self.write('ship/big.txt', b'x' * 100)
+        refresh_file_index()
+        self.assertEqual(fill_digests('ship', budget=50), 1)
+        self.assertEqual(self.digests()['ship/big.txt'], '')
+        self.assertEqual(fill_digests('ship'), 0)
+        self.assertEqual(self.digests()['ship/big.txt'], hashlib.sha256(b'x' * 100).hexdigest())
+
+    @override_settings(DEDUP_STORAGE_ENABLED=True)
+    def test_content_store_digest_only_for_an_unchanged_file(self):
+        for name, data in (('kept.txt', b'kept'), ('edited.txt', b'edit')):
+            tmp_path, digest, size = write_hashed([data])
+            link_into_tree(tmp_path, digest, size, self.path('ship'), name, 'ship')
+        # Rewritten in place to the same size, so only the mtime tells
+        edited = self.path('ship/edited.txt')
+        os.chmod(edited, 0o644)
+        with open(edited, 'wb') as f:
+            f.write(b'EDIT')
+        st = os.stat(edited)
+        os.utime(edited, (st.st_atime, st.st_mtime + 10))
+        refresh_file_index()
+
+        # Nothing may be hashed, so only the stored digest can be used
+        self.assertEqual(fill_digests('ship', budget=0), 1)
+        self.assertEqual(self.digests(), {'ship/kept.txt': hashlib.sha256(b'kept').hexdigest(), 'ship/edited.txt': ''})
+
+class ManifestViewTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write('ship/a.txt', b'alpha' * 100)
+        user = User.objects.create_user('vessel', password='pw')
+        FolderPermission.objects.create(user=user, folder_path='ship', permission='read')
+        self.client.force_login(user)
+
+    def lines(self, response):
+        body = response_body(response)
+        if response.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 31)
+        return [json.loads(line) for line in body.decode('utf-8').splitlines()]
+
+    def test_stream_ends_with_a_marker(self):
+        lines = self.lines(self.client.get('/api/manifest/', {'path': 'ship'}, HTTP_ACCEPT_ENCODING='identity'))
+        self.assertTrue(lines[0]['full'])
+        self.assertEqual([line['path'] for line in lines[1:-1]], ['ship/a.txt'])
+        self.assertEqual(lines[-1], {'end': True, 'changes': 1, 'deleted': 0})
+
+        os.remove(self.path('ship/a.txt'))
+        lines = self.lines(self.client.get('/api/manifest/', {'path': 'ship', 'cursor': lines[0]['cursor']}, HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertEqual(lines[1:], [{'path': 'ship/a.txt', 'deleted': True}, {'end': True, 'changes': 1, 'deleted': 1}])
+
+    def test_refused_requests(self):
+        self.assertEqual(self.client.get('/api/manifest/', {'path': 'other'}).status_code, 403)
+        self.assertEqual(self.client.get('/api/manifest/', {'path': 'ship/..'}).status_code, 403)
+        self.assertEqual(self.client.get('/api/manifest/', {'path': 'ship/missing'}).status_code, 404)
+
+    @override_settings(MANIFEST_SNAPSHOTS_KEPT=2)
+    def test_old_snapshots_are_pruned(self):
+        user = User.objects.get(username='vessel')
+        for i in range(4):
+            self.write(f'ship/{i}.txt', b'x')
+            build_manifest(user, 'ship')
+        prefix = snapshot_prefix(user, 'ship')
+        self.assertEqual(len([name for name in os.listdir(self.scratch + '/manifests') if name.startswith(prefix)]), 2)
@@ -0,0 +1,75 @@
+import json
+import time
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, override_settings
+from ..metrics import Histogram, Registry, escape_label, render_metrics
+from ..models import FolderPermission
+from .helpers import StorageTestCase, read_file, response_body
+
+def sample_line(text, prefix):
+    """Value of the first exposition line starting with prefix"""
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+class HistogramTests(SimpleTestCase):
+    def test_buckets_are_cumulative(self):
+        hist = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            hist.observe(value)
+        self.assertEqual(list(hist.cumulative()), [(0.1, 2), (1.0, 3), ('+Inf', 4)])
+        self.assertEqual((hist.count, hist.sum), (4, 3.65))
+
+    def test_labels_are_escaped(self):
+        self.assertEqual(escape_label('a"b\\c\nd'), 'a\\"b\\\\c\\nd')
+
+@override_settings(METRICS_SLOW_REQUEST_SECONDS=0)
+class MetricsMiddlewareTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('filemanager.metrics.registry', Registry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.write('ship/a.txt', b'x' * 3000)
+        self.user = User.objects.create_user('crew', password='pw')
+        FolderPermission.objects.create(user=self.user, folder_path='ship', permission='read')
+        self.client.force_login(self.user)
+
+    def test_requests_are_counted_per_view(self):
+        response = self.client.get('/download/ship/a.txt/', HTTP_ACCEPT_ENCODING='identity')
+        response_body(response)
+        self.client.get('/download/ship/missing.txt/')
+        self.client.get('/api/list/', {'path': 'ship'})
+
+        text = render_metrics()
+        self.assertEqual(sample_line(text, 'portal_requests_total{view="download_file",method="GET",status="200"}'), 1)
+        self.assertEqual(sample_line(text, 'portal_requests_total{view="download_file",method="GET",status="404"}'), 1)
+        self.assertEqual(sample_line(text, 'portal_request_duration_seconds_count{view="list_folder",method="GET"}'), 1)
+        self.assertEqual(sample_line(text, 'portal_response_bytes_total{view="download_file"}'), 3000 + len(b'{"error": "File not found"}'))
+        self.assertGreater(sample_line(text, 'portal_request_queries_sum{view="list_folder",method="GET"}'), 0)
+        self.assertGreater(sample_line(text, 'portal_fs_calls_total{view="list_folder",method="GET"}'), 0)
+        self.assertEqual(sample_line(text, 'portal_requests_in_progress'), 0)
+
+    def test_endpoint_needs_staff_or_the_token(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        with override_settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.client.logout()
+            response = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer s3cret')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'# TYPE portal_requests_total counter', response.content)
+        self.client.force_login(User.objects.create_user('staff', password='pw', is_staff=True))
+        self.assertEqual(self.client.get('/metrics/').status_code, 200)
+
+    @override_settings(METRICS_SLOW_REQUEST_SECONDS=0.001, METRICS_PROFILE_SAMPLE_RATE=1.0)
+    def test_slow_profiled_requests_are_logged(self):
+        with mock.patch('filemanager.views.list_directory', side_effect=lambda *args, **kwargs: time.sleep(0.05) or {
+            'items': [], 'next_cursor': None, 'total_size': 0, 'file_count': 0, 'folder_count': 0,
+        }):
+            self.client.get('/api/list/', {'path': 'ship'})
+        entry = json.loads(read_file(self.scratch + '/slow_requests.jsonl').decode('utf-8').splitlines()[-1])
+        self.assertEqual((entry['view'], entry['status']), ('list_folder', 200))
+        self.assertGreater(entry['samples'], 0)
+        self.assertTrue(entry['stacks'])
@@ -0,0 +1,107 @@
+import os
+import json
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase
+from ..models import FolderPermission
+from ..permissions import PermissionTrie, get_permission_trie, split_path
+from ..utils import has_permission, resolve_path
+from .helpers import StorageTestCase
+
+class PermissionTrieTests(SimpleTestCase):
+    def setUp(self):
+        self.trie = PermissionTrie([
+            {'folder_path': 'vessels', 'permission': 'read'},
+            {'folder_path': 'vessels/alpha', 'permission': 'write'},
+            {'folder_path': 'vessels/alpha/secret', 'permission': 'read'},
+        ])
+
+    def test_longest_prefix_wins(self):
+        self.assertEqual(self.trie.resolve('vessels/beta/logs'), 'read')
+        self.assertEqual(self.trie.resolve('vessels/alpha/logs'), 'write')
+        self.assertEqual(self.trie.resolve('vessels/alpha/secret/x'), 'read')
+        self.assertIsNone(self.trie.resolve('other'))
+
+    def test_segments_are_not_string_prefixes(self):
+        self.assertIsNone(self.trie.resolve('vesselsX'))
+        self.assertEqual(self.trie.resolve('vessels/alphabet'), 'read')
+
+    def test_allows_compares_levels(self):
+        self.assertTrue(self.trie.allows('vessels/alpha', 'read'))
+        self.assertTrue(self.trie.allows('vessels/alpha', 'write'))
+        self.assertFalse(self.trie.allows('vessels/alpha', 'admin'))
+        # A deeper grant narrows access as well as widening it
+        self.assertFalse(self.trie.allows('vessels/alpha/secret', 'write'))
+        self.assertFalse(self.trie.allows('other', 'read'))
+
+    def test_dot_dot_is_refused(self):
+        self.assertEqual(split_path('/a/./b\\c/'), ['a', 'b', 'c'])
+        self.assertIsNone(split_path('a/../b'))
+        self.assertIsNone(self.trie.resolve('vessels/beta/../alpha'))
+        self.assertFalse(self.trie.allows('vessels/alpha/..', 'read'))
+
+    def test_grants_with_dot_dot_are_ignored(self):
+        trie = PermissionTrie([{'folder_path': 'vessels/../other', 'permission': 'admin'}])
+        self.assertIsNone(trie.resolve('other'))
+        self.assertIsNone(trie.resolve('vessels'))
+
+class ResolvePathTests(StorageTestCase):
+    def test_paths_below_the_root(self):
+        self.assertEqual(resolve_path('/ship//logs/./a.txt'), ('ship/logs/a.txt', os.path.join(self.root, 'ship', 'logs', 'a.txt')))
+        self.assertEqual(resolve_path(''), ('', os.path.abspath(self.root)))
+
+    def test_dot_dot_is_refused(self):
+        for path in ('..', 'ship/../../etc/passwd', 'ship/../ship/a.txt', 'ship\\..\\..\\x'):
+            self.assertEqual(resolve_path(path), (None, None), path)
+
+class PermissionCacheTests(StorageTestCase):
+    def test_trie_follows_permission_changes(self):
+        user = User.objects.create_user('crew', password='pw')
+        self.assertFalse(has_permission(User.objects.get(pk=user.pk), 'ship', 'read'))
+        permission = FolderPermission.objects.create(user=user, folder_path='ship', permission='write')
+        self.assertTrue(has_permission(User.objects.get(pk=user.pk), 'ship/logs', 'write'))
+        permission.delete()
+        self.assertFalse(has_permission(User.objects.get(pk=user.pk), 'ship/logs', 'read'))
+
+    def test_trie_is_memoized_per_request_user(self):
+        user = User.objects.create_user('crew', password='pw')
+        FolderPermission.objects.create(user=user, folder_path='ship', permission='read')
+        trie = get_permission_trie(user)
+        with self.assertNumQueries(0):
+            self.assertIs(get_permission_trie(user), trie)
+
+    def test_superuser_reads_everything(self):
+        admin = User.objects.create_superuser('admin', password='pw')
+        self.assertTrue(has_permission(admin, 'any/folder', 'admin'))
+
+class PathTraversalViewTests(StorageTestCase):
+    """The folder checked for permission must be the folder that is opened"""
+
+    def setUp(self):
+        super().setUp()
+        self.write('ship/a.txt', b'mine')
+        self.write('secret/b.txt', b'not mine')
+        self.user = User.objects.create_user('crew', password='pw')
+        FolderPermission.objects.create(user=self.user, folder_path='ship', permission='admin')
+        self.client.force_login(self.user)
+
+    def test_download_and_preview(self):
+        self.assertEqual(self.client.get('/download/ship/a.txt/').status_code, 200)
+        for path in ('ship/../secret/b.txt', 'ship/x/../../secret/b.txt'):
+            self.assertEqual(self.client.get(f'/download/{path}/').status_code, 403, path)
+            self.assertEqual(self.client.get(f'/preview/{path}/').status_code, 403, path)
+            self.assertEqual(self.client.get(f'/delta/signature/{path}/').status_code, 403, path)
+
+    def test_listing_and_archive(self):
+        self.assertEqual(self.client.get('/api/list/', {'path': 'ship/..'}).status_code, 403)
+        self.assertEqual(self.client.get('/download-zip/', {'path': 'ship/../secret'}).status_code, 403)
+
+    def test_delete_and_create_folder(self):
+        response = self.client.post('/delete/', json.dumps({'path': 'ship/x/..'}), content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(os.path.isdir(self.path('ship')))
+        response = self.client.post('/create-folder/', json.dumps({'folder_path': 'ship', 'folder_name': '../escaped'}), content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(os.path.exists(self.path('escaped')))
+        response = self.client.post('/create-folder/', json.dumps({'folder_path': 'ship', 'folder_name': 'logs'}), content_type='application/json')
+        self.assertEqual(response.json(), {'success': True})
+        self.assertTrue(os.path.isdir(self.path('ship/logs')))
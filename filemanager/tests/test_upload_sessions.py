@@ -0,0 +1,100 @@
+import os
+import json
+from django.contrib.auth.models import User
+from django.test import override_settings
+from ..models import FileActivity, FileIndexEntry, FolderPermission, UploadSession
+from ..uploads import staging_path
+from .helpers import StorageTestCase, read_file
+
+@override_settings(UPLOAD_CHUNK_SIZE=1000, DEDUP_STORAGE_ENABLED=False)
+class UploadSessionTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('crew', password='pw')
+        FolderPermission.objects.create(user=self.user, folder_path='ship', permission='write')
+        self.client.force_login(self.user)
+        self.data = os.urandom(2500)
+
+    def start(self, folder_path='ship/logs', filename='track.bin', total_size=None):
+        body = {'folder_path': folder_path, 'filename': filename, 'total_size': len(self.data) if total_size is None else total_size}
+        return self.client.post('/upload/sessions/', json.dumps(body), content_type='application/json')
+
+    def put_chunk(self, session_id, index, data=None):
+        if data is None:
+            data = self.data[index * 1000:(index + 1) * 1000]
+        return self.client.put(f'/upload/sessions/{session_id}/chunks/{index}/', data, content_type='application/octet-stream')
+
+    def complete(self, session_id):
+        return self.client.post(f'/upload/sessions/{session_id}/complete/')
+
+    def test_chunks_in_any_order_are_assembled(self):
+        status = self.start().json()
+        self.assertEqual((status['total_chunks'], status['chunk_size']), (3, 1000))
+        session_id = status['session_id']
+
+        status = self.put_chunk(session_id, 2).json()
+        self.assertEqual((status['received_chunks'], status['received_offset'], status['uploaded_size']), ([2], 0, 500))
+        status = self.put_chunk(session_id, 0).json()
+        self.assertEqual((status['received_chunks'], status['received_offset']), ([0, 2], 1000))
+
+        # Missing chunks are reported rather than producing a truncated file
+        response = self.complete(session_id)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['received_chunks'], [0, 2])
+
+        self.put_chunk(session_id, 1)
+        result = self.complete(session_id).json()
+        self.assertEqual(result['path'], 'ship/logs/track.bin')
+        self.assertEqual(read_file(self.path('ship/logs/track.bin')), self.data)
+        self.assertFalse(os.path.exists(staging_path(session_id)))
+        self.assertTrue(FileIndexEntry.objects.filter(path='ship/logs/track.bin').exists())
+        self.assertEqual(FileActivity.objects.filter(activity_type='upload').count(), 1)
+
+        # A retried completion gets the same answer and does not upload twice
+        self.assertEqual(self.complete(session_id).json(), result)
+        self.assertEqual(FileActivity.objects.filter(activity_type='upload').count(), 1)
+
+    def test_resume_after_reload(self):
+        session_id = self.start().json()['session_id']
+        self.put_chunk(session_id, 0)
+        self.put_chunk(session_id, 1)
+        status = self.client.get(f'/upload/sessions/{session_id}/').json()
+        self.assertEqual((status['received_chunks'], status['received_offset'], status['status']), ([0, 1], 2000, 'uploading'))
+
+        # A chunk sent again is acknowledged without being rewritten
+        status = self.put_chunk(session_id, 1, b'y' * 1000).json()
+        self.assertEqual(status['received_chunks'], [0, 1])
+        self.put_chunk(session_id, 2)
+        self.complete(session_id)
+        self.assertEqual(read_file(self.path('ship/logs/track.bin')), self.data)
+
+    def test_existing_names_are_not_overwritten(self):
+        self.write('ship/logs/track.bin', b'old')
+        session_id = self.start().json()['session_id']
+        for index in range(3):
+            self.put_chunk(session_id, index)
+        self.assertEqual(self.complete(session_id).json()['name'], 'track_1.bin')
+        self.assertEqual(read_file(self.path('ship/logs/track.bin')), b'old')
+
+    def test_bad_chunks_are_refused(self):
+        session_id = self.start().json()['session_id']
+        self.assertEqual(self.put_chunk(session_id, 3, b'x').status_code, 400)
+        self.assertEqual(self.put_chunk(session_id, 0, b'short').status_code, 400)
+        self.assertFalse(UploadSession.objects.get(session_id=session_id).chunks.exists())
+
+    def test_cancelled_session_takes_no_more_chunks(self):
+        session_id = self.start().json()['session_id']
+        self.put_chunk(session_id, 0)
+        self.client.delete(f'/upload/sessions/{session_id}/')
+        self.assertFalse(os.path.exists(staging_path(session_id)))
+        self.assertEqual(self.put_chunk(session_id, 1).status_code, 409)
+        self.assertEqual(self.complete(session_id).status_code, 409)
+
+    def test_sessions_need_write_permission_and_belong_to_their_user(self):
+        self.assertEqual(self.start(folder_path='other').status_code, 403)
+        self.assertEqual(self.start(total_size=-1).status_code, 400)
+
+        session_id = self.start().json()['session_id']
+        self.client.force_login(User.objects.create_user('stranger', password='pw'))
+        self.assertEqual(self.put_chunk(session_id, 0).status_code, 404)
+        self.assertEqual(self.client.get(f'/upload/sessions/{session_id}/').status_code, 404)
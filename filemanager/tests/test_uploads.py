@@ -0,0 +1,99 @@
+import os
+import time
+import hashlib
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from ..dedup import blob_path
+from ..models import ContentBlob, FileActivity, FileIndexEntry, FolderPermission
+from ..uploads import HashingUploadHandler, UPLOAD_TEMP_SUFFIX, cleanup_upload_temps, upload_temp_dir
+from .helpers import StorageTestCase, make_temp_dir, read_file
+
+class HashingUploadHandlerTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = make_temp_dir(self)
+        overrides = override_settings(UPLOAD_STAGING_ROOT=self.dir, DEDUP_STORAGE_ENABLED=False)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def receive(self, chunks):
+        handler = HashingUploadHandler()
+        handler.new_file('files', 'log.txt', 'text/plain', None)
+        start = 0
+        for chunk in chunks:
+            handler.receive_data_chunk(chunk, start)
+            start += len(chunk)
+        return handler.file_complete(start)
+
+    def test_file_is_hashed_while_written(self):
+        uploaded = self.receive([b'abc', b'def'])
+        self.assertEqual((uploaded.size, uploaded.sha256), (6, hashlib.sha256(b'abcdef').hexdigest()))
+        self.assertEqual(uploaded.read(), b'abcdef')
+
+        path, digest, size = uploaded.claim()
+        self.assertEqual((digest, size), (uploaded.sha256, 6))
+        uploaded.close()
+        self.assertEqual(read_file(path), b'abcdef')
+
+    def test_unclaimed_file_is_deleted_on_close(self):
+        uploaded = self.receive([b'abc'])
+        self.assertTrue(os.path.exists(uploaded.temporary_file_path()))
+        uploaded.close()
+        self.assertFalse(os.path.exists(uploaded.temporary_file_path()))
+
+    def test_cleanup_removes_only_old_temp_files(self):
+        old = self.receive([b'old']).claim()[0]
+        new = self.receive([b'new']).claim()[0]
+        other = os.path.join(self.dir, 'session.part')
+        open(other, 'wb').close()
+        os.utime(old, (time.time() - 7200, time.time() - 7200))
+        os.utime(other, (time.time() - 7200, time.time() - 7200))
+        self.assertEqual(cleanup_upload_temps(3600), 1)
+        self.assertEqual(sorted(os.listdir(self.dir)), sorted([os.path.basename(new), 'session.part']))
+
+class UploadViewTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('crew', password='pw')
+        FolderPermission.objects.create(user=self.user, folder_path='ship', permission='write')
+        self.client.force_login(self.user)
+
+    def upload(self, folder_path, *files):
+        return self.client.post('/upload/', {'folder_path': folder_path, 'files': list(files)})
+
+    def temp_files(self):
+        try:
+            return [name for name in os.listdir(upload_temp_dir()) if name.endswith(UPLOAD_TEMP_SUFFIX)]
+        except FileNotFoundError:
+            return []
+
+    def test_files_are_moved_into_place(self):
+        result = self.upload('ship/logs', SimpleUploadedFile('a.txt', b'first'), SimpleUploadedFile('a.txt', b'second')).json()
+        self.assertEqual([item['name'] for item in result['uploaded_files']], ['a.txt', 'a_1.txt'])
+        self.assertEqual(result['total_size'], 11)
+        self.assertEqual(read_file(self.path('ship/logs/a_1.txt')), b'second')
+        self.assertEqual(self.temp_files(), [])
+        self.assertEqual(FileIndexEntry.objects.filter(path__startswith='ship/logs/').count(), 2)
+        self.assertEqual(FileActivity.objects.filter(activity_type='upload').count(), 2)
+
+    async def test_upload_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post('/upload/', {'folder_path': 'ship', 'files': [SimpleUploadedFile('a.txt', b'first')]})
+        self.assertEqual(response.json()['uploaded_files'][0]['name'], 'a.txt')
+        self.assertEqual(read_file(self.path('ship/a.txt')), b'first')
+        self.assertEqual(await FileActivity.objects.filter(activity_type='upload').acount(), 1)
+
+    @override_settings(DEDUP_STORAGE_ENABLED=True)
+    def test_dedup_uses_the_digest_from_the_handler(self):
+        data = os.urandom(5000)
+        self.upload('ship', SimpleUploadedFile('track.bin', data))
+        digest = hashlib.sha256(data).hexdigest()
+        self.assertEqual(list(ContentBlob.objects.values_list('digest', flat=True)), [digest])
+        self.assertTrue(os.path.samefile(blob_path(digest), self.path('ship/track.bin')))
+        self.assertEqual(self.temp_files(), [])
+
+    def test_refused_upload_leaves_no_temp_file(self):
+        response = self.upload('other', SimpleUploadedFile('a.txt', b'x'))
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(os.path.exists(self.path('other')))
+        self.assertEqual(self.temp_files(), [])
@@ -0,0 +1,102 @@
+import os
+import select
+import shutil
+import unittest
+from django.test import SimpleTestCase
+from ..folderstats import reconcile_folder_stats
+from ..indexing import refresh_file_index
+from ..models import FileIndexEntry, FolderStats
+from ..watcher import ChangeJournal, Watcher, apply_changes, load_libc
+from .helpers import StorageTestCase
+
+class ChangeJournalTests(SimpleTestCase):
+    def test_bursts_are_coalesced_until_quiet(self):
+        journal = ChangeJournal(debounce=2, max_delay=30)
+        journal.add('ship/a.txt', now=0)
+        journal.add('ship/a.txt', now=1.5)
+        journal.add('ship/b.txt', now=1)
+        self.assertEqual(len(journal), 2)
+        self.assertEqual(journal.next_deadline(), 3)
+        self.assertEqual(journal.pop_due(now=3.4), [('ship/b.txt', False)])
+        self.assertEqual(journal.pop_due(now=3.5), [('ship/a.txt', False)])
+        self.assertIsNone(journal.next_deadline())
+
+    def test_a_file_that_never_settles_is_released_after_max_delay(self):
+        journal = ChangeJournal(debounce=2, max_delay=5)
+        for now in range(0, 6):
+            journal.add('ship/growing.log', now=now)
+        self.assertEqual(journal.pop_due(now=5), [('ship/growing.log', False)])
+
+    def test_folder_changes_cover_everything_below_them(self):
+        journal = ChangeJournal(debounce=0, max_delay=0)
+        journal.add('ship/logs/a.txt', now=0)
+        journal.add('ship/logs', folder=True, now=0)
+        journal.add('ship/logs/old', folder=True, now=0)
+        journal.add('ship/logsheet.txt', now=0)
+        journal.add('ship/logs', now=0)
+        self.assertEqual(journal.pop_due(now=0), [('ship/logs', True), ('ship/logsheet.txt', False)])
+
+class ApplyChangesTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write('ship/a.txt', b'x' * 10)
+        self.write('ship/logs/b.txt', b'x' * 5)
+        refresh_file_index()
+        reconcile_folder_stats()
+
+    def totals(self, path):
+        row = FolderStats.objects.get(path=path)
+        return row.total_size, row.file_count
+
+    def test_file_changes(self):
+        self.write('ship/c.txt', b'x' * 3)
+        self.write('ship/a.txt', b'x' * 4)
+        os.remove(self.path('ship/logs/b.txt'))
+        self.assertEqual(apply_changes([('ship/c.txt', False), ('ship/a.txt', False), ('ship/logs/b.txt', False)]), (3, 0))
+        self.assertEqual(dict(FileIndexEntry.objects.values_list('path', 'size')), {'ship/a.txt': 4, 'ship/c.txt': 3})
+        self.assertEqual(self.totals('ship'), (7, 2))
+        self.assertEqual(self.totals(''), (7, 2))
+
+    def test_folder_changes(self):
+        self.write('ship/new/d.txt', b'x' * 6)
+        self.write('Ship/e.txt', b'x')
+        refresh_file_index('Ship')
+        reconcile_folder_stats('Ship')
+        shutil.rmtree(self.path('ship/logs'))
+        shutil.rmtree(self.path('Ship'))
+        self.assertEqual(apply_changes([('ship/new', True), ('ship/logs', True), ('Ship', True)]), (0, 3))
+        self.assertEqual(sorted(FileIndexEntry.objects.values_list('path', flat=True)), ['ship/a.txt', 'ship/new/d.txt'])
+        self.assertEqual(self.totals('ship/new'), (6, 1))
+        self.assertEqual(self.totals('ship'), (16, 2))
+        self.assertFalse(FolderStats.objects.filter(path__in=['ship/logs', 'Ship']).exists())
+
+@unittest.skipIf(load_libc() is None, 'inotify is not available')
+class InotifyWatcherTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        os.makedirs(self.path('ship'))
+        self.watcher = Watcher()
+        self.addCleanup(self.watcher.inotify.close)
+        self.watcher.watch_tree('')
+
+    def read_events(self):
+        poller = select.poll()
+        poller.register(self.watcher.inotify.fileno(), select.POLLIN)
+        while poller.poll(200):
+            for wd, mask, name in self.watcher.inotify.read_events():
+                self.watcher.handle_event(wd, mask, name)
+        return sorted(self.watcher.journal.pop_due(now=float('inf')))
+
+    def test_events_become_journal_entries(self):
+        self.assertEqual(sorted(self.watcher.watches), ['', 'ship'])
+        self.write('ship/a.txt', b'a')
+        os.makedirs(self.path('ship/new'))
+        self.assertEqual(self.read_events(), [('ship/a.txt', False), ('ship/new', True)])
+
+        # New folders are watched straight away
+        self.write('ship/new/b.txt', b'b')
+        self.assertEqual(self.read_events(), [('ship/new/b.txt', False)])
+
+        shutil.rmtree(self.path('ship/new'))
+        self.assertEqual(self.read_events(), [('ship/new', True)])
+        self.assertNotIn('ship/new', self.watcher.watches)
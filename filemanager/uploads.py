@@ -0,0 +1,160 @@
+import os
+import time
+import uuid
+import shutil
+import hashlib
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+UPLOAD_TEMP_SUFFIX = '.upload'
+
+def staging_path(session_id):
+    return os.path.join(settings.UPLOAD_STAGING_ROOT, f'{session_id}.part')
+
+def create_staging_file(session_id, total_size):
+    """Create the (sparse) staging file that chunks are written into"""
+    os.makedirs(settings.UPLOAD_STAGING_ROOT, exist_ok=True)
+    path = staging_path(session_id)
+    with open(path, 'wb') as f:
+        f.truncate(total_size)
+    return path
+
+def write_chunk(path, offset, stream, expected_size, progress=None):
+    """Copy expected_size bytes from stream into the staging file at offset.
+
+    Returns the number of bytes written; the caller rejects the chunk when
+    it does not match expected_size. progress, if given, is called with
+    the size of each block as it is written.
+    """
+    written = 0
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        while written < expected_size:
+            data = stream.read(min(STREAM_CHUNK_SIZE, expected_size - written))
+            if not data:
+                break
+            f.write(data)
+            written += len(data)
+            if progress is not None:
+                progress(len(data))
+        # Anything beyond the expected size means the client sent a bad chunk
+        if stream.read(1):
+            return written + 1
+    return written
+
+def unique_destination(dest_dir, filename):
+    """Return (filename, path) that does not clash with an existing file"""
+    file_path = os.path.join(dest_dir, filename)
+    counter = 1
+    name, ext = os.path.splitext(filename)
+    while os.path.exists(file_path):
+        filename = f"{name}_{counter}{ext}"
+        file_path = os.path.join(dest_dir, filename)
+        counter += 1
+    return filename, file_path
+
+def move_into_place(src_path, dest_dir, filename):
+    """Move a finished upload into dest_dir, renaming on collision.
+
+    Returns the filename that was actually used.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    filename, file_path = unique_destination(dest_dir, filename)
+    try:
+        os.replace(src_path, file_path)
+    except OSError:
+        # Staging area on a different volume
+        shutil.move(src_path, file_path)
+    return filename
+
+def discard_staging_file(session_id):
+    try:
+        os.remove(staging_path(session_id))
+    except FileNotFoundError:
+        pass
+
+def upload_temp_dir():
+    """Where form uploads are streamed to: next to the blobs with dedup on, else the staging area"""
+    if settings.DEDUP_STORAGE_ENABLED:
+        return os.path.join(settings.CONTENT_STORE_ROOT, 'tmp')
+    return str(settings.UPLOAD_STAGING_ROOT)
+
+class HashedUploadedFile(UploadedFile):
+    """A form upload already written to disk, with its SHA-256 computed on the way in.
+
+    The view takes the file over with claim(). Closing a file that was
+    never claimed deletes it.
+    """
+
+    def __init__(self, path, name, content_type, charset, content_type_extra=None):
+        super().__init__(open(path, 'w+b'), name, content_type, 0, charset, content_type_extra)
+        self.path = path
+        self.hasher = hashlib.sha256()
+        self.sha256 = None
+        self.claimed = False
+
+    def temporary_file_path(self):
+        return self.path
+
+    def claim(self):
+        """Close the file and hand it over: returns (path, sha256 hex digest, size)"""
+        self.file.close()
+        self.claimed = True
+        return self.path, self.sha256, self.size
+
+    def close(self):
+        self.file.close()
+        if not self.claimed:
+            discard_upload_temp(self.path)
+
+class HashingUploadHandler(FileUploadHandler):
+    """Streams each uploaded file straight to disk on the storage volume, hashing it as it arrives"""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        temp_dir = upload_temp_dir()
+        os.makedirs(temp_dir, exist_ok=True)
+        path = os.path.join(temp_dir, uuid.uuid4().hex + UPLOAD_TEMP_SUFFIX)
+        self.file = HashedUploadedFile(path, self.file_name, self.content_type, self.charset, self.content_type_extra)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file.hasher.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.flush()
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.sha256 = self.file.hasher.hexdigest()
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
+
+def discard_upload_temp(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def cleanup_upload_temps(max_age):
+    """Delete form-upload temp files older than max_age seconds. Returns the number removed."""
+    removed = 0
+    cutoff = time.time() - max_age
+    for temp_dir in {upload_temp_dir(), str(settings.UPLOAD_STAGING_ROOT)}:
+        try:
+            entries = list(os.scandir(temp_dir))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            try:
+                if entry.name.endswith(UPLOAD_TEMP_SUFFIX) and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+    return removed
@@ -9,14 +9,25 @@ urlpatterns = [
     path('dashboard/', views.dashboard, name='dashboard'),
     path('browser/', views.file_browser, name='file_browser'),
     path('browser/<path:folder_path>/', views.file_browser, name='file_browser'),
+    path('api/list/', views.list_folder, name='list_folder'),
+    path('api/manifest/', views.folder_manifest, name='folder_manifest'),
     path('download/<path:file_path>/', views.download_file, name='download_file'),
+    path('download-zip/', views.download_archive, name='download_archive'),
+    path('delta/signature/<path:file_path>/', views.delta_signature, name='delta_signature'),
+    path('delta/blocks/<path:file_path>/', views.delta_blocks, name='delta_blocks'),
     path('preview/<path:file_path>/', views.file_preview, name='file_preview'),
+    path('thumbnail/<path:file_path>/', views.image_preview, name='image_preview'),
     path('upload/', views.upload_file, name='upload_file'),
+    path('upload/archive/', views.upload_archive, name='upload_archive'),
     path('upload/progress/<str:session_id>/', views.get_upload_progress, name='upload_progress'),
+    path('upload/sessions/', views.create_upload_session, name='create_upload_session'),
+    path('upload/sessions/<str:session_id>/', views.upload_session_detail, name='upload_session_detail'),
+    path('upload/sessions/<str:session_id>/chunks/<int:index>/', views.upload_chunk, name='upload_chunk'),
+    path('upload/sessions/<str:session_id>/complete/', views.complete_upload_session, name='complete_upload_session'),
+    path('upload/sessions/<str:session_id>/events/', views.upload_session_events, name='upload_session_events'),
     path('delete/', views.delete_file, name='delete_file'),
     path('search/', views.search_files, name='search_files'),
+    path('search/content/', views.search_file_contents, name='search_contents'),
     path('create-folder/', views.create_folder, name='create_folder'),
-    # Admin folder browser
-    path('admin/folder-browser/', views.admin_folder_browser, name='admin_folder_browser'),
-    path('admin/get-folders/', views.admin_get_folder_tree, name='admin_get_folders'),
+    path('metrics/', views.prometheus_metrics, name='metrics'),
 ]
\ No newline at end of file
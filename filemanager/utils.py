@@ -1,40 +1,44 @@
 import os
 from django.conf import settings
+from django.utils import timezone
 from .models import FolderPermission, FileActivity
+from .permissions import get_permission_trie, split_path
+from .activity import record_activity
+from .folderstats import get_folder_stats
+
+def resolve_path(path):
+    """Return (rel_path, full_path) for a path below FILE_STORAGE_ROOT, or (None, None).
+
+    Views check permissions on rel_path and open full_path, so both always
+    mean the same file. Paths with a '..' segment, and anything else that
+    would end up outside the storage root, are refused.
+    """
+    parts = split_path(path)
+    if parts is None:
+        return None, None
+    base_path = os.path.abspath(settings.FILE_STORAGE_ROOT)
+    full_path = os.path.join(base_path, *parts)
+    if full_path != base_path and not full_path.startswith(base_path + os.sep):
+        return None, None
+    return '/'.join(parts), full_path
 
 def get_user_permissions(user):
-    if user.is_superuser:
-        return [{'folder_path': '/', 'permission': 'admin'}]
-    
-    permissions = FolderPermission.objects.filter(user=user)
-    return [{'folder_path': perm.folder_path, 'permission': perm.permission} for perm in permissions]
+    return get_permission_trie(user).permissions
 
 def has_permission(user, folder_path, required_permission):
-    if user.is_superuser:
-        return True
-    
-    permissions = get_user_permissions(user)
-    
-    for perm in permissions:
-        if folder_path.startswith(perm['folder_path']) or perm['folder_path'] == '/':
-            if required_permission == 'read':
-                return perm['permission'] in ['read', 'write', 'admin']
-            elif required_permission == 'write':
-                return perm['permission'] in ['write', 'admin']
-            elif required_permission == 'admin':
-                return perm['permission'] == 'admin'
-    
-    return False
+    return get_permission_trie(user).allows(folder_path, required_permission)
 
 def log_activity(user, filename, filepath, activity_type, ip_address, file_size=None):
-    FileActivity.objects.create(
-        user=user,
-        filename=filename,
-        filepath=filepath,
-        activity_type=activity_type,
-        ip_address=ip_address,
-        file_size=file_size
-    )
+    # Queued and written in batches by the activity writer (see activity.py)
+    record_activity({
+        'user_id': user.pk,
+        'filename': filename,
+        'filepath': filepath,
+        'activity_type': activity_type,
+        'ip_address': ip_address,
+        'file_size': file_size,
+        'timestamp': timezone.now().isoformat(),
+    })
 
 def format_file_size(size_bytes):
     if size_bytes == 0:
@@ -49,9 +53,41 @@ def format_file_size(size_bytes):
     return f"{size_bytes:.2f} {size_names[i]}"
 
 def get_folder_size(folder_path):
+    # Use the maintained totals when the folder is tracked, walking only as a fallback
+    base_path = os.path.abspath(settings.FILE_STORAGE_ROOT)
+    rel_path = os.path.relpath(os.path.abspath(folder_path), base_path)
+    if not rel_path.startswith('..'):
+        stats = get_folder_stats('' if rel_path == '.' else rel_path)
+        if stats is not None:
+            return stats.total_size
+    
     total_size = 0
     for dirpath, dirnames, filenames in os.walk(folder_path):
         for filename in filenames:
             filepath = os.path.join(dirpath, filename)
             total_size += os.path.getsize(filepath)
-    return total_size
\ No newline at end of file
+    return total_size
+
+def get_file_icon(extension):
+    icon_map = {
+        '.pdf': '📕',
+        '.doc': '📘',
+        '.docx': '📘',
+        '.xls': '📗',
+        '.xlsx': '📗',
+        '.ppt': '📙',
+        '.pptx': '📙',
+        '.txt': '📄',
+        '.zip': '📦',
+        '.rar': '📦',
+        '.jpg': '🖼️',
+        '.jpeg': '🖼️',
+        '.png': '🖼️',
+        '.gif': '🖼️',
+        '.mp4': '🎬',
+        '.avi': '🎬',
+        '.mov': '🎬',
+        '.mp3': '🎵',
+        '.wav': '🎵',
+    }
+    return icon_map.get(extension, '📄')
\ No newline at end of file
@@ -1,21 +1,44 @@
 import os
 import json
 import uuid
-from django.shortcuts import render, redirect, get_object_or_404
+import sqlite3
+from datetime import datetime, timezone as dt_timezone
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth import login, authenticate, update_session_auth_hash
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse
 from django.conf import settings
 from django.utils.text import get_valid_filename
+from django.utils.http import content_disposition_header, http_date
+from django.utils.cache import patch_vary_headers
+from django.utils.crypto import constant_time_compare
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 from django.views.decorators.csrf import csrf_exempt
 from django.db.models import Q
-from .models import FolderPermission, UserProfile, FileActivity, UploadSession
-from .utils import get_user_permissions, has_permission, log_activity, format_file_size
+from .aio import run_io
+from .models import FolderPermission, UserProfile, FileActivity, UploadSession, UploadChunk, FolderStats
+from .utils import get_user_permissions, has_permission, log_activity, format_file_size, get_file_icon, resolve_path
+from .indexing import index_file, remove_from_index, search_index, index_is_built
+from .contentindex import content_index_is_built, queue_content_update, search_contents
+from .downloads import serve_file, serve_encoded_file, is_initial_transfer, file_etag, encoded_etag, conditional_response, set_cache_validators
+from .compression import accepted_encodings, choose_encoding, compress_chunks, is_compressible
+from .delta import blocks_length, get_signature, iter_blocks
+from .archives import collect_archive_entries, iter_zip
+from .dedup import hash_file, link_into_tree, release_path, remove_file, write_hashed
+from .metrics import render_metrics
+from .listing import list_directory, listing_validators
+from .ingest import IngestError, ingest_archive
+from .manifest import build_manifest, iter_manifest_lines
+from .folderstats import child_folder_stats, record_file_added, record_file_removed, record_folder_created, record_folder_removed
+from .previews import PREVIEW_FORMATS, get_preview, is_previewable
+from .progress import ChunkProgress, aiter_progress_events, flush_progress, get_progress, set_progress_status, should_flush
+from .uploads import HashedUploadedFile, create_staging_file, discard_staging_file, move_into_place, staging_path, unique_destination, write_chunk
 import mimetypes
-from wsgiref.util import FileWrapper
 import urllib.parse
+from PIL import Image
 
 from django.contrib.auth import login as auth_login
 
@@ -66,15 +89,22 @@ def dashboard(request):
     user_permissions = get_user_permissions(request.user)
     
     # Get accessible folders
+    folder_stats = {
+        row.path: row
+        for row in FolderStats.objects.filter(path__in=[perm['folder_path'].strip('/') for perm in user_permissions])
+    }
     accessible_folders = []
     for perm in user_permissions:
         folder_path = perm['folder_path']
         full_path = os.path.join(base_path, folder_path.lstrip('/'))
         if os.path.exists(full_path):
+            stats = folder_stats.get(folder_path.strip('/'))
             accessible_folders.append({
                 'name': os.path.basename(folder_path),
                 'path': folder_path,
-                'permission': perm['permission']
+                'permission': perm['permission'],
+                'size': format_file_size(stats.total_size) if stats else None,
+                'file_count': stats.file_count if stats else None
             })
     
     # Get recent activities
@@ -89,57 +119,35 @@ def dashboard(request):
 
 @login_required
 def file_browser(request, folder_path=''):
-    if not has_permission(request.user, folder_path, 'read'):
+    folder_path, full_path = resolve_path(folder_path)
+    if folder_path is None or not has_permission(request.user, folder_path, 'read'):
         messages.error(request, 'You do not have permission to access this folder')
         return redirect('dashboard')
     
-    base_path = settings.FILE_STORAGE_ROOT
-    full_path = os.path.join(base_path, folder_path.lstrip('/'))
-    
     if not os.path.exists(full_path):
         os.makedirs(full_path, exist_ok=True)
     
-    # Get files and folders
-    items = []
-    total_size = 0
-    file_count = 0
-    folder_count = 0
+    sort = request.GET.get('sort', 'name')
+    order = request.GET.get('order', 'asc')
+    view_mode = 'grid' if request.GET.get('view') == 'grid' else 'list'
     
+    # Pending messages are only shown once, so that page must not be revalidated
+    validators = None
+    if not len(messages.get_messages(request)):
+        validators = listing_validators(request, full_path, folder_path)
+        response = conditional_response(request, *validators)
+        if response is not None:
+            return response
+    
+    listing = {'items': [], 'next_cursor': None, 'sort': sort, 'order': order, 'total_size': 0, 'file_count': 0, 'folder_count': 0}
     try:
-        for item in os.listdir(full_path):
-            item_path = os.path.join(full_path, item)
-            rel_path = os.path.join(folder_path, item).replace('\\', '/')
-            
-            if os.path.isdir(item_path):
-                items.append({
-                    'name': item,
-                    'type': 'folder',
-                    'path': rel_path,
-                    'size': '-',
-                    'size_bytes': 0,
-                    'modified': os.path.getmtime(item_path),
-                    'icon': '📁'
-                })
-                folder_count += 1
-            else:
-                size = os.path.getsize(item_path)
-                items.append({
-                    'name': item,
-                    'type': 'file',
-                    'path': rel_path,
-                    'size': format_file_size(size),
-                    'size_bytes': size,
-                    'modified': os.path.getmtime(item_path),
-                    'extension': os.path.splitext(item)[1].lower(),
-                    'icon': get_file_icon(os.path.splitext(item)[1].lower())
-                })
-                total_size += size
-                file_count += 1
+        listing = list_directory(full_path, folder_path, sort, order, limit=settings.LISTING_PAGE_SIZE, folder_stats=child_folder_stats(folder_path))
     except Exception as e:
         messages.error(request, f'Error accessing folder: {str(e)}')
     
-    # Sort: folders first, then files
-    items.sort(key=lambda x: (x['type'] != 'folder', x['name'].lower()))
+    items = listing['items']
+    for item in items:
+        item['modified_at'] = datetime.fromtimestamp(item['modified'], tz=dt_timezone.utc)
     
     # Breadcrumb
     breadcrumbs = []
@@ -157,123 +165,304 @@ def file_browser(request, folder_path=''):
         'can_upload': has_permission(request.user, folder_path, 'write'),
         'can_delete': has_permission(request.user, folder_path, 'admin'),
         'can_create_folder': has_permission(request.user, folder_path, 'write'),
-        'total_size': format_file_size(total_size),
-        'file_count': file_count,
-        'folder_count': folder_count,
-    }
-    return render(request, 'filemanager/file_browser.html', context)
-
-def get_file_icon(extension):
-    icon_map = {
-        '.pdf': '📕',
-        '.doc': '📘',
-        '.docx': '📘',
-        '.xls': '📗',
-        '.xlsx': '📗',
-        '.ppt': '📙',
-        '.pptx': '📙',
-        '.txt': '📄',
-        '.zip': '📦',
-        '.rar': '📦',
-        '.jpg': '🖼️',
-        '.jpeg': '🖼️',
-        '.png': '🖼️',
-        '.gif': '🖼️',
-        '.mp4': '🎬',
-        '.avi': '🎬',
-        '.mov': '🎬',
-        '.mp3': '🎵',
-        '.wav': '🎵',
+        'total_size': format_file_size(listing['total_size']),
+        'file_count': listing['file_count'],
+        'folder_count': listing['folder_count'],
+        'next_cursor': listing['next_cursor'],
+        'sort': listing['sort'],
+        'order': listing['order'],
+        'view_mode': view_mode,
+        # Live upload progress is only streamed when no thread waits on it
+        'progress_events': isinstance(request, ASGIRequest),
     }
-    return icon_map.get(extension, '📄')
+    response = render(request, 'filemanager/file_browser.html', context)
+    if validators:
+        set_cache_validators(response, *validators)
+    return response
 
 @login_required
-def download_file(request, file_path):
-    if not has_permission(request.user, os.path.dirname(file_path), 'read'):
+async def list_folder(request):
+    folder_path, full_path = resolve_path(request.GET.get('path', ''))
+    
+    user = await request.auser()
+    if folder_path is None or not await sync_to_async(has_permission)(user, folder_path, 'read'):
         return JsonResponse({'error': 'Permission denied'}, status=403)
     
-    base_path = settings.FILE_STORAGE_ROOT
-    full_path = os.path.join(base_path, file_path.lstrip('/'))
+    if not await run_io(os.path.isdir, full_path):
+        return JsonResponse({'error': 'Folder not found'}, status=404)
     
-    if os.path.exists(full_path) and os.path.isfile(full_path):
-        # Log download activity
-        log_activity(
-            request.user, 
-            os.path.basename(file_path), 
-            file_path, 
-            'download', 
-            request.META.get('REMOTE_ADDR'),
-            os.path.getsize(full_path)
+    validators = await sync_to_async(listing_validators)(request, full_path, folder_path)
+    response = conditional_response(request, *validators)
+    if response is not None:
+        return response
+    
+    try:
+        limit = min(int(request.GET.get('limit', settings.LISTING_PAGE_SIZE)), settings.LISTING_MAX_PAGE_SIZE)
+    except ValueError:
+        limit = settings.LISTING_PAGE_SIZE
+    
+    folder_stats = await sync_to_async(child_folder_stats)(folder_path)
+    try:
+        listing = await run_io(
+            list_directory,
+            full_path,
+            folder_path,
+            request.GET.get('sort', 'name'),
+            request.GET.get('order', 'asc'),
+            cursor=request.GET.get('cursor'),
+            limit=max(limit, 1),
+            folder_stats=folder_stats
         )
+    except OSError as e:
+        return JsonResponse({'error': str(e)}, status=500)
+    
+    listing['formatted_total_size'] = format_file_size(listing['total_size'])
+    response = JsonResponse(listing)
+    set_cache_validators(response, *validators)
+    return response
+
+@login_required
+async def download_file(request, file_path):
+    user = await request.auser()
+    file_path, full_path = resolve_path(file_path)
+    if file_path is None or not await sync_to_async(has_permission)(user, os.path.dirname(file_path), 'read'):
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    
+    if await run_io(os.path.isfile, full_path):
+        st = await run_io(os.stat, full_path)
+        encoding, sidecar = await run_io(choose_encoding, request, file_path, st)
+        etag = encoded_etag(file_etag(st), encoding)
+        response = conditional_response(request, etag, st.st_mtime)
+        if response is not None:
+            return response
+        
+        if encoding:
+            response = await run_io(serve_encoded_file, request, full_path, os.path.basename(file_path), encoding, sidecar, etag)
+        else:
+            response = await run_io(serve_file, request, full_path, os.path.basename(file_path))
+        if is_compressible(file_path):
+            patch_vary_headers(response, ['Accept-Encoding'])
+        
+        # Log download activity once per download, not per resumed segment
+        if is_initial_transfer(response):
+            await sync_to_async(log_activity)(
+                user, 
+                os.path.basename(file_path), 
+                file_path, 
+                'download', 
+                request.META.get('REMOTE_ADDR'),
+                st.st_size
+            )
         
-        wrapper = FileWrapper(open(full_path, 'rb'))
-        content_type, encoding = mimetypes.guess_type(full_path)
-        response = HttpResponse(wrapper, content_type=content_type)
-        response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_path)}"'
         return response
     
     return JsonResponse({'error': 'File not found'}, status=404)
 
+def resolve_readable_file(request, file_path):
+    """Return the full path of a file the user may read, or an error response"""
+    file_path, full_path = resolve_path(file_path)
+    if file_path is None or not has_permission(request.user, os.path.dirname(file_path), 'read'):
+        return None, JsonResponse({'error': 'Permission denied'}, status=403)
+    
+    if not os.path.isfile(full_path):
+        return None, JsonResponse({'error': 'File not found'}, status=404)
+    
+    return full_path, None
+
+def delta_block_size(value):
+    try:
+        block_size = int(value)
+    except (TypeError, ValueError):
+        return settings.DELTA_BLOCK_SIZE
+    return max(settings.DELTA_MIN_BLOCK_SIZE, min(block_size, settings.DELTA_MAX_BLOCK_SIZE))
+
+@login_required
+def delta_signature(request, file_path):
+    full_path, error = resolve_readable_file(request, file_path)
+    if error:
+        return error
+    
+    block_size = delta_block_size(request.GET.get('block_size'))
+    st = os.stat(full_path)
+    signature = get_signature(full_path, block_size, settings.DELTA_CACHE_ROOT)
+    signature['etag'] = file_etag(st)
+    
+    # A delta sync starts with the signature, so that is where the download is logged
+    log_activity(
+        request.user, 
+        os.path.basename(file_path), 
+        file_path, 
+        'download', 
+        request.META.get('REMOTE_ADDR'),
+        st.st_size
+    )
+    
+    response = JsonResponse(signature)
+    response['ETag'] = signature['etag']
+    return response
+
+@login_required
+def delta_blocks(request, file_path):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    
+    full_path, error = resolve_readable_file(request, file_path)
+    if error:
+        return error
+    
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return JsonResponse({'error': 'Expected a JSON object'}, status=400)
+    
+    st = os.stat(full_path)
+    
+    # Blocks only fit together if they come from the version the signature described
+    if data.get('etag') != file_etag(st):
+        return JsonResponse({'error': 'File changed, fetch a new signature'}, status=412)
+    
+    block_size = delta_block_size(data.get('block_size'))
+    block_count = (st.st_size + block_size - 1) // block_size
+    try:
+        indices = sorted({int(index) for index in data.get('indices', [])})
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'indices must be block numbers'}, status=400)
+    
+    if len(indices) > settings.DELTA_MAX_BLOCKS_PER_REQUEST:
+        return JsonResponse({'error': f'At most {settings.DELTA_MAX_BLOCKS_PER_REQUEST} blocks per request'}, status=400)
+    if indices and (indices[0] < 0 or indices[-1] >= block_count):
+        return JsonResponse({'error': 'Block index out of range'}, status=400)
+    
+    response = StreamingHttpResponse(iter_blocks(full_path, block_size, indices), content_type='application/octet-stream')
+    response['Content-Length'] = str(blocks_length(st.st_size, block_size, indices))
+    return response
+
+@login_required
+def folder_manifest(request):
+    """Files below ?path= with size, mtime and digest; with ?cursor= only what changed since"""
+    folder_path, full_path = resolve_path(request.GET.get('path', ''))
+    if folder_path is None or not has_permission(request.user, folder_path, 'read'):
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    
+    if not os.path.isdir(full_path):
+        return JsonResponse({'error': 'Folder not found'}, status=404)
+    
+    header, changes = build_manifest(request.user, folder_path, request.GET.get('cursor'))
+    lines = iter_manifest_lines(header, changes)
+    
+    encodings = accepted_encodings(request.headers.get('Accept-Encoding')) if settings.COMPRESSION_ENABLED else []
+    if encodings:
+        response = StreamingHttpResponse(compress_chunks(lines, encodings[0]), content_type='application/x-ndjson')
+        response['Content-Encoding'] = encodings[0]
+    else:
+        response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+    patch_vary_headers(response, ['Accept-Encoding'])
+    response['Cache-Control'] = 'no-store'
+    return response
+
+@login_required
+def download_archive(request):
+    paths = [path for path in request.GET.getlist('path') if path.strip('/')]
+    
+    if not paths:
+        return JsonResponse({'error': 'No files selected'}, status=400)
+    
+    entries = collect_archive_entries(request.user, paths)
+    if entries is None:
+        return JsonResponse({'error': 'Permission denied or file not found'}, status=403)
+    
+    if len(paths) == 1:
+        archive_name = f"{os.path.basename(paths[0].strip('/'))}.zip"
+    else:
+        archive_name = 'download.zip'
+    
+    # One activity record for the whole archive
+    log_activity(
+        request.user,
+        archive_name,
+        ', '.join(paths)[:1000],
+        'download',
+        request.META.get('REMOTE_ADDR'),
+        sum(size for full_path, arcname, size in entries)
+    )
+    
+    response = StreamingHttpResponse(iter_zip(entries), content_type='application/zip')
+    response['Content-Disposition'] = content_disposition_header(True, archive_name)
+    return response
+
+
+def store_uploaded_file(file, full_path, folder_path):
+    """Put one form upload into full_path. Returns (filename, size)."""
+    filename = get_valid_filename(file.name)
+    
+    if isinstance(file, HashedUploadedFile):
+        # Streamed to disk and hashed by the upload handler; only a rename is left
+        tmp_path, digest, file_size = file.claim()
+        if settings.DEDUP_STORAGE_ENABLED:
+            filename = link_into_tree(tmp_path, digest, file_size, full_path, filename, folder_path)
+        else:
+            filename = move_into_place(tmp_path, full_path, filename)
+    elif settings.DEDUP_STORAGE_ENABLED:
+        # Hash while writing, then keep one copy per digest
+        tmp_path, digest, file_size = write_hashed(file.chunks())
+        filename = link_into_tree(tmp_path, digest, file_size, full_path, filename, folder_path)
+    else:
+        # Check if file already exists
+        filename, file_path = unique_destination(full_path, filename)
+        
+        # Save file
+        with open(file_path, 'wb+') as destination:
+            for chunk in file.chunks():
+                destination.write(chunk)
+        
+        file_size = os.path.getsize(file_path)
+    return filename, file_size
+
+def record_upload(user, relative_path, file_size, ip_address):
+    index_file(relative_path)
+    queue_content_update(relative_path)
+    record_file_added(relative_path)
+    log_activity(
+        user, 
+        os.path.basename(relative_path), 
+        relative_path, 
+        'upload', 
+        ip_address,
+        file_size
+    )
 
 @login_required
 @csrf_exempt
-def upload_file(request):
+async def upload_file(request):
     if request.method == 'POST':
-        folder_path = request.POST.get('folder_path', '')
+        # Parsing the form runs the upload handlers, which write every file to disk
+        files = await run_io(lambda: request.FILES.getlist('files'))
+        folder_path, full_path = resolve_path(request.POST.get('folder_path', ''))
         
-        if not has_permission(request.user, folder_path, 'write'):
+        user = await request.auser()
+        if folder_path is None or not await sync_to_async(has_permission)(user, folder_path, 'write'):
             return JsonResponse({'error': 'Permission denied'}, status=403)
         
-        base_path = settings.FILE_STORAGE_ROOT
-        # Normalize path for Windows
-        if folder_path.startswith('/'):
-            folder_path = folder_path[1:]
-        full_path = os.path.join(base_path, folder_path)
-        
-        print(f"DEBUG: Base path: {base_path}")
-        print(f"DEBUG: Folder path: {folder_path}") 
-        print(f"DEBUG: Full path: {full_path}")
-        
         # Ensure directory exists
-        os.makedirs(full_path, exist_ok=True)
+        await run_io(os.makedirs, full_path, exist_ok=True)
         
-        files = request.FILES.getlist('files')
         uploaded_files = []
         total_size = 0
         
         for file in files:
             try:
-                filename = get_valid_filename(file.name)
-                file_path = os.path.join(full_path, filename)
-                
-                print(f"DEBUG: Saving file: {file_path}")
-                
-                # Check if file already exists
-                counter = 1
-                name, ext = os.path.splitext(filename)
-                while os.path.exists(file_path):
-                    filename = f"{name}_{counter}{ext}"
-                    file_path = os.path.join(full_path, filename)
-                    counter += 1
-                
-                # Save file
-                with open(file_path, 'wb+') as destination:
-                    for chunk in file.chunks():
-                        destination.write(chunk)
-                
-                file_size = os.path.getsize(file_path)
+                if settings.DEDUP_STORAGE_ENABLED:
+                    # link_into_tree records the blob reference in the database
+                    filename, file_size = await sync_to_async(store_uploaded_file)(file, full_path, folder_path)
+                else:
+                    filename, file_size = await run_io(store_uploaded_file, file, full_path, folder_path)
                 total_size += file_size
                 
                 # Log upload activity
                 relative_path = os.path.join(folder_path, filename).replace('\\', '/')
-                log_activity(
-                    request.user, 
-                    filename, 
-                    relative_path, 
-                    'upload', 
-                    request.META.get('REMOTE_ADDR'),
-                    file_size
-                )
+                await sync_to_async(record_upload)(user, relative_path, file_size, request.META.get('REMOTE_ADDR'))
                 
                 uploaded_files.append({
                     'name': filename,
@@ -281,10 +470,7 @@ def upload_file(request):
                     'formatted_size': format_file_size(file_size)
                 })
                 
-                print(f"DEBUG: Successfully uploaded: {filename}")
-                
             except Exception as e:
-                print(f"DEBUG: Upload error: {str(e)}")
                 return JsonResponse({'error': f'Error uploading {file.name}: {str(e)}'}, status=500)
         
         return JsonResponse({
@@ -296,33 +482,263 @@ def upload_file(request):
     
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
+@login_required
+def upload_archive(request):
+    """Extract a tar or zip request body into ?folder_path=, for batches of many small files"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    folder_path, _ = resolve_path(request.GET.get('folder_path', ''))
+    if folder_path is None or not has_permission(request.user, folder_path, 'write'):
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = 0
+
+    try:
+        result = ingest_archive(request.user, folder_path, request, content_length, request.META.get('REMOTE_ADDR'))
+    except IngestError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    except OSError as e:
+        print(f"Archive upload error: {e}")
+        return JsonResponse({'error': f'Error extracting archive: {e}'}, status=500)
+
+    return JsonResponse({
+        'success': True,
+        'uploaded_files': result['files'],
+        'total_size': result['total_size'],
+        'formatted_total_size': format_file_size(result['total_size']),
+        'folders': result['folders'],
+        'renamed': result['renamed'],
+        'skipped': result['skipped'],
+    })
+
 @login_required
 def get_upload_progress(request, session_id):
     try:
         session = UploadSession.objects.get(session_id=session_id, user=request.user)
+        uploaded_size, status = get_progress(session)
         return JsonResponse({
             'total_files': session.total_files,
             'completed_files': session.completed_files,
             'total_size': session.total_size,
-            'uploaded_size': session.uploaded_size,
-            'status': session.status,
-            'progress': (session.completed_files / session.total_files * 100) if session.total_files > 0 else 0
+            'uploaded_size': uploaded_size,
+            'status': status,
+            'progress': upload_progress_percent(session, uploaded_size)
         })
     except UploadSession.DoesNotExist:
         return JsonResponse({'error': 'Session not found'}, status=404)
 
+def upload_progress_percent(session, uploaded_size):
+    if session.total_size > 0:
+        return min(uploaded_size / session.total_size * 100, 100)
+    return (session.completed_files / session.total_files * 100) if session.total_files > 0 else 0
+
+@login_required
+def upload_session_events(request, session_id):
+    """Server-sent events with the live progress, throughput and ETA of an upload session"""
+    session = get_object_or_404(UploadSession, session_id=session_id, user=request.user)
+    
+    # Under WSGI a stream would hold a server thread for as long as it is open,
+    # so clients poll get_upload_progress instead; 204 stops EventSource reconnecting
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    
+    response = StreamingHttpResponse(aiter_progress_events(session), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def upload_session_status(session):
+    chunks = list(session.chunks.order_by('index').values_list('index', 'size'))
+    received = [index for index, size in chunks]
+    # Exact even between the periodic writes of uploaded_size
+    uploaded_size = sum(size for index, size in chunks) if session.status == 'uploading' else session.uploaded_size
+    
+    # Offset up to which every byte has arrived, for clients resuming sequentially
+    contiguous = 0
+    while contiguous < len(received) and received[contiguous] == contiguous:
+        contiguous += 1
+    
+    return {
+        'session_id': session.session_id,
+        'filename': session.filename,
+        'folder_path': session.folder_path,
+        'chunk_size': session.chunk_size,
+        'total_chunks': session.total_chunks,
+        'total_size': session.total_size,
+        'uploaded_size': uploaded_size,
+        'received_chunks': received,
+        'received_offset': min(contiguous * session.chunk_size, session.total_size),
+        'status': session.status,
+    }
+
+@login_required
+def create_upload_session(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    
+    data = json.loads(request.body)
+    folder_path, _ = resolve_path(data.get('folder_path', ''))
+    filename = get_valid_filename(data.get('filename', ''))
+    
+    try:
+        total_size = int(data.get('total_size', -1))
+    except (TypeError, ValueError):
+        total_size = -1
+    
+    if not filename or total_size < 0:
+        return JsonResponse({'error': 'filename and total_size are required'}, status=400)
+    
+    if folder_path is None or not has_permission(request.user, folder_path, 'write'):
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    
+    session = UploadSession.objects.create(
+        user=request.user,
+        session_id=uuid.uuid4().hex,
+        folder_path=folder_path,
+        filename=filename,
+        chunk_size=settings.UPLOAD_CHUNK_SIZE,
+        total_files=1,
+        total_size=total_size,
+    )
+    create_staging_file(session.session_id, total_size)
+    
+    return JsonResponse(upload_session_status(session), status=201)
+
+@login_required
+def upload_session_detail(request, session_id):
+    session = get_object_or_404(UploadSession, session_id=session_id, user=request.user)
+    
+    if request.method == 'DELETE':
+        discard_staging_file(session.session_id)
+        session.chunks.all().delete()
+        session.status = 'cancelled'
+        session.save()
+        set_progress_status(session.session_id, 'cancelled')
+        return JsonResponse({'success': True})
+    
+    return JsonResponse(upload_session_status(session))
+
+@login_required
+async def upload_chunk(request, session_id, index):
+    if request.method != 'PUT':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    
+    user = await request.auser()
+    session = await aget_object_or_404(UploadSession, session_id=session_id, user=user)
+    
+    if session.status != 'uploading':
+        return JsonResponse({'error': f'Upload is {session.status}'}, status=409)
+    
+    if index < 0 or index >= session.total_chunks:
+        return JsonResponse({'error': 'Chunk index out of range'}, status=400)
+    
+    # A chunk that already arrived is acknowledged without rewriting it
+    if await session.chunks.filter(index=index).aexists():
+        return JsonResponse(await sync_to_async(upload_session_status)(session))
+    
+    expected = session.expected_chunk_size(index)
+    # Bytes are counted into the live progress store while they arrive
+    received, _ = await sync_to_async(get_progress)(session)
+    progress = ChunkProgress(session.session_id, received)
+    accepted = False
+    try:
+        written = await run_io(write_chunk, staging_path(session.session_id), index * session.chunk_size, request, expected, progress)
+        if written != expected:
+            return JsonResponse({'error': f'Expected {expected} bytes, received {written}'}, status=400)
+        accepted = await sync_to_async(record_chunk)(session, index, written)
+    except FileNotFoundError:
+        return JsonResponse({'error': 'Upload staging file is missing, restart the upload'}, status=410)
+    finally:
+        await run_io(progress.finish, accepted)
+    
+    await session.arefresh_from_db()
+    return JsonResponse(await sync_to_async(upload_session_status)(session))
+
+def record_chunk(session, index, written):
+    """Store a received chunk; False when a concurrent request stored it first"""
+    chunk, created = UploadChunk.objects.get_or_create(session=session, index=index, defaults={'size': written})
+    # The session total is only written now and then; live progress is in the cache
+    if created and should_flush(session.session_id):
+        flush_progress(session)
+    return created
+
+@login_required
+def complete_upload_session(request, session_id):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    
+    session = get_object_or_404(UploadSession, session_id=session_id, user=request.user)
+    
+    # Repeated completion (e.g. a retry after a lost response) reports the same result
+    if session.status == 'completed':
+        return JsonResponse(completed_upload_response(session))
+    
+    if session.status != 'uploading':
+        return JsonResponse({'error': f'Upload is {session.status}'}, status=409)
+    
+    if not has_permission(request.user, session.folder_path, 'write'):
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    
+    missing = session.total_chunks - session.chunks.count()
+    if missing:
+        return JsonResponse({'error': f'{missing} chunk(s) still missing', **upload_session_status(session)}, status=409)
+    
+    full_path = os.path.join(settings.FILE_STORAGE_ROOT, session.folder_path)
+    try:
+        if settings.DEDUP_STORAGE_ENABLED:
+            source = staging_path(session.session_id)
+            filename = link_into_tree(source, hash_file(source), session.total_size, full_path, session.filename, session.folder_path)
+        else:
+            filename = move_into_place(staging_path(session.session_id), full_path, session.filename)
+    except OSError as e:
+        return JsonResponse({'error': f'Error saving {session.filename}: {str(e)}'}, status=500)
+    
+    relative_path = os.path.join(session.folder_path, filename).replace('\\', '/')
+    index_file(relative_path)
+    queue_content_update(relative_path)
+    record_file_added(relative_path)
+    log_activity(
+        request.user, 
+        filename, 
+        relative_path, 
+        'upload', 
+        request.META.get('REMOTE_ADDR'),
+        session.total_size
+    )
+    
+    session.filename = filename
+    session.completed_files = 1
+    session.uploaded_size = session.total_size
+    session.status = 'completed'
+    session.save()
+    session.chunks.all().delete()
+    set_progress_status(session.session_id, 'completed', session.total_size)
+    
+    return JsonResponse(completed_upload_response(session))
+
+def completed_upload_response(session):
+    return {
+        'success': True,
+        'name': session.filename,
+        'path': os.path.join(session.folder_path, session.filename).replace('\\', '/'),
+        'size': session.total_size,
+        'formatted_size': format_file_size(session.total_size)
+    }
+
 @login_required
 def delete_file(request):
     if request.method == 'POST':
         data = json.loads(request.body)
-        item_path = data.get('path', '')
+        item_path, full_path = resolve_path(data.get('path', ''))
         
-        if not has_permission(request.user, os.path.dirname(item_path), 'admin'):
+        # The storage root itself is never deleted
+        if not item_path or not has_permission(request.user, os.path.dirname(item_path), 'admin'):
             return JsonResponse({'error': 'Permission denied'}, status=403)
         
-        base_path = settings.FILE_STORAGE_ROOT
-        full_path = os.path.join(base_path, item_path.lstrip('/'))
-        
         try:
             if os.path.exists(full_path):
                 if os.path.isdir(full_path):
@@ -330,9 +746,15 @@ def delete_file(request):
                     if len(os.listdir(full_path)) > 0:
                         return JsonResponse({'error': 'Folder is not empty'}, status=400)
                     os.rmdir(full_path)
+                    file_size = 0
+                    record_folder_removed(item_path)
                 else:
                     file_size = os.path.getsize(full_path)
-                    os.remove(full_path)
+                    remove_file(full_path)
+                    release_path(item_path)
+                    record_file_removed(item_path, file_size)
+                remove_from_index(item_path)
+                queue_content_update(item_path)
                 
                 # Log delete activity
                 log_activity(
@@ -341,7 +763,7 @@ def delete_file(request):
                     item_path, 
                     'delete', 
                     request.META.get('REMOTE_ADDR'),
-                    file_size if not os.path.isdir(full_path) else 0
+                    file_size
                 )
                 
                 return JsonResponse({'success': True})
@@ -353,18 +775,81 @@ def delete_file(request):
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
 @login_required
-def search_files(request):
+async def search_files(request):
     query = request.GET.get('q', '')
     file_type = request.GET.get('type', '')
     
     if not query:
         return JsonResponse({'results': []})
     
-    base_path = settings.FILE_STORAGE_ROOT
+    user = await request.auser()
+    user_permissions = await sync_to_async(get_user_permissions)(user)
+    
+    # Fall back to walking the tree until the index has been built
+    if not await sync_to_async(index_is_built)():
+        results = await run_io(walk_search, user_permissions, query, file_type)
+        return JsonResponse({'results': results, 'truncated': False})
+    
+    entries, truncated = await sync_to_async(search_index)(user_permissions, query, file_type)
     results = []
+    for entry in entries:
+        results.append({
+            'name': entry.name,
+            'path': entry.path,
+            'folder': entry.folder,
+            'size': entry.size,
+            'formatted_size': format_file_size(entry.size),
+            'extension': entry.extension,
+            'icon': get_file_icon(entry.extension),
+            'modified': entry.mtime
+        })
     
-    # Search in all accessible folders
-    user_permissions = get_user_permissions(request.user)
+    return JsonResponse({'results': results, 'truncated': truncated})
+
+@login_required
+async def search_file_contents(request):
+    """Full-text search inside documents, best matches first, with a highlighted snippet each"""
+    query = request.GET.get('q', '')
+    if not query.strip():
+        return JsonResponse({'results': []})
+    
+    user = await request.auser()
+    user_permissions = await sync_to_async(get_user_permissions)(user)
+    
+    if not await run_io(content_index_is_built):
+        return JsonResponse({'error': 'The content index has not been built yet'}, status=503)
+    
+    try:
+        matches, truncated = await run_io(search_contents, user_permissions, query)
+    except sqlite3.OperationalError as e:
+        return JsonResponse({'error': f'Invalid search: {e}'}, status=400)
+    
+    results = []
+    for match in matches:
+        name = os.path.basename(match['path'])
+        extension = os.path.splitext(name)[1].lower()
+        full_path = os.path.join(settings.FILE_STORAGE_ROOT, match['path'])
+        try:
+            modified = os.path.getmtime(full_path)
+        except OSError:
+            continue
+        results.append({
+            'name': name,
+            'path': match['path'],
+            'folder': os.path.dirname(match['path']),
+            'size': match['size'],
+            'formatted_size': format_file_size(match['size']),
+            'extension': extension,
+            'icon': get_file_icon(extension),
+            'modified': modified,
+            'snippet': match['snippet'],
+        })
+    
+    return JsonResponse({'results': results, 'truncated': truncated})
+
+def walk_search(user_permissions, query, file_type):
+    base_path = settings.FILE_STORAGE_ROOT
+    results = []
     
     for perm in user_permissions:
         if perm['permission'] in ['read', 'write', 'admin']:
@@ -384,34 +869,34 @@ def search_files(request):
                             if file_type and file_ext != f'.{file_type}':
                                 continue
                             
+                            file_size = os.path.getsize(file_path)
                             results.append({
                                 'name': file,
                                 'path': rel_path,
                                 'folder': os.path.dirname(rel_path),
-                                'size': os.path.getsize(file_path),
-                                'formatted_size': format_file_size(os.path.getsize(file_path)),
+                                'size': file_size,
+                                'formatted_size': format_file_size(file_size),
                                 'extension': file_ext,
                                 'icon': get_file_icon(file_ext),
                                 'modified': os.path.getmtime(file_path)
                             })
     
-    return JsonResponse({'results': results})
+    return results
 
 @login_required
 def create_folder(request):
     if request.method == 'POST':
         data = json.loads(request.body)
-        folder_path = data.get('folder_path', '')
-        folder_name = data.get('folder_name', '')
+        folder_path, _ = resolve_path(data.get('folder_path', ''))
+        new_path, full_path = resolve_path(f"{data.get('folder_path', '')}/{data.get('folder_name', '')}")
         
-        if not has_permission(request.user, folder_path, 'write'):
+        # An empty folder name would stand for the parent folder itself
+        if new_path is None or new_path == folder_path or not has_permission(request.user, folder_path, 'write'):
             return JsonResponse({'error': 'Permission denied'}, status=403)
         
-        base_path = settings.FILE_STORAGE_ROOT
-        full_path = os.path.join(base_path, folder_path.lstrip('/'), folder_name)
-        
         try:
             os.makedirs(full_path, exist_ok=True)
+            record_folder_created(new_path)
             return JsonResponse({'success': True})
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
@@ -420,13 +905,17 @@ def create_folder(request):
 
 @login_required
 def file_preview(request, file_path):
-    if not has_permission(request.user, os.path.dirname(file_path), 'read'):
+    file_path, full_path = resolve_path(file_path)
+    if file_path is None or not has_permission(request.user, os.path.dirname(file_path), 'read'):
         return JsonResponse({'error': 'Permission denied'}, status=403)
     
-    base_path = settings.FILE_STORAGE_ROOT
-    full_path = os.path.join(base_path, file_path.lstrip('/'))
-    
     if os.path.exists(full_path) and os.path.isfile(full_path):
+        st = os.stat(full_path)
+        etag = f'W/{file_etag(st)}'
+        response = conditional_response(request, etag, st.st_mtime)
+        if response is not None:
+            return response
+        
         # Log view activity
         log_activity(
             request.user, 
@@ -434,85 +923,67 @@ def file_preview(request, file_path):
             file_path, 
             'view', 
             request.META.get('REMOTE_ADDR'),
-            os.path.getsize(full_path)
+            st.st_size
         )
         
-        # For now, just return file info. You can extend this for actual previews
         file_info = {
             'name': os.path.basename(file_path),
             'path': file_path,
-            'size': os.path.getsize(full_path),
-            'formatted_size': format_file_size(os.path.getsize(full_path)),
-            'modified': os.path.getmtime(full_path),
-            'extension': os.path.splitext(file_path)[1].lower()
+            'size': st.st_size,
+            'formatted_size': format_file_size(st.st_size),
+            'modified': st.st_mtime,
+            'extension': os.path.splitext(file_path)[1].lower(),
+            'previewable': is_previewable(file_path)
         }
         
-        return JsonResponse({'file': file_info})
+        response = JsonResponse({'file': file_info})
+        set_cache_validators(response, etag, st.st_mtime)
+        return response
     
     return JsonResponse({'error': 'File not found'}, status=404)
 
-# Add these imports at the top
-import json
-from django.http import JsonResponse
-from django.contrib.admin.views.decorators import staff_member_required
-
-@staff_member_required
-def admin_folder_browser(request):
-    """Admin view to browse folders for permission assignment"""
-    base_path = settings.FILE_STORAGE_ROOT
-    folder_path = request.GET.get('path', '')
-    
-    full_path = os.path.join(base_path, folder_path)
-    
-    if not os.path.exists(full_path):
-        return JsonResponse({'error': 'Path does not exist'}, status=404)
+@login_required
+def image_preview(request, file_path):
+    """Serve a downscaled copy of an image instead of the original"""
+    full_path, error = resolve_readable_file(request, file_path)
+    if error:
+        return error
+    if not is_previewable(file_path):
+        return JsonResponse({'error': 'No preview available for this file type'}, status=415)
+    
+    size_name = request.GET.get('size', 'thumb')
+    if size_name not in ('thumb', 'medium'):
+        size_name = 'thumb'
+    fmt = request.GET.get('format')
+    if fmt not in PREVIEW_FORMATS:
+        fmt = 'webp' if 'image/webp' in request.META.get('HTTP_ACCEPT', '') else 'jpeg'
+    
+    # A preview changes exactly when its source file does
+    st = os.stat(full_path)
+    etag = f'{file_etag(st)[:-1]}-{size_name}-{fmt}"'
+    response = conditional_response(request, etag, st.st_mtime)
+    if response is not None:
+        return response
     
-    folders = []
     try:
-        for item in os.listdir(full_path):
-            item_path = os.path.join(full_path, item)
-            if os.path.isdir(item_path):
-                rel_path = os.path.join(folder_path, item).replace('\\', '/')
-                folders.append({
-                    'name': item,
-                    'path': rel_path,
-                    'has_children': any(os.path.isdir(os.path.join(item_path, subitem)) for subitem in os.listdir(item_path) if os.path.isdir(os.path.join(item_path, subitem)))
-                })
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
-    
-    # Sort folders alphabetically
-    folders.sort(key=lambda x: x['name'].lower())
-    
-    return JsonResponse({'folders': folders})
+        preview_path = get_preview(full_path, file_path.strip('/'), size_name, fmt)
+    except TimeoutError:
+        return JsonResponse({'error': 'Preview is still being generated, try again'}, status=503)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"Error generating preview for {file_path}: {e}")
+        return JsonResponse({'error': 'Could not generate preview'}, status=415)
+    
+    response = FileResponse(open(preview_path, 'rb'), content_type=PREVIEW_FORMATS[fmt][2])
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(st.st_mtime)
+    response['Cache-Control'] = 'private, max-age=86400'
+    response['Vary'] = 'Accept'
+    return response
 
-@staff_member_required
-def admin_get_folder_tree(request):
-    """Get complete folder tree for admin panel"""
-    base_path = settings.FILE_STORAGE_ROOT
-    
-    def build_tree(current_path):
-        tree = []
-        full_path = os.path.join(base_path, current_path.lstrip('/'))
-        
-        if not os.path.exists(full_path):
-            return tree
-            
-        try:
-            for item in os.listdir(full_path):
-                item_path = os.path.join(full_path, item)
-                if os.path.isdir(item_path):
-                    rel_path = os.path.join(current_path, item).replace('\\', '/')
-                    node = {
-                        'name': item,
-                        'path': rel_path,
-                        'children': build_tree(rel_path)
-                    }
-                    tree.append(node)
-        except Exception as e:
-            print(f"Error reading directory {full_path}: {e}")
-            
-        return tree
-    
-    tree = build_tree('')
-    return JsonResponse({'tree': tree})
\ No newline at end of file
+def prometheus_metrics(request):
+    """Per-view request metrics for staff, or for a scraper holding METRICS_TOKEN"""
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    if not (request.user.is_staff or (token and constant_time_compare(authorization, f'Bearer {token}'))):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
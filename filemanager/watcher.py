@@ -0,0 +1,349 @@
+"""Keeps the derived data of FILE_STORAGE_ROOT fresh as files change on disk.
+
+Files arrive through the portal but also from sync jobs and SMB copies the
+views never see. On Linux the tree is watched with inotify; events are
+coalesced per path in a ChangeJournal and applied once a path has been
+quiet for WATCHER_DEBOUNCE seconds, updating the filename index, folder
+stats and content index for just that path. A full scandir/mtime
+reconciliation runs every WATCHER_RECONCILE_INTERVAL seconds to catch
+anything the events missed, and every WATCHER_POLL_INTERVAL seconds when
+inotify is not available or runs out of watches.
+"""
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+from django.conf import settings
+from django.db import close_old_connections
+from .contentindex import refresh_content_index, update_document
+from .folderstats import apply_delta, parent_path, reconcile_folder_stats, record_file_added, record_file_removed, record_folder_created, record_folder_removed
+from .indexing import index_file, normalize_rel_path, refresh_file_index, remove_from_index
+from .models import FileIndexEntry
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+# Writes are seen when the file is closed rather than on every write();
+# IN_CREATE and IN_ATTRIB catch hardlinks and touched mtimes
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_ATTRIB | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+)
+
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+def load_libc():
+    """libc with the inotify calls, or None on platforms without them"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, 'inotify_init1'):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+class Inotify:
+    """Minimal ctypes wrapper around an inotify file descriptor"""
+
+    def __init__(self, libc):
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        # Fails harmlessly when the kernel already dropped the watch
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """Return every queued event as (wd, mask, name)"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+def is_below(rel_path, folder):
+    return folder == '' or rel_path.startswith(folder + '/')
+
+class ChangeJournal:
+    """Paths that changed, coalesced and held back until they have gone quiet.
+
+    A burst of events for one file (create, close, chmod) becomes a single
+    entry, released debounce seconds after the last of them, or max_delay
+    seconds after the first for a file that never stops changing. A folder
+    change covers every change below it.
+    """
+
+    def __init__(self, debounce, max_delay):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        # rel_path -> [first seen, last seen, whole folder]
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, rel_path, folder=False, now=None):
+        now = time.monotonic() if now is None else now
+        entry = self.entries.get(rel_path)
+        if entry is None:
+            self.entries[rel_path] = [now, now, folder]
+        else:
+            entry[1] = now
+            entry[2] = entry[2] or folder
+
+    def ready_at(self, entry):
+        return min(entry[1] + self.debounce, entry[0] + self.max_delay)
+
+    def next_deadline(self):
+        if not self.entries:
+            return None
+        return min(self.ready_at(entry) for entry in self.entries.values())
+
+    def pop_due(self, now=None):
+        """Remove and return the changes that are ready as (rel_path, folder), folders first"""
+        now = time.monotonic() if now is None else now
+        due = [
+            (rel_path, entry[2]) for rel_path, entry in self.entries.items()
+            if self.ready_at(entry) <= now
+        ]
+        for rel_path, folder in due:
+            del self.entries[rel_path]
+
+        folders = [rel_path for rel_path, folder in due if folder]
+        changes = [(rel_path, True) for rel_path in folders if not any(
+            other != rel_path and is_below(rel_path, other) for other in folders
+        )]
+        changes += [
+            (rel_path, False) for rel_path, folder in due
+            if not folder and not any(is_below(rel_path, other) for other in folders)
+        ]
+        return changes
+
+    def clear(self):
+        self.entries.clear()
+
+def apply_file_change(rel_path):
+    """Update the index, folder stats and content index for one file that changed on disk"""
+    full_path = os.path.join(settings.FILE_STORAGE_ROOT, rel_path)
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        st = None
+    if st is not None and os.path.isdir(full_path):
+        return apply_folder_change(rel_path)
+
+    # The indexed size is what the folder totals currently include
+    old_size = FileIndexEntry.objects.filter(path=rel_path).values_list('size', flat=True).first()
+    if st is None:
+        if old_size is not None:
+            remove_from_index(rel_path)
+            record_file_removed(rel_path, old_size)
+    else:
+        index_file(rel_path)
+        if old_size is None:
+            record_file_added(rel_path)
+        elif old_size != st.st_size:
+            apply_delta(parent_path(rel_path), st.st_size - old_size, 0, st.st_mtime)
+
+    if settings.CONTENT_INDEX_ENABLED:
+        update_document(rel_path)
+
+def apply_folder_change(rel_folder):
+    """Re-scan a folder that appeared, or drop everything below one that went away"""
+    if os.path.isdir(os.path.join(settings.FILE_STORAGE_ROOT, rel_folder)):
+        refresh_file_index(rel_folder)
+        # A stats row for a new folder lets the reconciler carry its totals up to the parents
+        record_folder_created(rel_folder)
+        reconcile_folder_stats(rel_folder)
+        if settings.CONTENT_INDEX_ENABLED:
+            refresh_content_index(rel_folder)
+    else:
+        remove_from_index(rel_folder)
+        record_folder_removed(rel_folder)
+        if settings.CONTENT_INDEX_ENABLED:
+            update_document(rel_folder)
+
+def apply_changes(changes):
+    """Apply a batch from ChangeJournal.pop_due(). Returns (files, folders) applied."""
+    files = folders = 0
+    for rel_path, folder in changes:
+        try:
+            if folder:
+                apply_folder_change(rel_path)
+                folders += 1
+            else:
+                apply_file_change(rel_path)
+                files += 1
+        except Exception as e:
+            print(f"Could not apply change to {rel_path or '/'}: {e}")
+    return files, folders
+
+class Watcher:
+    """Watches FILE_STORAGE_ROOT and feeds a ChangeJournal; run() loops forever"""
+
+    def __init__(self, use_inotify=True, report=print):
+        self.root = str(settings.FILE_STORAGE_ROOT)
+        self.journal = ChangeJournal(settings.WATCHER_DEBOUNCE, settings.WATCHER_MAX_DELAY)
+        self.report = report
+        self.inotify = None
+        # wd -> rel_dir and back
+        self.folders = {}
+        self.watches = {}
+        # False when some folders could not be watched
+        self.complete = False
+
+        libc = load_libc() if use_inotify else None
+        if libc is not None:
+            try:
+                self.inotify = Inotify(libc)
+            except OSError as e:
+                print(f"inotify is not available, polling instead: {e}")
+        elif use_inotify:
+            print("inotify is not available on this platform, polling instead")
+
+    def watch_tree(self, rel_dir):
+        """Watch rel_dir and every folder below it"""
+        stack = [rel_dir]
+        while stack:
+            rel_dir = stack.pop()
+            full_dir = os.path.join(self.root, rel_dir)
+            try:
+                wd = self.inotify.add_watch(full_dir, WATCH_MASK)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    print("Out of inotify watches (raise fs.inotify.max_user_watches); "
+                          f"polling every {settings.WATCHER_POLL_INTERVAL}s instead")
+                    self.complete = False
+                    return
+                # Removed again before we got to it
+                continue
+            self.folders[wd] = rel_dir
+            self.watches[rel_dir] = wd
+            try:
+                with os.scandir(full_dir) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(f"{rel_dir}/{entry.name}" if rel_dir else entry.name)
+            except OSError:
+                continue
+
+    def unwatch_tree(self, rel_dir):
+        for path in [path for path in self.watches if path == rel_dir or is_below(path, rel_dir)]:
+            wd = self.watches.pop(path)
+            if self.folders.get(wd) == path:
+                del self.folders[wd]
+                self.inotify.rm_watch(wd)
+
+    def handle_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            # Events were dropped; only a full rescan can tell what changed
+            print("inotify queue overflowed, rescanning everything")
+            self.journal.add('', folder=True)
+            return
+        rel_dir = self.folders.get(wd)
+        if rel_dir is None:
+            return
+        if mask & IN_IGNORED:
+            del self.folders[wd]
+            if self.watches.get(rel_dir) == wd:
+                del self.watches[rel_dir]
+            return
+        if not name:
+            return
+
+        rel_path = f"{rel_dir}/{name}" if rel_dir else name
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # Files may already be inside before the watch is in place, so the folder is rescanned
+                self.watch_tree(rel_path)
+                self.journal.add(rel_path, folder=True)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.unwatch_tree(rel_path)
+                self.journal.add(rel_path, folder=True)
+        else:
+            self.journal.add(rel_path)
+
+    def reconcile_interval(self):
+        if self.inotify is not None and self.complete:
+            return settings.WATCHER_RECONCILE_INTERVAL
+        return settings.WATCHER_POLL_INTERVAL
+
+    def apply(self, changes):
+        close_old_connections()
+        started = time.monotonic()
+        files, folders = apply_changes(changes)
+        self.report(f"Applied {files} file and {folders} folder changes in {time.monotonic() - started:.2f}s")
+
+    def run(self):
+        if self.inotify is not None:
+            self.complete = True
+            self.watch_tree('')
+            self.report(f"Watching {len(self.watches)} folders below {self.root}")
+            poller = select.poll()
+            poller.register(self.inotify.fileno(), select.POLLIN)
+
+        # Watches are in place first, so nothing changed during the scan is missed
+        self.apply([('', True)])
+        next_reconcile = time.monotonic() + self.reconcile_interval()
+
+        while True:
+            deadline = self.journal.next_deadline()
+            wait = max(0, min(next_reconcile, deadline if deadline is not None else next_reconcile) - time.monotonic())
+            if self.inotify is not None:
+                if poller.poll(wait * 1000):
+                    for wd, mask, name in self.inotify.read_events():
+                        self.handle_event(wd, mask, name)
+            else:
+                time.sleep(wait)
+
+            now = time.monotonic()
+            if now >= next_reconcile:
+                # The full scan covers whatever was still pending
+                self.journal.clear()
+                self.apply([('', True)])
+                next_reconcile = time.monotonic() + self.reconcile_interval()
+                continue
+            changes = self.journal.pop_due(now)
+            if changes:
+                self.apply(changes)
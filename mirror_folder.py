@@ -0,0 +1,253 @@
+"""Keep a local mirror of a portal folder in sync, fetching only what changed.
+
+Usage:
+    python mirror_folder.py <server> <username> <remote folder> <local folder>
+        [--jobs N] [--bwlimit KB/s] [--keep-deleted]
+
+The folder manifest names the files that changed since the previous run;
+those are downloaded --jobs at a time, sharing a --bwlimit budget, and
+checked against their size and SHA-256 digest. Interrupted downloads are
+resumed with a Range request on the next run. Sync state is kept in
+.portal-mirror.json inside the local folder.
+
+The password is read from the PORTAL_PASSWORD environment variable or
+prompted for. Only the standard library is needed on the vessel side.
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import getpass
+import hashlib
+import argparse
+import threading
+import email.utils
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from filemanager.client import PortalClient, PortalError, quote_path
+
+STATE_FILE = '.portal-mirror.json'
+PART_SUFFIX = '.mirror-part'
+CHUNK_SIZE = 64 * 1024
+
+class MirrorError(Exception):
+    pass
+
+class Throttle:
+    """Token bucket shared by all download threads; rate is in bytes per second, 0 for none"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.allowance = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, size):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            # At most one second's worth may be saved up for a burst
+            self.allowance = min(self.rate, self.allowance + (now - self.last) * self.rate)
+            self.last = now
+            self.allowance -= size
+            wait = -self.allowance / self.rate if self.allowance < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+def load_state(local_root, server, remote_root):
+    """Previous sync state, or a fresh one when the mirror pointed somewhere else"""
+    try:
+        with open(os.path.join(local_root, STATE_FILE), encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('server') == server and state.get('root') == remote_root:
+            return state
+    except (OSError, ValueError):
+        pass
+    return {'server': server, 'root': remote_root, 'cursor': None, 'files': {}}
+
+def save_state(local_root, state):
+    path = os.path.join(local_root, STATE_FILE)
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, separators=(',', ':'))
+    os.replace(f'{path}.tmp', path)
+
+def fetch_manifest(client, remote_root, cursor):
+    """Return (header, changes) from the manifest API; changes map path to [size, mtime, digest] or None"""
+    params = {'path': remote_root}
+    if cursor:
+        params['cursor'] = cursor
+    with client.open(f'api/manifest/?{urllib.parse.urlencode(params)}', headers={'Accept-Encoding': 'gzip'}) as response:
+        stream = gzip.GzipFile(fileobj=response) if response.headers.get('Content-Encoding') == 'gzip' else response
+        header = None
+        changes = {}
+        for line in stream:
+            record = json.loads(line)
+            if header is None:
+                header = record
+            elif record.get('end'):
+                return header, changes
+            elif record.get('deleted'):
+                changes[record['path']] = None
+            else:
+                changes[record['path']] = [record['size'], record['mtime'], record['digest']]
+    raise MirrorError('Manifest ended early; the connection was probably cut')
+
+def local_path_for(local_root, remote_root, path):
+    rel_path = path[len(remote_root):].lstrip('/') if remote_root else path
+    # Manifest paths come from the server, but never let one point outside the mirror
+    parts = [part for part in rel_path.split('/') if part not in ('', '.', '..')]
+    return os.path.join(local_root, *parts)
+
+def is_current(local_path, known, entry):
+    """True when the local copy already is the version the manifest describes"""
+    if known is None or known[0] != entry[0] or known[1] != entry[1]:
+        return False
+    if entry[2] and known[2] and known[2] != entry[2]:
+        return False
+    try:
+        return os.path.getsize(local_path) == entry[0]
+    except OSError:
+        return False
+
+def download(client, path, local_path, entry, throttle):
+    """Fetch one file into place, resuming a partial download of the same version"""
+    size, mtime, expected = entry
+    # The part file is tied to a version, so a newer one never resumes onto older bytes
+    part_path = f'{local_path}.{size:x}-{int(mtime):x}{PART_SUFFIX}'
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+
+    digest = hashlib.sha256()
+    offset = 0
+    if os.path.exists(part_path):
+        with open(part_path, 'rb') as f:
+            for data in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(data)
+                offset += len(data)
+        if offset > size:
+            digest, offset = hashlib.sha256(), 0
+
+    headers = {}
+    if 0 < offset < size:
+        headers['Range'] = f'bytes={offset}-'
+        headers['If-Range'] = email.utils.formatdate(int(mtime), usegmt=True)
+
+    if offset < size or size == 0:
+        with client.open(f'download/{quote_path(path)}/', headers=headers) as response:
+            if response.status != 206:
+                # Changed since the manifest or no partial download: start over
+                digest, offset = hashlib.sha256(), 0
+            with open(part_path, 'ab' if offset else 'wb') as out:
+                while True:
+                    data = response.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    throttle.consume(len(data))
+                    digest.update(data)
+                    out.write(data)
+                    offset += len(data)
+
+    if offset != size or (expected and digest.hexdigest() != expected):
+        os.remove(part_path)
+        raise MirrorError(f'{path} changed during the transfer; it will be fetched again next run')
+
+    os.replace(part_path, local_path)
+    os.utime(local_path, (mtime, mtime))
+    return [size, mtime, digest.hexdigest()]
+
+def remove_local(local_root, local_path):
+    try:
+        os.remove(local_path)
+    except FileNotFoundError:
+        pass
+    # Prune folders left empty, but never the mirror root itself
+    folder = os.path.dirname(local_path)
+    while os.path.abspath(folder) != os.path.abspath(local_root):
+        try:
+            os.rmdir(folder)
+        except OSError:
+            break
+        folder = os.path.dirname(folder)
+
+def mirror(client, remote_root, local_root, jobs=4, bwlimit=0, keep_deleted=False):
+    remote_root = remote_root.strip('/')
+    os.makedirs(local_root, exist_ok=True)
+    state = load_state(local_root, client.server, remote_root)
+    known = state['files']
+
+    header, changes = fetch_manifest(client, remote_root, state['cursor'])
+    if header['full']:
+        # Without a cursor the listing is complete: anything not in it is gone
+        for path in known:
+            changes.setdefault(path, None)
+
+    wanted = {}
+    removed = []
+    for path, entry in changes.items():
+        if entry is None:
+            if path in known:
+                removed.append(path)
+        elif is_current(local_path_for(local_root, remote_root, path), known.get(path), entry):
+            # Only the digest was new
+            known[path] = entry[:2] + [entry[2] or known[path][2]]
+        else:
+            wanted[path] = entry
+
+    total = sum(entry[0] for entry in wanted.values())
+    print(f"{len(wanted)} files to fetch ({total} bytes), {len(removed)} removed on the server")
+
+    throttle = Throttle(bwlimit * 1024)
+    failed = 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = {
+            executor.submit(download, client, path, local_path_for(local_root, remote_root, path), entry, throttle): path
+            for path, entry in sorted(wanted.items())
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                known[path] = future.result()
+            except (PortalError, MirrorError, OSError) as e:
+                failed += 1
+                print(f"Could not fetch {path}: {e}")
+
+    for path in removed:
+        del known[path]
+        if not keep_deleted:
+            remove_local(local_root, local_path_for(local_root, remote_root, path))
+
+    # Keeping the old cursor after a failure makes the next run list those files again
+    if not failed:
+        state['cursor'] = header['cursor']
+    save_state(local_root, state)
+
+    elapsed = time.monotonic() - started
+    print(f"Fetched {len(wanted) - failed} files in {elapsed:.1f}s, {failed} failed; "
+          f"mirror holds {len(known)} of {header['files']} files")
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description='Mirror a portal folder to a local folder')
+    parser.add_argument('server')
+    parser.add_argument('username')
+    parser.add_argument('remote_folder')
+    parser.add_argument('local_folder')
+    parser.add_argument('--jobs', type=int, default=4, help='Parallel downloads')
+    parser.add_argument('--bwlimit', type=int, default=0, help='Bandwidth cap for all downloads together, in KB/s')
+    parser.add_argument('--keep-deleted', action='store_true', help='Keep local copies of files removed on the server')
+    args = parser.parse_args()
+
+    password = os.environ.get('PORTAL_PASSWORD') or getpass.getpass()
+    try:
+        client = PortalClient(args.server, args.username, password)
+        failed = mirror(client, args.remote_folder, args.local_folder, args.jobs, args.bwlimit, args.keep_deleted)
+    except (PortalError, MirrorError, IOError) as e:
+        print(f"Mirror failed: {e}")
+        sys.exit(1)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
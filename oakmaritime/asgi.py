@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'oakmaritime.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+# Same as get_asgi_application(), but streamed responses are not buffered
+from filemanager.aio import StreamingASGIHandler
+
+application = StreamingASGIHandler()
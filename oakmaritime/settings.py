@@ -22,6 +22,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'filemanager.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -94,12 +95,159 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_REDIRECT_URL = '/dashboard/'
 LOGOUT_REDIRECT_URL = '/'
 
-FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024 * 1024  # 10GB
-DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024 * 1024  # 10GB
+# Form uploads are streamed to disk and hashed as they arrive rather than
+# buffered in memory; see filemanager.uploads.HashingUploadHandler
+FILE_UPLOAD_HANDLERS = ['filemanager.uploads.HashingUploadHandler']
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2 * 1024 * 1024  # 2MB
+# Limits non-file request data (form fields, JSON bodies)
+DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 
 # File storage settings
 FILE_STORAGE_ROOT = config('FILE_STORAGE_ROOT', default=BASE_DIR / 'vessel_files')
 
+# Chunked uploads are assembled here, and form uploads streamed here, before being moved into FILE_STORAGE_ROOT.
+# Keep it on the same volume so the final move is a rename.
+UPLOAD_STAGING_ROOT = config('UPLOAD_STAGING_ROOT', default=BASE_DIR / 'upload_staging')
+UPLOAD_CHUNK_SIZE = config('UPLOAD_CHUNK_SIZE', default=8 * 1024 * 1024, cast=int)  # 8MB
+
+# Seconds a process may reuse compiled folder permissions. Changes made in
+# the same process invalidate immediately through signals.
+PERMISSION_CACHE_TIMEOUT = config('PERMISSION_CACHE_TIMEOUT', default=60, cast=int)
+
+# Directory listings are paginated so huge folders load incrementally
+LISTING_PAGE_SIZE = config('LISTING_PAGE_SIZE', default=200, cast=int)
+LISTING_MAX_PAGE_SIZE = 1000
+
+# Levels returned by one admin folder tree request (deeper levels load lazily)
+FOLDER_TREE_DEPTH = 2
+FOLDER_TREE_MAX_DEPTH = 5
+
+# File activity is queued and written in batches by a background thread.
+# With a spool directory, queued records are journaled to disk first so a
+# crash does not lose them; they are replayed on the next start.
+ACTIVITY_LOG_ASYNC = config('ACTIVITY_LOG_ASYNC', default=True, cast=bool)
+ACTIVITY_LOG_BATCH_SIZE = 200
+ACTIVITY_LOG_FLUSH_INTERVAL = 2.0  # seconds
+ACTIVITY_LOG_SPOOL_DIR = config('ACTIVITY_LOG_SPOOL_DIR', default=None)
+# Individual activity rows are kept this long; the rollup_activity command
+# folds older ones into daily per-user totals (ActivityRollup)
+ACTIVITY_RETENTION_DAYS = config('ACTIVITY_RETENTION_DAYS', default=90, cast=int)
+
+# Optional content-addressed storage: uploads are stored once per SHA-256
+# digest and hardlinked into FILE_STORAGE_ROOT, so the store must be on the
+# same volume.
+DEDUP_STORAGE_ENABLED = config('DEDUP_STORAGE_ENABLED', default=False, cast=bool)
+CONTENT_STORE_ROOT = config('CONTENT_STORE_ROOT', default=BASE_DIR / 'content_store')
+
+# Block-signature delta sync. Signatures are cached per file until its
+# size or mtime changes.
+DELTA_BLOCK_SIZE = 64 * 1024
+DELTA_MIN_BLOCK_SIZE = 4 * 1024
+DELTA_MAX_BLOCK_SIZE = 4 * 1024 * 1024
+DELTA_MAX_BLOCKS_PER_REQUEST = 1024
+DELTA_CACHE_ROOT = config('DELTA_CACHE_ROOT', default=BASE_DIR / 'cache' / 'delta')
+
+# Image previews. Thumbnails fill the grid view, medium previews are shown
+# instead of sending the original; both are cached on disk, oldest first out.
+PREVIEW_CACHE_ROOT = config('PREVIEW_CACHE_ROOT', default=BASE_DIR / 'cache' / 'previews')
+PREVIEW_CACHE_MAX_BYTES = config('PREVIEW_CACHE_MAX_BYTES', default=1024 * 1024 * 1024, cast=int)
+PREVIEW_WORKERS = config('PREVIEW_WORKERS', default=2, cast=int)
+PREVIEW_THUMB_SIZE = 256
+PREVIEW_MEDIUM_SIZE = 1280
+PREVIEW_QUALITY = 80
+PREVIEW_TIMEOUT = 30
+
+# Download compression, negotiated on Accept-Encoding for text-like files.
+# zstd and brotli are used when the zstandard / brotli packages are
+# installed. precompress_files keeps compressed copies of popular files.
+COMPRESSION_ENABLED = config('COMPRESSION_ENABLED', default=True, cast=bool)
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSION_ZSTD_LEVEL = 6
+COMPRESSION_CACHE_ROOT = config('COMPRESSION_CACHE_ROOT', default=BASE_DIR / 'cache' / 'compressed')
+PRECOMPRESS_MIN_SIZE = config('PRECOMPRESS_MIN_SIZE', default=1024 * 1024, cast=int)
+
+# How downloads are sent:
+#   'wsgi'      - FileResponse through the WSGI server's wsgi.file_wrapper
+#   'xsendfile' - X-Sendfile header for Apache with mod_xsendfile
+#   'xaccel'    - X-Accel-Redirect for nginx; DOWNLOAD_ACCEL_LOCATION must be an
+#                 internal location aliased to FILE_STORAGE_ROOT
+DOWNLOAD_BACKEND = config('DOWNLOAD_BACKEND', default='wsgi')
+DOWNLOAD_ACCEL_LOCATION = config('DOWNLOAD_ACCEL_LOCATION', default='/protected-files/')
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024
+
+# Threads used for blocking file I/O by the async views, and under ASGI for
+# reading streamed responses
+ASYNC_IO_THREADS = config('ASYNC_IO_THREADS', default=32, cast=int)
+
+# Live progress of chunked uploads is counted in this cache and written to
+# UploadSession at most every UPLOAD_PROGRESS_FLUSH_INTERVAL seconds. With more
+# than one server process, point it at a shared backend (Redis, Memcached or
+# the database cache) so every process sees the same counters.
+UPLOAD_PROGRESS_CACHE = config('UPLOAD_PROGRESS_CACHE', default='default')
+UPLOAD_PROGRESS_FLUSH_INTERVAL = config('UPLOAD_PROGRESS_FLUSH_INTERVAL', default=5, cast=int)
+# Seconds between progress events, and how long one event stream stays open
+# before the browser reconnects. Events are only streamed under ASGI; under
+# waitress the browser counts finished chunks instead.
+UPLOAD_PROGRESS_EVENT_INTERVAL = config('UPLOAD_PROGRESS_EVENT_INTERVAL', default=1, cast=float)
+UPLOAD_PROGRESS_STREAM_TIMEOUT = config('UPLOAD_PROGRESS_STREAM_TIMEOUT', default=300, cast=int)
+
+# Full-text index of document contents (SQLite FTS5, in its own file). Built
+# and refreshed by the update_content_index command; files uploaded or
+# deleted through the portal are updated in the background right away.
+CONTENT_INDEX_ENABLED = config('CONTENT_INDEX_ENABLED', default=True, cast=bool)
+CONTENT_INDEX_PATH = config('CONTENT_INDEX_PATH', default=BASE_DIR / 'content_index.sqlite3')
+CONTENT_INDEX_MAX_FILE_SIZE = config('CONTENT_INDEX_MAX_FILE_SIZE', default=50 * 1024 * 1024, cast=int)  # 50MB
+CONTENT_INDEX_MAX_CHARS = 2 * 1024 * 1024  # text kept per document
+
+# watch_files keeps the indexes and folder stats fresh as files change on
+# disk. Changes are applied once a path has been quiet for WATCHER_DEBOUNCE
+# seconds (WATCHER_MAX_DELAY at the latest). The whole tree is reconciled
+# every WATCHER_RECONCILE_INTERVAL seconds, or every WATCHER_POLL_INTERVAL
+# seconds where inotify is unavailable or out of watches.
+WATCHER_DEBOUNCE = config('WATCHER_DEBOUNCE', default=2.0, cast=float)
+WATCHER_MAX_DELAY = config('WATCHER_MAX_DELAY', default=30.0, cast=float)
+WATCHER_RECONCILE_INTERVAL = config('WATCHER_RECONCILE_INTERVAL', default=6 * 3600, cast=int)
+WATCHER_POLL_INTERVAL = config('WATCHER_POLL_INTERVAL', default=300, cast=int)
+
+# Per-view request metrics, served in the Prometheus text format at /metrics/
+# to staff users, or to a scraper sending "Authorization: Bearer <METRICS_TOKEN>".
+# Requests slower than METRICS_SLOW_REQUEST_SECONDS are printed (0 turns this
+# off). METRICS_PROFILE_SAMPLE_RATE of requests have their stacks sampled, and
+# slow ones among them are written with their profile to METRICS_SLOW_LOG.
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_SLOW_REQUEST_SECONDS = config('METRICS_SLOW_REQUEST_SECONDS', default=2.0, cast=float)
+METRICS_PROFILE_SAMPLE_RATE = config('METRICS_PROFILE_SAMPLE_RATE', default=0.0, cast=float)
+METRICS_PROFILE_INTERVAL = 0.005  # seconds between stack samples
+METRICS_SLOW_LOG = config('METRICS_SLOW_LOG', default=BASE_DIR / 'logs' / 'slow_requests.jsonl')
+
+# Limits for /upload/archive/, which extracts a tar or zip body into a folder.
+# The archive size is what is sent; the total is what it expands to, checked
+# against the bytes actually extracted. Members over INGEST_MAX_FILE_SIZE are
+# skipped and reported rather than failing the whole batch.
+INGEST_MAX_ARCHIVE_SIZE = config('INGEST_MAX_ARCHIVE_SIZE', default=2 * 1024 * 1024 * 1024, cast=int)
+INGEST_MAX_TOTAL_SIZE = config('INGEST_MAX_TOTAL_SIZE', default=4 * 1024 * 1024 * 1024, cast=int)
+INGEST_MAX_FILE_SIZE = config('INGEST_MAX_FILE_SIZE', default=1024 * 1024 * 1024, cast=int)
+INGEST_MAX_FILES = config('INGEST_MAX_FILES', default=50000, cast=int)
+
+# Folder manifests for vessel mirrors (/api/manifest/ and mirror_folder.py).
+# The snapshot behind each sync cursor is kept in MANIFEST_SNAPSHOT_ROOT: the
+# newest MANIFEST_SNAPSHOTS_KEPT per user and folder, for at most
+# MANIFEST_SNAPSHOT_MAX_AGE days since last use. Up to MANIFEST_DIGEST_BUDGET
+# bytes of not yet hashed files are hashed per request; the rest follow on
+# later requests or from `update_file_index --digests`. With the file watcher
+# running, MANIFEST_REFRESH_INDEX can be turned off to skip the rescan.
+MANIFEST_SNAPSHOT_ROOT = config('MANIFEST_SNAPSHOT_ROOT', default=BASE_DIR / 'cache' / 'manifests')
+MANIFEST_SNAPSHOTS_KEPT = config('MANIFEST_SNAPSHOTS_KEPT', default=3, cast=int)
+MANIFEST_SNAPSHOT_MAX_AGE = config('MANIFEST_SNAPSHOT_MAX_AGE', default=30, cast=int)
+MANIFEST_DIGEST_BUDGET = config('MANIFEST_DIGEST_BUDGET', default=256 * 1024 * 1024, cast=int)
+MANIFEST_REFRESH_INDEX = config('MANIFEST_REFRESH_INDEX', default=True, cast=bool)
+
+# Maximum number of hits returned by the indexed filename search
+SEARCH_RESULT_LIMIT = config('SEARCH_RESULT_LIMIT', default=200, cast=int)
+
 SECURE_SSL_REDIRECT = False
 CSRF_COOKIE_SECURE = False
 SESSION_COOKIE_SECURE = False
@@ -0,0 +1,27 @@
+import os
+from decouple import config
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("ASGI mode needs uvicorn: pip install uvicorn")
+    
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'oakmaritime.settings')
+    port = config('PORT', default=80, cast=int)
+    host = config('HOST', default='0.0.0.0')
+    # Each worker is a separate process with its own event loop; one loop holds
+    # thousands of idle or slow connections without a thread apiece
+    workers = config('ASGI_WORKERS', default=1, cast=int)
+    
+    print(f"Starting SNSeaFile (ASGI) on {host}:{port}")
+    print("Press Ctrl+C to stop the server")
+    
+    uvicorn.run(
+        'oakmaritime.asgi:application',
+        host=host,
+        port=port,
+        workers=workers,
+        timeout_keep_alive=config('ASGI_KEEP_ALIVE', default=30, cast=int),
+        lifespan='off',
+    )
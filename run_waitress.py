@@ -6,8 +6,11 @@ from decouple import config
 if __name__ == '__main__':
     port = config('PORT', default=80, cast=int)
     host = config('HOST', default='0.0.0.0')
+    # Downloads are handed to waitress' wsgi.file_wrapper and written out by its
+    # I/O thread, so these threads are only busy while a view is running
+    threads = config('WAITRESS_THREADS', default=8, cast=int)
     
     print(f"Starting SNSeaFile on {host}:{port}")
     print("Press Ctrl+C to stop the server")
     
-    serve(application, host=host, port=port)
\ No newline at end of file
+    serve(application, host=host, port=port, threads=threads)
\ No newline at end of file